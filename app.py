@@ -1,24 +1,191 @@
 import os
+import bisect
+import codecs
 import csv
+import errno
+import io
+import sys
+import functools
 import hashlib
+import math
+import multiprocessing
+import queue
 import sqlite3
+import stat
+import struct
+import tempfile
+import threading
+import zlib
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from io import StringIO
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, g, jsonify,
+                   stream_with_context)
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+import click
 import secrets
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 
-# Reject uploads larger than 5 MB to avoid exhausting memory.
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
+# Without SECRET_KEY, the workers on a host share a random key kept in
+# SECRET_KEY_FILE, in the app's private instance directory by default, so a
+# session cookie signed by one worker is valid in all of them. Sessions
+# still reset when the file is lost (e.g. on redeploy).
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', os.path.join(app.instance_path, 'secret_key'))
+
+
+def _shared_secret_key(path):
+    """Read the key in path, creating it first if needed.
+
+    The file is created exclusively with mode 0600, so concurrent workers all
+    end up with the first key. An existing file is only trusted if it is a
+    regular file (not a symlink) owned by this user that no one else can read
+    or write; anything else raises RuntimeError rather than sign sessions
+    with a key someone else may know or have chosen."""
+    refused = (f'Refusing to use the secret key in {path}: it must be a regular file owned by this user '
+               'with mode 0600. Fix or remove it, or set SECRET_KEY.')
+    nofollow = getattr(os, 'O_NOFOLLOW', 0)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | nofollow, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    # The worker that created the file may not have written the key yet.
+    for _ in range(50):
+        try:
+            fd = os.open(path, os.O_RDONLY | nofollow)
+        except OSError as e:
+            if e.errno == errno.ELOOP:
+                raise RuntimeError(refused)
+            raise
+        with os.fdopen(fd) as f:
+            info = os.fstat(f.fileno())
+            if not stat.S_ISREG(info.st_mode) or (
+                    hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o077)):
+                raise RuntimeError(refused)
+            key = f.read().strip()
+        if key:
+            return key
+        time.sleep(0.1)
+    raise RuntimeError(f'The secret key file {path} is empty. Remove it or set SECRET_KEY.')
+
+
+app.secret_key = os.environ.get('SECRET_KEY') or _shared_secret_key(SECRET_KEY_FILE)
+
+
+def _private_directory(path):
+    """Create path (mode 0700) if needed and return it, or raise
+    RuntimeError if it is a symlink, not owned by this user or writable by
+    anyone else: files another user could plant there would be trusted."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or (
+            hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o022)):
+        raise RuntimeError(f'Refusing to use {path}: it must be a directory owned by this user that no one '
+                           'else can write to.')
+    return path
+
+# Reject uploads larger than MAX_UPLOAD_MB (default 5 MB).
+# Prediction files are parsed as a stream, so this bounds request size, not
+# scoring memory. Configurable via MAX_UPLOAD_MB.
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '5'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Size of each read from an upload stream while it is being parsed.
+UPLOAD_READ_CHUNK = 64 * 1024
+
+# With ASYNC_SCORING=1, uploads are stored as jobs and scored by a local
+# process pool; users poll /submission/<job id>/status for the result.
+ASYNC_SCORING = os.environ.get('ASYNC_SCORING', '').lower() in ('1', 'true', 'yes')
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', str(os.cpu_count() or 1)))
+# A job not finished within SCORING_JOB_LEASE seconds of being queued or
+# started (say its process was restarted) is queued again by a live worker.
+SCORING_JOB_LEASE = float(os.environ.get('SCORING_JOB_LEASE', '600'))
+
+# With GROUP_COMMIT=1, accepted uploads from concurrent requests are written
+# in shared transactions: each process's writer thread commits whatever
+# arrived within GROUP_COMMIT_MS (at most GROUP_COMMIT_MAX_BATCH uploads).
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+GROUP_COMMIT_MS = float(os.environ.get('GROUP_COMMIT_MS', '5'))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '64'))
+
+# Every scored upload is appended to pi_submission_log. Entries older than
+# SUBMISSION_LOG_RETENTION_DAYS (0 = keep forever) are dropped by a background
+# compaction every SUBMISSION_LOG_COMPACT_INTERVAL seconds, except the ones
+# that are still some user's best.
+SUBMISSION_LOG_RETENTION_DAYS = float(os.environ.get('SUBMISSION_LOG_RETENTION_DAYS', '0'))
+SUBMISSION_LOG_COMPACT_INTERVAL = float(os.environ.get('SUBMISSION_LOG_COMPACT_INTERVAL', '3600'))
+
+# Target size of each chunk sent by the streaming CSV / ZIP exports.
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Leaderboard rows shown per page.
+LEADERBOARD_PAGE_SIZE = 100
+# Estimated fraction of their wrong (ID, value) pairs two submissions must
+# share to be flagged as near-copies on the leaderboard. Only pairs at or
+# above it are stored, so re-score the test after changing it.
+NEAR_DUP_THRESHOLD = float(os.environ.get('NEAR_DUP_THRESHOLD', '0.9'))
+# Most submissions one LSH bucket may contribute as near-copy candidates,
+# so a bucket that many submissions fall into can't make indexing quadratic.
+NEAR_DUP_BUCKET_CAP = int(os.environ.get('NEAR_DUP_BUCKET_CAP', '50'))
+
+# Rows per page in the admin dashboard's and test pages' submission lists.
+SUBMISSIONS_PAGE_SIZE = 50
+
+# Columns the list/detail pages need from pi_tests. Everything except the
+# ground truth file, which can be several MB per test.
+TEST_SUMMARY_COLUMNS = 'id, name, description, start_date, end_date, metric'
+
+# Rendered page cache: in-process by default, or a directory shared by all
+# workers on the host when PAGE_CACHE_DIR is set.
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+PAGE_CACHE_ENTRIES = int(os.environ.get('PAGE_CACHE_ENTRIES', '512'))
+
+# Upper bound on the memory each process spends caching parsed ground truth.
+GROUND_TRUTH_CACHE_BYTES = int(os.environ.get('GROUND_TRUTH_CACHE_MB', '64')) * 1024 * 1024
+# Where compiled (binary, memory-mapped) ground truth files are kept. Files are
+# named by content hash and rebuilt from the database when missing, so any
+# local directory private to the app's user works; every worker on the host
+# shares the mapped pages.
+GROUND_TRUTH_DIR = os.environ.get('GROUND_TRUTH_DIR', os.path.join(app.instance_path, 'ground-truth'))
+
+# Admission control for uploads. Each user and each test has a token bucket
+# refilled at SUBMIT_RATE_PER_USER / SUBMIT_RATE_PER_TEST uploads per minute
+# (0 = unlimited), shared by every worker through the database. On each host
+# at most SCORING_CONCURRENCY uploads are parsed and scored at once; up to
+# SCORING_QUEUE more wait for a slot for SCORING_QUEUE_TIMEOUT seconds, and
+# the rest are turned away with 429. ADMISSION_CONTROL=0 switches all of it off.
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1').lower() not in ('0', 'false', 'no')
+SUBMIT_RATE_PER_USER = float(os.environ.get('SUBMIT_RATE_PER_USER', '10'))
+SUBMIT_RATE_PER_TEST = float(os.environ.get('SUBMIT_RATE_PER_TEST', '600'))
+SCORING_CONCURRENCY = int(os.environ.get('SCORING_CONCURRENCY', str(os.cpu_count() or 1)))
+SCORING_QUEUE = int(os.environ.get('SCORING_QUEUE', str(4 * SCORING_CONCURRENCY)))
+SCORING_QUEUE_TIMEOUT = float(os.environ.get('SCORING_QUEUE_TIMEOUT', '15'))
+# Slot lock files for SCORING_CONCURRENCY; must be local to the host and, like
+# GROUND_TRUTH_DIR, private to the app's user.
+ADMISSION_DIR = os.environ.get('ADMISSION_DIR', os.path.join(app.instance_path, 'admission'))
+
+# Database statements slower than this are logged and counted.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+# Lets a Prometheus scraper read /metrics with "Authorization: Bearer <token>"
+# instead of an admin session.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 # Admin credentials - read from the environment in production, with the
-# previous values kept as a local-development fallback.
+# previous values kept as a local-development fallback. ADMIN_PASSWORD_HASH
+# (from `flask --app app hash-password`) takes precedence over ADMIN_PASSWORD
+# and spares each process the deliberately slow hashing at startup.
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'isaac3instein')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', '12zaci')
-ADMIN_HASH = generate_password_hash(ADMIN_PASSWORD)
+ADMIN_HASH = os.environ.get('ADMIN_PASSWORD_HASH') or generate_password_hash(ADMIN_PASSWORD)
 
 # Database configuration - use PostgreSQL if DATABASE_URL exists, else SQLite
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -31,24 +198,335 @@ if USE_POSTGRES:
     try:
         import psycopg2
         import psycopg2.extras
+        import psycopg2.pool
     except ImportError:
         print("WARNING: psycopg2 not available, falling back to SQLite")
         USE_POSTGRES = False
 
+# Connection pooling. PostgreSQL connections come from a bounded per-process
+# pool; SQLite keeps one long-lived, WAL-mode connection per thread.
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'predict_it.db')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Arbitrary constant naming the PostgreSQL advisory lock held while migrating.
+MIGRATION_LOCK_ID = 7_340_001
+
+# NumPy is optional: with it, scoring runs as vectorized array operations;
+# without it, the pure-Python implementation is used.
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+# Stored submission files and ground truth are compressed: with zstandard
+# when it is installed, otherwise with zlib. STORAGE_CODEC=zlib pins zlib,
+# e.g. while some hosts still lack zstandard (they could not read zstd rows).
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    zstandard = None
+    HAS_ZSTD = False
+STORAGE_CODEC = os.environ.get('STORAGE_CODEC') or ('zstd' if HAS_ZSTD else 'zlib')
+if STORAGE_CODEC == 'zstd' and not HAS_ZSTD:
+    print("WARNING: STORAGE_CODEC=zstd but zstandard is not installed, using zlib")
+    STORAGE_CODEC = 'zlib'
+
+# The host-wide scoring slots use flock(), which Windows lacks; there only
+# the token buckets apply.
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    fcntl = None
+    HAS_FCNTL = False
+
 if not USE_POSTGRES:
     print("WARNING: DATABASE_URL is not set - using local SQLite. On ephemeral "
           "hosts (e.g. Render's free tier) the database file is wiped on every "
           "restart, so all users, tests, and submissions will be LOST. Set "
           "DATABASE_URL to a PostgreSQL database for persistent storage.")
 
+
+# --- Metrics ---
+#
+# In-process counters and histograms, served in the Prometheus text format at
+# /metrics. Like the other per-process stats, each worker keeps its own, so
+# scrape every worker (or run one) for complete numbers.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """A small thread-safe registry of labelled counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._declared = {}    # name -> (type, help, buckets)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts, sum]
+
+    def counter(self, name, help_text):
+        self._declared[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._declared[name] = ('histogram', help_text, buckets)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._declared[name][2]
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(buckets, value)] += 1
+            entry[1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self, gauges=()):
+        """The registry (plus any (name, help, value) gauges) in the
+        Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._declared.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        for name, help_text, value in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+metrics = Metrics()
+metrics.histogram('predictit_request_duration_seconds', 'Time to handle a request, by endpoint and method.')
+metrics.counter('predictit_requests_total', 'Requests handled, by endpoint, method and status.')
+SUBMIT_STAGE = 'predictit_submit_stage_seconds'
+metrics.histogram(SUBMIT_STAGE, 'Time spent in each stage of handling an upload.')
+metrics.counter('predictit_submissions_total', 'Scored uploads, by outcome (accepted, kept, rejected).')
+metrics.histogram('predictit_group_commit_batch_size', 'Uploads written per GROUP_COMMIT transaction.',
+                  buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+metrics.counter('predictit_score_cache_total', 'Score cache lookups for uploads, by result (hit, miss).')
+metrics.counter('predictit_admission_total',
+                'Upload admission decisions (admitted, throttled, busy).')
+metrics.histogram('predictit_db_query_seconds', 'Database statement time, by statement type.')
+metrics.counter('predictit_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS, by statement type.')
+
+
+@app.before_request
+def _start_request_timer():
+    g._request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('_request_started', None)
+    if started is not None:
+        # Unmatched URLs share one label so scanners can't grow the registry.
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('predictit_request_duration_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method)
+        metrics.inc('predictit_requests_total', endpoint=endpoint, method=request.method,
+                    status=response.status_code)
+    return response
+
+
+def _observe_query(query, seconds):
+    """Time a statement and log it if it was slow."""
+    statement = query.split(None, 1)[0].upper() if query.strip() else ''
+    metrics.observe('predictit_db_query_seconds', seconds, statement=statement)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        metrics.inc('predictit_db_slow_queries_total', statement=statement)
+        app.logger.warning('Slow query (%.0f ms): %s', seconds * 1000, ' '.join(query.split())[:500])
+
+class PostgresPool:
+    """Bounded pool of psycopg2 connections shared by the threads of one
+    process. Callers block for up to DB_POOL_TIMEOUT seconds when every
+    connection is checked out, instead of failing straight away."""
+
+    def __init__(self, dsn, minconn, maxconn, timeout):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise RuntimeError('Timed out waiting for a database connection.')
+        try:
+            conn = self._pool.getconn()
+            if conn.closed:
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def putconn(self, conn):
+        # Never hand a connection with an open (possibly failed) transaction
+        # to the next request; drop it instead if it can't be reset.
+        close = bool(conn.closed)
+        if not close:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        self._pool.putconn(conn, close=close)
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'postgresql', 'max': self.maxconn, 'in_use': self.in_use,
+                    'checkouts': self.checkouts, 'waits': self.waits, 'timeouts': self.timeouts}
+
+
+class SQLitePool:
+    """One persistent SQLite connection per thread, tuned for concurrent use:
+    WAL journaling so readers don't block on the writer, synchronous=NORMAL,
+    and a busy timeout instead of immediate 'database is locked' errors."""
+
+    def __init__(self, path, busy_timeout_ms):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.opened = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def getconn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def putconn(self, conn):
+        # The connection stays open for the thread's next request; just make
+        # sure no transaction is left hanging.
+        conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+
+    def close(self):
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'sqlite', 'path': self.path, 'in_use': self.in_use,
+                    'checkouts': self.checkouts, 'connections_opened': self.opened}
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Return this process's connection pool, creating it on first use (and
+    again after a fork, since pooled sockets must not be shared)."""
+    global _db_pool, _db_pool_pid
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool_pid != os.getpid():
+            if USE_POSTGRES:
+                _db_pool = PostgresPool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT)
+            else:
+                _db_pool = SQLitePool(SQLITE_PATH, SQLITE_BUSY_TIMEOUT_MS)
+            _db_pool_pid = os.getpid()
+        return _db_pool
+
+
+def close_db_pool():
+    """Close this process's pool, e.g. in a preloading server's master
+    before it forks workers, so no connection is inherited by them."""
+    global _db_pool, _db_pool_pid
+    with _db_pool_lock:
+        if _db_pool is not None and _db_pool_pid == os.getpid():
+            _db_pool.close()
+        _db_pool = _db_pool_pid = None
+
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        if USE_POSTGRES:
-            db = g._database = psycopg2.connect(DATABASE_URL)
-        else:
-            db = g._database = sqlite3.connect('predict_it.db')
-            db.row_factory = sqlite3.Row
+        db = g._database = get_db_pool().getconn()
     return db
 
 class DBWrapper:
@@ -58,36 +536,136 @@ class DBWrapper:
         self.is_postgres = USE_POSTGRES
     
     def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            if self.is_postgres:
+                # Convert ? to %s for PostgreSQL
+                pg_query = query.replace('?', '%s')
+                cursor = self.db.cursor()
+                cursor.execute(pg_query, params)
+                return PGResult(cursor)
+            else:
+                return self.db.execute(query, params)
+        finally:
+            _observe_query(query, time.perf_counter() - started)
+    
+    def iterate(self, query, params=(), batch_size=500):
+        """Yield the rows of a query without materializing the result set:
+        a named server-side cursor on PostgreSQL, fetchmany() batches on
+        SQLite. Consume it fully (or close it) within the request."""
         if self.is_postgres:
-            # Convert ? to %s for PostgreSQL
-            pg_query = query.replace('?', '%s')
-            cursor = self.db.cursor()
-            cursor.execute(pg_query, params)
-            return PGResult(cursor)
+            cursor = self.db.cursor(name=f'pi_stream_{secrets.token_hex(8)}')
+            cursor.itersize = batch_size
+            started = time.perf_counter()
+            cursor.execute(query.replace('?', '%s'), params)
+            _observe_query(query, time.perf_counter() - started)
+            result = PGResult(cursor, batch_size)
         else:
-            return self.db.execute(query, params)
-    
+            result = self.execute(query, params)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            result.close()
+
     def commit(self):
         self.db.commit()
 
+    def rollback(self):
+        self.db.rollback()
+
+
+class PGRow:
+    """A PostgreSQL result row that reads like sqlite3.Row: by column name or
+    position. Rows of one result share a single name -> position dict, so
+    each row costs only its value tuple."""
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return list(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        # Values, as sqlite3.Row yields them; keys() has the names.
+        return iter(self._values)
+
+    def __repr__(self):
+        return f'PGRow({dict(zip(self._index, self._values))!r})'
+
+
 class PGResult:
-    """Wrapper to make PostgreSQL cursor results dict-accessible like SQLite Row"""
-    def __init__(self, cursor):
+    """Wrapper to make PostgreSQL cursor results row-accessible like SQLite.
+
+    Rows are PGRow objects sharing one column index, built once per result.
+    Iterating fetches fetchmany() batches; on a client-side cursor psycopg2
+    has already received the whole result, so use DBWrapper.iterate (a named
+    server-side cursor) when the result itself is large.
+    """
+
+    def __init__(self, cursor, batch_size=500):
         self.cursor = cursor
-    
+        self.batch_size = batch_size
+        self._index = None
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def _schema(self):
+        # Named cursors only have a description after the first fetch.
+        if self._index is None and self.cursor.description:
+            self._index = {desc[0]: i for i, desc in enumerate(self.cursor.description)}
+        return self._index
+
     def fetchone(self):
         row = self.cursor.fetchone()
-        if row and self.cursor.description:
-            cols = [desc[0] for desc in self.cursor.description]
-            return dict(zip(cols, row))
-        return None
-    
+        if row is None or not self._schema():
+            return None
+        return PGRow(row, self._index)
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size or self.batch_size)
+        if not rows or not self._schema():
+            return []
+        index = self._index
+        return [PGRow(row, index) for row in rows]
+
     def fetchall(self):
         rows = self.cursor.fetchall()
-        if rows and self.cursor.description:
-            cols = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(cols, row)) for row in rows]
-        return []
+        if not rows or not self._schema():
+            return []
+        index = self._index
+        return [PGRow(row, index) for row in rows]
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self.cursor.close()
+
 
 def get_db_wrapper():
     """Get database connection wrapped for compatibility"""
@@ -95,101 +673,558 @@ def get_db_wrapper():
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        get_db_pool().putconn(db)
+
+# --- Schema migrations ---
+#
+# The schema is versioned in pi_schema_version. Each entry in MIGRATIONS is
+# (version, description, function) and runs exactly once, in its own
+# transaction, under a lock so concurrent deploys can't apply it twice. To
+# change the schema, append a new step; never edit one that has shipped.
+# Migrations run at deploy time (`flask --app app migrate`), not per request.
+
+def _serial_pk():
+    return 'SERIAL PRIMARY KEY' if USE_POSTGRES else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+
+def _column_names(db, table):
+    if USE_POSTGRES:
+        rows = db.execute('SELECT column_name FROM information_schema.columns '
+                          'WHERE table_schema = current_schema() AND table_name = ?', (table,)).fetchall()
+        return {row['column_name'] for row in rows}
+    return {row[1] for row in db.execute(f'PRAGMA table_info({table})').fetchall()}
+
+
+def _add_missing_columns(db, table, columns):
+    """Add (name, definition) columns that an older database lacks."""
+    existing = _column_names(db, table)
+    for name, definition in columns:
+        if name not in existing:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+def _migration_initial_schema(db):
+    """Base tables. Idempotent, so it also adopts databases created by the
+    old per-process init_db() before schema versioning existed."""
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_users (
+            id {_serial_pk()},
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT NOT NULL
+        )
+    ''')
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_tests (
+            id {_serial_pk()},
+            name TEXT NOT NULL,
+            description TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            metric TEXT,
+            ground_truth TEXT,
+            ground_truth_version INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_submissions (
+            id {_serial_pk()},
+            test_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            score REAL NOT NULL,
+            filename TEXT,
+            filesize INTEGER,
+            content TEXT,
+            content_hash TEXT,
+            FOREIGN KEY (test_id) REFERENCES pi_tests (id)
+        )
+    ''')
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_jobs (
+            id {_serial_pk()},
+            test_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            created TEXT NOT NULL,
+            finished TEXT,
+            status TEXT NOT NULL,
+            filename TEXT,
+            filesize INTEGER,
+            content TEXT,
+            score REAL,
+            error TEXT,
+            message TEXT
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pi_blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            content TEXT NOT NULL
+        )
+    ''')
+    # Add columns to databases created before they existed.
+    _add_missing_columns(db, 'pi_submissions', [('filesize', 'INTEGER'), ('content', 'TEXT'),
+                                                 ('content_hash', 'TEXT')])
+    _add_missing_columns(db, 'pi_tests', [('ground_truth_version', 'INTEGER NOT NULL DEFAULT 1')])
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submissions_content_hash ON pi_submissions (content_hash)')
+    _move_content_to_blobs(db)
+
+
+def _migration_hot_path_indexes(db):
+    """Index the (test_id, username) and (test_id, score) lookups and make
+    (test_id, username) unique so the best-per-user write is one upsert."""
+    # Older code could leave several rows per user; keep only each user's best.
+    dup_pairs = db.execute('SELECT test_id, username FROM pi_submissions '
+                           'GROUP BY test_id, username HAVING COUNT(*) > 1').fetchall()
+    for pair in dup_pairs:
+        rows = db.execute('SELECT s.id, s.score, s.content_hash, t.metric FROM pi_submissions s '
+                          'LEFT JOIN pi_tests t ON t.id = s.test_id '
+                          'WHERE s.test_id = ? AND s.username = ? ORDER BY s.id',
+                          (pair['test_id'], pair['username'])).fetchall()
+        best = rows[0]
+        for row in rows[1:]:
+            if _is_better_score(row['score'], best['score'], row['metric']):
+                best = row
+        losers = [row for row in rows if row['id'] != best['id']]
+        for row in losers:
+            db.execute('DELETE FROM pi_submissions WHERE id = ?', (row['id'],))
+        _release_blobs(db, [row['content_hash'] for row in losers], logged=False)
+
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_pi_submissions_test_user '
+               'ON pi_submissions (test_id, username)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submissions_test_score '
+               'ON pi_submissions (test_id, score)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_jobs_test_user ON pi_jobs (test_id, username)')
+
+
+def _migration_timestamp_index(db):
+    """Support keyset pagination of submissions by (timestamp, id)."""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submissions_timestamp ON pi_submissions (timestamp, id)')
+
+
+def _migration_cache_generations(db):
+    """Generation counters that key the rendered page cache."""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pi_cache_generations (
+            scope TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        )
+    ''')
+
+
+def _migration_near_duplicate_index(db):
+    """MinHash signatures per submission, the LSH band buckets that index
+    them, and the candidate near-duplicate pairs found through the buckets."""
+    _add_missing_columns(db, 'pi_submissions', [('minhash', 'TEXT')])
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pi_lsh_buckets (
+            test_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            submission_id INTEGER NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_lsh_buckets_bucket ON pi_lsh_buckets (test_id, bucket)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_lsh_buckets_submission ON pi_lsh_buckets (submission_id)')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pi_near_duplicates (
+            test_id INTEGER NOT NULL,
+            a INTEGER NOT NULL,
+            b INTEGER NOT NULL,
+            similarity REAL NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_near_duplicates_test ON pi_near_duplicates (test_id, similarity)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_near_duplicates_a ON pi_near_duplicates (a)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_near_duplicates_b ON pi_near_duplicates (b)')
+
+
+def _binary_type():
+    return 'BYTEA' if USE_POSTGRES else 'BLOB'
+
+
+def _migration_compress_storage(db):
+    """Store submission files and ground truth compressed (see _compress),
+    converting existing rows in batches so memory stays flat."""
+    _add_missing_columns(db, 'pi_blobs', [('codec', 'TEXT'), ('data', _binary_type())])
+    _add_missing_columns(db, 'pi_tests', [('ground_truth_codec', 'TEXT'),
+                                          ('ground_truth_data', _binary_type()),
+                                          ('ground_truth_size', 'INTEGER')])
+    while True:
+        rows = db.execute('SELECT hash, content FROM pi_blobs WHERE codec IS NULL LIMIT 100').fetchall()
+        if not rows:
+            break
+        for row in rows:
+            codec, data = _compress(row['content'])
+            # content keeps its NOT NULL constraint; compressed rows leave it empty.
+            db.execute("UPDATE pi_blobs SET codec = ?, data = ?, content = '' WHERE hash = ?",
+                       (codec, data, row['hash']))
+    while True:
+        rows = db.execute('SELECT id, ground_truth FROM pi_tests WHERE ground_truth IS NOT NULL '
+                          'AND ground_truth_codec IS NULL LIMIT 10').fetchall()
+        if not rows:
+            break
+        for row in rows:
+            codec, data = _compress(row['ground_truth'])
+            size = len(row['ground_truth'].encode('utf-8'))
+            db.execute('UPDATE pi_tests SET ground_truth_codec = ?, ground_truth_data = ?, ground_truth_size = ?, '
+                       'ground_truth = NULL WHERE id = ?', (codec, data, size, row['id']))
+
+
+def _migration_ground_truth_hash(db):
+    """Record each test's ground truth SHA-256, which names its compiled
+    artifact in GROUND_TRUTH_DIR."""
+    _add_missing_columns(db, 'pi_tests', [('ground_truth_hash', 'TEXT')])
+    for row in db.execute('SELECT id FROM pi_tests WHERE ground_truth_hash IS NULL').fetchall():
+        text = _load_ground_truth_text(db, row['id'])
+        if text:
+            db.execute('UPDATE pi_tests SET ground_truth_hash = ? WHERE id = ?',
+                       (hashlib.sha256(text.encode('utf-8')).hexdigest(), row['id']))
+
+
+def _migration_score_cache(db):
+    """Scores of already-seen files, keyed by the ground truth and metric
+    they were computed against (see _cached_score)."""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pi_score_cache (
+            test_id INTEGER NOT NULL,
+            ground_truth_hash TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            score REAL,
+            error TEXT,
+            minhash TEXT,
+            PRIMARY KEY (test_id, ground_truth_hash, metric, content_hash)
+        )
+    ''')
 
-def init_db():
-    with app.app_context():
-        db = get_db()
-        if USE_POSTGRES:
-            cursor = db.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS pi_users (
-                    id SERIAL PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    email TEXT NOT NULL
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS pi_tests (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    start_date TEXT,
-                    end_date TEXT,
-                    metric TEXT,
-                    ground_truth TEXT
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS pi_submissions (
-                    id SERIAL PRIMARY KEY,
-                    test_id INTEGER NOT NULL,
-                    username TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    score REAL NOT NULL,
-                    filename TEXT,
-                    filesize INTEGER,
-                    content TEXT,
-                    FOREIGN KEY (test_id) REFERENCES pi_tests (id)
-                )
-            ''')
-            # Add columns to databases created before they existed.
-            cursor.execute('ALTER TABLE pi_submissions ADD COLUMN IF NOT EXISTS filesize INTEGER')
-            cursor.execute('ALTER TABLE pi_submissions ADD COLUMN IF NOT EXISTS content TEXT')
-            db.commit()
-        else:
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS pi_users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    email TEXT NOT NULL
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS pi_tests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    start_date TEXT,
-                    end_date TEXT,
-                    metric TEXT,
-                    ground_truth TEXT
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS pi_submissions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    test_id INTEGER NOT NULL,
-                    username TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    score REAL NOT NULL,
-                    filename TEXT,
-                    filesize INTEGER,
-                    content TEXT,
-                    FOREIGN KEY (test_id) REFERENCES pi_tests (id)
-                )
-            ''')
-            # Add columns to databases created before they existed.
-            existing_cols = [row[1] for row in db.execute('PRAGMA table_info(pi_submissions)').fetchall()]
-            if 'filesize' not in existing_cols:
-                db.execute('ALTER TABLE pi_submissions ADD COLUMN filesize INTEGER')
-            if 'content' not in existing_cols:
-                db.execute('ALTER TABLE pi_submissions ADD COLUMN content TEXT')
-            db.commit()
 
-_db_initialized = False
+def _migration_rate_limits(db):
+    """Token buckets for upload admission control (see _take_submit_tokens)."""
+    real = 'DOUBLE PRECISION' if USE_POSTGRES else 'REAL'
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_rate_limits (
+            bucket TEXT PRIMARY KEY,
+            tokens {real} NOT NULL,
+            updated {real} NOT NULL
+        )
+    ''')
+
+
+def _migration_submission_log(db):
+    """Append-only history of every scored upload. Each best-submission row
+    points at its entry through log_id; existing rows are logged as they are."""
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_submission_log (
+            id {_serial_pk()},
+            test_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            score REAL NOT NULL,
+            filename TEXT,
+            filesize INTEGER,
+            content_hash TEXT NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submission_log_test_user '
+               'ON pi_submission_log (test_id, username)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submission_log_timestamp ON pi_submission_log (timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submission_log_hash ON pi_submission_log (content_hash)')
+    _add_missing_columns(db, 'pi_submissions', [('log_id', 'INTEGER')])
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submissions_log_id ON pi_submissions (log_id)')
+    db.execute('INSERT INTO pi_submission_log (test_id, username, timestamp, score, filename, filesize, content_hash) '
+               'SELECT test_id, username, timestamp, score, filename, filesize, content_hash FROM pi_submissions '
+               'WHERE log_id IS NULL AND content_hash IS NOT NULL')
+    db.execute('UPDATE pi_submissions SET log_id = (SELECT MAX(l.id) FROM pi_submission_log l '
+               'WHERE l.test_id = pi_submissions.test_id AND l.username = pi_submissions.username) '
+               'WHERE log_id IS NULL AND content_hash IS NOT NULL')
+
+
+def _migration_job_blobs(db):
+    """Scoring jobs reference their upload in pi_blobs instead of carrying
+    its text, and hold a lease so that jobs orphaned by a restart are picked
+    up again (see requeue_stale_jobs)."""
+    real = 'DOUBLE PRECISION' if USE_POSTGRES else 'REAL'
+    _add_missing_columns(db, 'pi_jobs', [('content_hash', 'TEXT'), ('lease_expires', real)])
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_jobs_content_hash ON pi_jobs (content_hash)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_jobs_lease ON pi_jobs (status, lease_expires)')
+    # Failed jobs could still hold their text; nothing reads it.
+    db.execute("UPDATE pi_jobs SET content = NULL WHERE status NOT IN ('queued', 'running')")
+    while True:
+        row = db.execute('SELECT id, content FROM pi_jobs WHERE content IS NOT NULL LIMIT 1').fetchone()
+        if not row:
+            break
+        raw = row['content'].encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        _store_blob(db, digest, len(raw), lambda: io.BytesIO(raw))
+        db.execute('UPDATE pi_jobs SET content_hash = ?, content = NULL WHERE id = ?', (digest, row['id']))
+    # Unfinished jobs from before leases existed are due straight away.
+    db.execute("UPDATE pi_jobs SET lease_expires = 0 WHERE status IN ('queued', 'running')")
+
+
+def _migration_user_history_index(db):
+    """Support keyset pagination of a user's history on a test page by
+    (timestamp, id). The new index also covers (test_id, username) lookups."""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_submission_log_user_history '
+               'ON pi_submission_log (test_id, username, timestamp, id)')
+    db.execute('DROP INDEX IF EXISTS idx_pi_submission_log_test_user')
+
+
+def _migration_rescore_runs(db):
+    """Progress of background re-scores started from the leaderboard."""
+    real = 'DOUBLE PRECISION' if USE_POSTGRES else 'REAL'
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS pi_rescore_runs (
+            id {_serial_pk()},
+            test_id INTEGER NOT NULL,
+            started TEXT NOT NULL,
+            finished TEXT,
+            status TEXT NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            heartbeat {real},
+            message TEXT
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_pi_rescore_runs_test ON pi_rescore_runs (test_id, id)')
+
+
+def _migration_residual_signatures(db):
+    """Signatures now sketch only the values a prediction gets wrong. Drop
+    the old ones, and the pairs found with them, rather than mix the two:
+    re-scoring a test rebuilds its index."""
+    db.execute('DELETE FROM pi_near_duplicates')
+    db.execute('DELETE FROM pi_lsh_buckets')
+    db.execute('UPDATE pi_submissions SET minhash = NULL WHERE minhash IS NOT NULL')
+    # Cached results carry a signature too; identical uploads are re-scored.
+    db.execute('DELETE FROM pi_score_cache')
+
+
+MIGRATIONS = [
+    (1, 'initial schema', _migration_initial_schema),
+    (2, 'hot path indexes and unique (test_id, username)', _migration_hot_path_indexes),
+    (3, 'submission timestamp index for pagination', _migration_timestamp_index),
+    (4, 'page cache generation counters', _migration_cache_generations),
+    (5, 'near-duplicate MinHash/LSH index', _migration_near_duplicate_index),
+    (6, 'compressed file and ground truth storage', _migration_compress_storage),
+    (7, 'ground truth content hash', _migration_ground_truth_hash),
+    (8, 'score cache for identical uploads', _migration_score_cache),
+    (9, 'upload rate limit buckets', _migration_rate_limits),
+    (10, 'append-only submission log', _migration_submission_log),
+    (11, 'scoring jobs reference stored files and hold a lease', _migration_job_blobs),
+    (12, 'submission log index for per-user history', _migration_user_history_index),
+    (13, 're-score run progress', _migration_rescore_runs),
+    (14, 'near-duplicate signatures of wrong predictions only', _migration_residual_signatures),
+]
+
+
+def _lock_schema(db):
+    """Start a transaction that holds the migration lock until commit."""
+    if USE_POSTGRES:
+        db.execute('SELECT pg_advisory_xact_lock(?)', (MIGRATION_LOCK_ID,))
+    else:
+        db.execute('BEGIN IMMEDIATE')
 
-@app.before_request
-def before_first_request():
-    """Initialize the database once, on the first request."""
-    global _db_initialized
-    if not _db_initialized:
-        init_db()
-        _db_initialized = True
+
+def migrate_db():
+    """Apply every pending migration and return the ones that were applied.
+    Safe to run from several processes at once."""
+    applied = []
+    with app.app_context():
+        db = get_db_wrapper()
+        # Under the lock too: concurrent CREATE TABLE IF NOT EXISTS can still
+        # collide on PostgreSQL.
+        _lock_schema(db)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS pi_schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        db.commit()
+        for version, description, step in MIGRATIONS:
+            _lock_schema(db)
+            row = db.execute('SELECT MAX(version) AS version FROM pi_schema_version').fetchone()
+            if (row['version'] or 0) >= version:
+                db.commit()
+                continue
+            step(db)
+            db.execute('INSERT INTO pi_schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                       (version, description, datetime.now().isoformat()))
+            db.commit()
+            applied.append((version, description))
+    return applied
+
+
+@app.cli.command('hash-password')
+@click.password_option()
+def hash_password_command(password):
+    """Print a hash for the ADMIN_PASSWORD_HASH environment variable."""
+    click.echo(generate_password_hash(password))
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Bring the database schema up to date."""
+    applied = migrate_db()
+    for version, description in applied:
+        click.echo(f'Applied migration {version}: {description}')
+    if not applied:
+        click.echo('Database schema is up to date.')
+
+
+def _move_content_to_blobs(db):
+    """Move submission files stored inline (before content-addressed storage)
+    into pi_blobs, one row at a time so memory stays flat. The caller commits."""
+    while True:
+        row = db.execute('SELECT id, content FROM pi_submissions '
+                         'WHERE content IS NOT NULL AND content_hash IS NULL LIMIT 1').fetchone()
+        if not row:
+            break
+        raw = row['content'].encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        # Stored uncompressed: this runs in the first migration, before the
+        # codec columns exist. A later migration compresses it.
+        db.execute('INSERT INTO pi_blobs (hash, size, content) VALUES (?, ?, ?) '
+                   'ON CONFLICT (hash) DO NOTHING', (digest, len(raw), row['content']))
+        db.execute('UPDATE pi_submissions SET content_hash = ?, content = NULL WHERE id = ?',
+                   (digest, row['id']))
+
+
+def _store_blob(db, digest, size, open_content):
+    """Store file content under its SHA-256 digest unless an identical file
+    is already stored. open_content returns the file as a binary stream and
+    is only called for new content, which is compressed as it is read."""
+    if db.execute('SELECT 1 FROM pi_blobs WHERE hash = ?', (digest,)).fetchone():
+        return
+    codec, data = _compress_stream(open_content(), size)
+    db.execute("INSERT INTO pi_blobs (hash, size, content, codec, data) VALUES (?, ?, '', ?, ?) "
+               'ON CONFLICT (hash) DO NOTHING', (digest, size, codec, data))
+
+
+def _release_blobs(db, digests, logged=True):
+    """Delete the given blobs if no submission, submission log entry or
+    unfinished scoring job references them any more, and return how many were
+    deleted. Migrations that run before the log and the job references exist
+    pass logged=False."""
+    log_check = (' AND NOT EXISTS (SELECT 1 FROM pi_submission_log WHERE content_hash = ?)'
+                 " AND NOT EXISTS (SELECT 1 FROM pi_jobs WHERE content_hash = ? AND status IN ('queued', 'running'))"
+                 if logged else '')
+    released = 0
+    for digest in set(digests):
+        if digest:
+            released += db.execute('DELETE FROM pi_blobs WHERE hash = ? AND NOT EXISTS '
+                                   f'(SELECT 1 FROM pi_submissions WHERE content_hash = ?){log_check}',
+                                   (digest,) * (4 if logged else 2)).rowcount
+    return released
+
+
+def _load_content(db, submission):
+    """Return the stored file text for a submission row, or None."""
+    if submission['content_hash']:
+        blob = db.execute('SELECT codec, data, content FROM pi_blobs WHERE hash = ?',
+                          (submission['content_hash'],)).fetchone()
+        if blob:
+            return _blob_text(blob)
+    return submission['content']
+
+
+def _compress(text):
+    """Encode text for storage with STORAGE_CODEC; returns (codec, data).
+    Files too small to gain anything are kept as plain UTF-8 bytes."""
+    raw = text.encode('utf-8')
+    if STORAGE_CODEC == 'zstd':
+        data = zstandard.ZstdCompressor(level=9).compress(raw)
+    else:
+        data = zlib.compress(raw, 6)
+    if len(data) >= len(raw):
+        return 'none', raw
+    return STORAGE_CODEC, data
+
+
+def _compress_stream(stream, size):
+    """_compress for a binary stream of size bytes, read and compressed
+    UPLOAD_READ_CHUNK bytes at a time so the uncompressed file is never held
+    in memory. Returns (codec, data)."""
+    if STORAGE_CODEC == 'zstd':
+        # The size goes in the frame header, which ZstdDecompressor.decompress needs.
+        compressor = zstandard.ZstdCompressor(level=9).compressobj(size=size)
+    else:
+        compressor = zlib.compressobj(6)
+    parts = []
+    while True:
+        chunk = stream.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            break
+        parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    data = b''.join(parts)
+    if len(data) >= size:
+        stream.seek(0)
+        return 'none', stream.read()
+    return STORAGE_CODEC, data
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        if not HAS_ZSTD:
+            raise RuntimeError('This file is stored zstd-compressed; install zstandard to read it.')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    if codec == 'none':
+        return bytes(data).decode('utf-8')
+    raise ValueError(f'Unknown storage codec {codec!r}')
+
+
+def _blob_text(row):
+    """The file text of a pi_blobs row (codec, data, content)."""
+    if row['codec']:
+        return _decompress(row['codec'], row['data'])
+    return row['content']
+
+
+def _load_ground_truth_text(db, test_id):
+    """Return a test's ground truth CSV text, or None if it has none."""
+    row = db.execute('SELECT ground_truth, ground_truth_codec, ground_truth_data FROM pi_tests WHERE id = ?',
+                     (test_id,)).fetchone()
+    if not row:
+        return None
+    if row['ground_truth_codec']:
+        return _decompress(row['ground_truth_codec'], row['ground_truth_data'])
+    return row['ground_truth']
+
+
+def _storage_stats(db):
+    """Raw vs stored bytes of submission files and ground truth."""
+    blobs = db.execute('SELECT COUNT(*) AS files, SUM(size) AS raw, '
+                       'SUM(CASE WHEN codec IS NULL THEN LENGTH(content) ELSE LENGTH(data) END) AS stored '
+                       'FROM pi_blobs').fetchone()
+    truth = db.execute('SELECT COUNT(*) AS files, SUM(ground_truth_size) AS raw, '
+                       'SUM(LENGTH(ground_truth_data)) AS stored FROM pi_tests '
+                       'WHERE ground_truth_codec IS NOT NULL').fetchone()
+    stats = {'codec': STORAGE_CODEC}
+    for name, row in (('submission_files', blobs), ('ground_truth', truth)):
+        raw, stored = row['raw'] or 0, row['stored'] or 0
+        stats[name] = {'files': row['files'], 'raw_bytes': raw, 'stored_bytes': stored,
+                       'saved': round(1 - stored / raw, 3) if raw else 0.0}
+    return stats
+
+
+@app.cli.command('storage-report')
+def storage_report_command():
+    """Show how much space compression saves."""
+    with app.app_context():
+        stats = _storage_stats(get_db_wrapper())
+    click.echo(f"New files are compressed with {stats['codec']}.")
+    for name in ('submission_files', 'ground_truth'):
+        row = stats[name]
+        click.echo(f"{name.replace('_', ' ').capitalize()}: {row['files']} files, "
+                   f"{format_filesize(row['raw_bytes'])} -> {format_filesize(row['stored_bytes'])} "
+                   f"({row['saved']:.0%} saved)")
 
 def format_filesize(num_bytes):
     """Render a byte count as a short human-readable string for templates."""
@@ -209,13 +1244,290 @@ app.jinja_env.filters['filesize'] = format_filesize
 
 @app.errorhandler(413)
 def file_too_large(error):
-    flash('File too large. The maximum upload size is 5 MB.')
+    flash(f'File too large. The maximum upload size is {MAX_UPLOAD_MB} MB.')
     return redirect(request.referrer or url_for('index'))
 
+# --- Rendered page cache ---
+#
+# index, test_detail and leaderboard are cached as rendered HTML. Each page
+# is keyed by the generation counters of the data it shows (stored in
+# pi_cache_generations, so every worker sees the same values) plus who is
+# looking at it. Write routes bump the affected generations in the same
+# transaction as their change, which makes every older cached copy
+# unreachable. The key's hash doubles as the ETag, so an unchanged page is
+# answered with 304 Not Modified without touching the store.
+
+class PageCache:
+    """In-process LRU of rendered pages, keyed by ETag."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            page = self._entries.get(etag)
+            if page is not None:
+                self._entries.move_to_end(etag)
+            return page
+
+    def put(self, etag, page):
+        with self._lock:
+            self._entries[etag] = page
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskPageCache:
+    """Page cache in a directory shared by every worker on the host. Files
+    are written atomically; the oldest are pruned once there are too many."""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, etag):
+        try:
+            with open(os.path.join(self.directory, etag), 'rb') as f:
+                mimetype = f.readline().decode('ascii').strip()
+                return mimetype, f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, etag, page):
+        mimetype, body = page
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(mimetype.encode('ascii') + b'\n')
+            f.write(body)
+        os.replace(tmp_path, os.path.join(self.directory, etag))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.startswith('.'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if not name.startswith('.'))
+
+
+if PAGE_CACHE_DIR:
+    page_cache = DiskPageCache(PAGE_CACHE_DIR, PAGE_CACHE_ENTRIES)
+else:
+    page_cache = PageCache(PAGE_CACHE_ENTRIES)
+page_cache_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0}
+_page_cache_stats_lock = threading.Lock()
+
+
+def _count_page(outcome):
+    # Worker threads serve pages concurrently; += on a shared dict is not atomic.
+    with _page_cache_stats_lock:
+        page_cache_stats[outcome] += 1
+
+
+def _page_cache_stats():
+    with _page_cache_stats_lock:
+        stats = dict(page_cache_stats)
+    stats['entries'] = len(page_cache)
+    return stats
+
+
+def bump_generations(db, *scopes):
+    """Invalidate every cached page that depends on the given scopes ('tests'
+    for the list of tests, 'test:<id>' for one test and its submissions).
+    Call before committing the write that changes them."""
+    for scope in scopes:
+        db.execute('INSERT INTO pi_cache_generations (scope, generation) VALUES (?, 1) '
+                   'ON CONFLICT (scope) DO UPDATE SET generation = pi_cache_generations.generation + 1',
+                   (scope,))
+
+
+def _current_generations(db, scopes):
+    placeholders = ', '.join('?' for _ in scopes)
+    rows = db.execute(f'SELECT scope, generation FROM pi_cache_generations WHERE scope IN ({placeholders})',
+                      tuple(scopes)).fetchall()
+    found = {row['scope']: row['generation'] for row in rows}
+    return [found.get(scope, 0) for scope in scopes]
+
+
+def cached_page(scopes):
+    """Serve a GET view from the page cache, with ETag / 304 support.
+
+    scopes(view_kwargs) returns the generation scopes the page depends on.
+    Pages carrying a flash message, or whose view touched the session, are
+    never cached.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if '_flashes' in session:
+                _count_page('bypassed')
+                return view(**kwargs)
+
+            page_scopes = scopes(kwargs)
+            generations = _current_generations(get_db_wrapper(), page_scopes)
+            key = '\x1f'.join(map(str, [
+                request.endpoint, sorted(kwargs.items()), request.query_string.decode('latin-1'),
+                session.get('username'), session.get('is_admin'), page_scopes, generations]))
+            etag = hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+            if etag in request.if_none_match:
+                _count_page('not_modified')
+                response = app.response_class(status=304)
+            else:
+                page = page_cache.get(etag)
+                if page is not None:
+                    _count_page('hits')
+                    response = app.response_class(page[1], mimetype=page[0])
+                else:
+                    _count_page('misses')
+                    response = app.make_response(view(**kwargs))
+                    if response.status_code != 200 or session.modified:
+                        return response
+                    page_cache.put(etag, (response.mimetype, response.get_data()))
+            response.set_etag(etag)
+            # Browsers must revalidate every time; the 304 makes that cheap.
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+# --- Admission control ---
+#
+# Guards submit_prediction so a few scripted users can't tie up every worker
+# with parse-and-score cycles. Token buckets (per user and per test) live in
+# pi_rate_limits so all workers and hosts share them; each take is a single
+# conditional UPDATE, which the database serializes. The concurrency cap is
+# per host: ScoringSlots hands out flock()ed files in ADMISSION_DIR, which the
+# kernel releases if a worker dies mid-request.
+
+def _take_submit_tokens(db, username, test_id):
+    """Take one upload token from the user's and the test's buckets, or from
+    neither. Returns 0 if admitted, else the seconds until a token is due."""
+    now = time.time()
+    retry_after = 0.0
+    refilled = 'tokens + (? - updated) * ?'
+    for bucket, per_minute in ((f'user:{username}', SUBMIT_RATE_PER_USER),
+                               (f'test:{test_id}', SUBMIT_RATE_PER_TEST)):
+        if per_minute <= 0:
+            continue
+        # Burst capacity is one minute's worth of uploads.
+        rate, capacity = per_minute / 60.0, max(per_minute, 1.0)
+        db.execute('INSERT INTO pi_rate_limits (bucket, tokens, updated) VALUES (?, ?, ?) '
+                   'ON CONFLICT (bucket) DO NOTHING', (bucket, capacity, now))
+        taken = db.execute(
+            f'UPDATE pi_rate_limits SET tokens = CASE WHEN {refilled} > ? THEN ? ELSE {refilled} END - 1, '
+            f'updated = ? WHERE bucket = ? AND {refilled} >= 1',
+            (now, rate, capacity, capacity, now, rate, now, bucket, now, rate)).rowcount
+        if not taken:
+            row = db.execute('SELECT tokens, updated FROM pi_rate_limits WHERE bucket = ?', (bucket,)).fetchone()
+            available = min(capacity, row['tokens'] + (now - row['updated']) * rate)
+            retry_after = max(retry_after, (1 - available) / rate)
+    if retry_after:
+        db.rollback()
+    else:
+        db.commit()
+    return retry_after
+
+
+class ScoringSlots:
+    """Host-wide cap on concurrent scoring, shared by every worker process.
+
+    A request first locks one of `queue` waiting-room files (none free means
+    the queue is full), then polls the `limit` slot files until one is free
+    or `timeout` passes.
+    """
+
+    POLL_SECONDS = 0.05
+
+    def __init__(self, directory, limit, queue, timeout):
+        self.directory = directory
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+
+    def _try_lock(self, prefix, count):
+        """Lock any free file among prefix-0 .. prefix-(count - 1), starting
+        from a random one; returns the open file or None."""
+        # Anyone who could create these files could hold every slot.
+        _private_directory(self.directory)
+        start = secrets.randbelow(count)
+        for i in range(count):
+            f = open(os.path.join(self.directory, f'{prefix}-{(start + i) % count}'), 'a+')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                f.close()
+        return None
+
+    @contextmanager
+    def acquire(self):
+        """Yields True while holding a scoring slot, or False if the host is
+        over capacity."""
+        if not HAS_FCNTL or self.limit <= 0:
+            yield True
+            return
+        slot = self._try_lock('slot', self.limit)
+        if slot is None and self.queue > 0:
+            place = self._try_lock('queue', self.queue)
+            if place is not None:
+                try:
+                    deadline = time.monotonic() + self.timeout
+                    while slot is None and time.monotonic() < deadline:
+                        time.sleep(self.POLL_SECONDS)
+                        slot = self._try_lock('slot', self.limit)
+                finally:
+                    place.close()
+        if slot is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            slot.close()
+
+
+scoring_slots = ScoringSlots(ADMISSION_DIR, SCORING_CONCURRENCY if ADMISSION_CONTROL else 0,
+                             SCORING_QUEUE, SCORING_QUEUE_TIMEOUT)
+
+
+def _busy_response(test_id, retry_after, reason):
+    """429 page for an upload turned away by admission control."""
+    retry_after = max(1, math.ceil(retry_after))
+    response = app.make_response((render_template('busy.html', test_id=test_id, reason=reason,
+                                                  retry_after=retry_after), 429))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @app.route('/')
+@cached_page(lambda kwargs: ['tests'])
 def index():
     db = get_db_wrapper()
-    tests = db.execute('SELECT * FROM pi_tests ORDER BY id DESC').fetchall()
+    tests = db.execute(f'SELECT {TEST_SUMMARY_COLUMNS} FROM pi_tests ORDER BY id DESC').fetchall()
     return render_template('index.html', tests=tests)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -277,9 +1589,95 @@ def admin_dashboard():
         return redirect(url_for('login'))
     
     db = get_db_wrapper()
-    tests = db.execute('SELECT * FROM pi_tests ORDER BY id DESC').fetchall()
-    submissions = db.execute('SELECT * FROM pi_submissions ORDER BY timestamp DESC').fetchall()
-    return render_template('admin.html', tests=tests, submissions=submissions)
+    tests = db.execute(f'SELECT {TEST_SUMMARY_COLUMNS} FROM pi_tests ORDER BY id DESC').fetchall()
+
+    # Per-test counts and best score, aggregated in SQL rather than by
+    # loading every submission into the page.
+    stats = {}
+    for row in db.execute('SELECT test_id, COUNT(*) AS submissions, COUNT(DISTINCT username) AS users, '
+                          'MIN(score) AS min_score, MAX(score) AS max_score '
+                          'FROM pi_submissions GROUP BY test_id').fetchall():
+        stats[row['test_id']] = row
+    test_stats = {}
+    for test in tests:
+        row = stats.get(test['id'])
+        if row:
+            best = row['min_score'] if _lower_is_better(test['metric']) else row['max_score']
+            test_stats[test['id']] = {'submissions': row['submissions'], 'users': row['users'],
+                                      'best_score': best}
+
+    before = _parse_keyset_cursor(request.args.get('before'))
+    submissions, next_cursor = _recent_submissions(db, '1 = 1', (), before)
+    test_names = {test['id']: test['name'] for test in tests}
+    return render_template('admin.html', tests=tests, test_stats=test_stats,
+                           submissions=submissions, test_names=test_names,
+                           next_cursor=next_cursor, paged=before is not None,
+                           scoring_metrics=SCORING_METRICS.values())
+
+def _parse_keyset_cursor(value):
+    """Decode a 'timestamp|id' pagination cursor; None if absent or invalid."""
+    if not value or '|' not in value:
+        return None
+    timestamp, _, row_id = value.rpartition('|')
+    try:
+        return timestamp, int(row_id)
+    except ValueError:
+        return None
+
+
+def _recent_submissions(db, where, params, before=None, limit=None, table='pi_submissions'):
+    """Keyset-paginated submissions matching a WHERE clause, newest first:
+    best submissions, or with table='pi_submission_log' every logged upload.
+
+    before is the (timestamp, id) of the last row already shown. Returns the
+    rows (without file content) and the cursor for the next page, or None
+    when this is the last page. Seeking past the cursor keeps every page as
+    cheap as the first, unlike OFFSET."""
+    limit = limit or SUBMISSIONS_PAGE_SIZE
+    query = ('SELECT id, test_id, username, timestamp, score, filename, filesize, content_hash '
+             f'FROM {table} WHERE {where}')
+    params = tuple(params)
+    if before:
+        query += ' AND (timestamp < ? OR (timestamp = ? AND id < ?))'
+        params += (before[0], before[0], before[1])
+    query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+    rows = db.execute(query, params + (limit + 1,)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['timestamp']}|{rows[-1]['id']}"
+    return rows, next_cursor
+
+@app.route('/admin/stats')
+def admin_stats():
+    """Per-process cache and connection pool counters, so admins can check
+    they are working."""
+    if not session.get('is_admin'):
+        flash('Admin access required')
+        return redirect(url_for('login'))
+
+    return jsonify({'pid': os.getpid(), 'ground_truth_cache': ground_truth_cache.stats(),
+                    'db_pool': get_db_pool().stats(),
+                    'page_cache': _page_cache_stats(),
+                    'storage': _storage_stats(get_db_wrapper())})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint: request, upload-stage and query timings
+    plus the /admin/stats counters, for this process."""
+    authorized = session.get('is_admin') or (
+        METRICS_TOKEN and secrets.compare_digest(request.headers.get('Authorization', ''),
+                                                 f'Bearer {METRICS_TOKEN}'))
+    if not authorized:
+        return 'Admin access required\n', 403, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    sections = {'ground_truth_cache': ground_truth_cache.stats(), 'db_pool': get_db_pool().stats(),
+                'page_cache': _page_cache_stats()}
+    gauges = [(f'predictit_{section}_{key}', f'{section} {key} (see /admin/stats).', value)
+              for section, stats in sections.items() for key, value in sorted(stats.items())
+              if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return app.response_class(metrics.render(gauges),
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/admin/create_test', methods=['POST'])
 def create_test():
@@ -291,6 +1689,9 @@ def create_test():
     start_date = request.form['start_date']
     end_date = request.form['end_date']
     metric = request.form['metric']
+    if metric not in SCORING_METRICS:
+        flash(f"Unknown metric '{metric}'.")
+        return redirect(url_for('admin_dashboard'))
     ground_truth = None
     
     # Handle ground truth file upload
@@ -299,10 +1700,24 @@ def create_test():
         if file and file.filename.endswith('.csv'):
             ground_truth = file.read().decode('utf-8')
     
+    error = _ground_truth_kind_error(metric, ground_truth)
+    if error:
+        flash(error)
+        return redirect(url_for('admin_dashboard'))
+
+    codec = data = size = digest = None
+    if ground_truth is not None:
+        codec, data = _compress(ground_truth)
+        size = len(ground_truth.encode('utf-8'))
+        digest = hashlib.sha256(ground_truth.encode('utf-8')).hexdigest()
     db = get_db_wrapper()
-    db.execute('INSERT INTO pi_tests (name, description, start_date, end_date, metric, ground_truth) VALUES (?, ?, ?, ?, ?, ?)',
-               (name, description, start_date, end_date, metric, ground_truth))
+    db.execute('INSERT INTO pi_tests (name, description, start_date, end_date, metric, ground_truth_codec, '
+               'ground_truth_data, ground_truth_size, ground_truth_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+               (name, description, start_date, end_date, metric, codec, data, size, digest))
+    bump_generations(db, 'tests')
     db.commit()
+    if ground_truth is not None:
+        _compile_ground_truth_quietly(ground_truth, digest)
     
     flash('Test created successfully!')
     return redirect(url_for('admin_dashboard'))
@@ -313,11 +1728,24 @@ def delete_test(test_id):
         return redirect(url_for('login'))
     
     db = get_db_wrapper()
+    digests = [row['content_hash'] for row in db.execute(
+        'SELECT content_hash FROM pi_submissions WHERE test_id = ? '
+        'UNION SELECT content_hash FROM pi_submission_log WHERE test_id = ?', (test_id, test_id)).fetchall()]
+    test = db.execute('SELECT ground_truth_hash FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
     # Delete submissions first (foreign key constraint)
+    _unindex_signatures(db, test_id)
+    _clear_score_cache(db, test_id)
     db.execute('DELETE FROM pi_submissions WHERE test_id = ?', (test_id,))
+    db.execute('DELETE FROM pi_submission_log WHERE test_id = ?', (test_id,))
+    db.execute('DELETE FROM pi_rescore_runs WHERE test_id = ?', (test_id,))
     # Delete the test
     db.execute('DELETE FROM pi_tests WHERE id = ?', (test_id,))
+    _release_blobs(db, digests)
+    bump_generations(db, 'tests', f'test:{test_id}')
     db.commit()
+    ground_truth_cache.invalidate(test_id)
+    if test:
+        _remove_compiled_ground_truth(db, test['ground_truth_hash'])
     
     flash('Test deleted successfully!')
     return '', 200
@@ -330,6 +1758,17 @@ def delete_submission(submission_id):
     db = get_db_wrapper()
     submission = db.execute('SELECT * FROM pi_submissions WHERE id = ?', (submission_id,)).fetchone()
     db.execute('DELETE FROM pi_submissions WHERE id = ?', (submission_id,))
+    if submission:
+        test_id, username = submission['test_id'], submission['username']
+        # The user's history for the test goes too, or its files would be
+        # kept until compaction (forever, by default).
+        digests = [submission['content_hash']] + [row['content_hash'] for row in db.execute(
+            'SELECT content_hash FROM pi_submission_log WHERE test_id = ? AND username = ?',
+            (test_id, username)).fetchall()]
+        db.execute('DELETE FROM pi_submission_log WHERE test_id = ? AND username = ?', (test_id, username))
+        _unindex_signatures(db, test_id, submission_id)
+        _release_blobs(db, digests)
+        bump_generations(db, f'test:{test_id}', f'history:{test_id}:{username}')
     db.commit()
 
     flash('Submission deleted successfully!')
@@ -343,7 +1782,16 @@ def delete_all_submissions(test_id):
         return redirect(url_for('login'))
 
     db = get_db_wrapper()
+    # Every user's history for the test goes too, as in delete_submission.
+    rows = db.execute('SELECT username, content_hash FROM pi_submissions WHERE test_id = ? '
+                      'UNION SELECT username, content_hash FROM pi_submission_log WHERE test_id = ?',
+                      (test_id, test_id)).fetchall()
     db.execute('DELETE FROM pi_submissions WHERE test_id = ?', (test_id,))
+    db.execute('DELETE FROM pi_submission_log WHERE test_id = ?', (test_id,))
+    _unindex_signatures(db, test_id)
+    _release_blobs(db, [row['content_hash'] for row in rows])
+    bump_generations(db, f'test:{test_id}',
+                     *sorted({f"history:{test_id}:{row['username']}" for row in rows}))
     db.commit()
 
     flash('All submissions for this test were deleted.')
@@ -362,6 +1810,10 @@ def edit_test(test_id):
         start_date = request.form['start_date']
         end_date = request.form['end_date']
         metric = request.form['metric']
+        if metric not in SCORING_METRICS:
+            flash(f"Unknown metric '{metric}'.")
+            return redirect(url_for('edit_test', test_id=test_id))
+        previous = db.execute('SELECT metric, ground_truth_hash FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
         
         # Handle ground truth file upload (optional on edit)
         ground_truth = None
@@ -369,43 +1821,88 @@ def edit_test(test_id):
             file = request.files['ground_truth']
             if file and file.filename.endswith('.csv'):
                 ground_truth = file.read().decode('utf-8')
-                # Update with new ground truth
-                db.execute('UPDATE pi_tests SET name = ?, description = ?, start_date = ?, end_date = ?, metric = ?, ground_truth = ? WHERE id = ?',
-                           (name, description, start_date, end_date, metric, ground_truth, test_id))
-            else:
-                # Update without changing ground truth
-                db.execute('UPDATE pi_tests SET name = ?, description = ?, start_date = ?, end_date = ?, metric = ? WHERE id = ?',
-                           (name, description, start_date, end_date, metric, test_id))
+
+        # The targets must suit the metric, whichever of the two is changing.
+        if ground_truth is not None or (previous and previous['metric'] != metric):
+            error = _ground_truth_kind_error(
+                metric, ground_truth if ground_truth is not None else _load_ground_truth_text(db, test_id))
+            if error:
+                flash(error)
+                return redirect(url_for('edit_test', test_id=test_id))
+
+        if ground_truth is not None:
+            codec, data = _compress(ground_truth)
+            digest = hashlib.sha256(ground_truth.encode('utf-8')).hexdigest()
+            # Update with new ground truth. Bumping the version makes every
+            # worker's cached copy of the old file unreachable.
+            db.execute('UPDATE pi_tests SET name = ?, description = ?, start_date = ?, end_date = ?, metric = ?, '
+                       'ground_truth = NULL, ground_truth_codec = ?, ground_truth_data = ?, ground_truth_size = ?, '
+                       'ground_truth_hash = ?, ground_truth_version = ground_truth_version + 1 WHERE id = ?',
+                       (name, description, start_date, end_date, metric, codec, data,
+                        len(ground_truth.encode('utf-8')), digest, test_id))
+            ground_truth_cache.invalidate(test_id)
         else:
             # Update without changing ground truth
             db.execute('UPDATE pi_tests SET name = ?, description = ?, start_date = ?, end_date = ?, metric = ? WHERE id = ?',
                        (name, description, start_date, end_date, metric, test_id))
         
+        if ground_truth is not None or (previous and previous['metric'] != metric):
+            _clear_score_cache(db, test_id)
+        bump_generations(db, 'tests', f'test:{test_id}')
         db.commit()
+        if ground_truth is not None:
+            _compile_ground_truth_quietly(ground_truth, digest)
+            if previous:
+                _remove_compiled_ground_truth(db, previous['ground_truth_hash'])
         flash('Test updated successfully!')
+        if ground_truth is not None or (previous and previous['metric'] != metric):
+            flash('Existing scores were computed against the old ground truth or metric. '
+                  'Use "Re-score All" on the leaderboard to update them.')
         return redirect(url_for('admin_dashboard'))
     
     # GET request - show edit form
-    test = db.execute('SELECT * FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    test = db.execute(f'SELECT {TEST_SUMMARY_COLUMNS} FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
     if not test:
         flash('Test not found')
         return redirect(url_for('admin_dashboard'))
     
-    return render_template('edit_test.html', test=test)
+    return render_template('edit_test.html', test=test, scoring_metrics=SCORING_METRICS.values())
 
 @app.route('/test/<int:test_id>')
+@cached_page(lambda kwargs: [f"test:{kwargs['test_id']}", f"history:{kwargs['test_id']}:{session.get('username')}"])
 def test_detail(test_id):
     db = get_db_wrapper()
-    test = db.execute('SELECT * FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    test = db.execute(f'SELECT {TEST_SUMMARY_COLUMNS} FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
     
     if not test:
         flash('Test not found')
         return redirect(url_for('index'))
+
+    participants = db.execute('SELECT COUNT(*) AS n FROM pi_submissions WHERE test_id = ?',
+                              (test_id,)).fetchone()['n']
+
+    # Only the signed-in user's own uploads are shown, newest first, from
+    # their submission history; best_log_id marks the one that counts.
+    test_submissions, next_cursor, best_log_id = [], None, None
+    before = _parse_keyset_cursor(request.args.get('before'))
+    if 'username' in session:
+        test_submissions, next_cursor = _recent_submissions(
+            db, 'test_id = ? AND username = ?', (test_id, session['username']), before,
+            table='pi_submission_log')
+        best = db.execute('SELECT log_id FROM pi_submissions WHERE test_id = ? AND username = ?',
+                          (test_id, session['username'])).fetchone()
+        best_log_id = best['log_id'] if best else None
+
+    # Recent ASYNC_SCORING jobs for this user, so pending uploads are visible.
+    jobs = []
+    if 'username' in session:
+        jobs = db.execute('SELECT id, created, status, filename, message FROM pi_jobs '
+                          'WHERE test_id = ? AND username = ? ORDER BY id DESC LIMIT 5',
+                          (test_id, session['username'])).fetchall()
     
-    test_submissions = db.execute('SELECT * FROM pi_submissions WHERE test_id = ? ORDER BY timestamp DESC',
-                                   (test_id,)).fetchall()
-    
-    return render_template('test.html', test=test, submissions=test_submissions)
+    return render_template('test.html', test=test, submissions=test_submissions, jobs=jobs,
+                           participants=participants, next_cursor=next_cursor,
+                           paged=before is not None, best_log_id=best_log_id)
 
 @app.route('/test/<int:test_id>/submit', methods=['POST'])
 def submit_prediction(test_id):
@@ -414,72 +1911,918 @@ def submit_prediction(test_id):
         return redirect(url_for('login'))
     
     db = get_db_wrapper()
-    test = db.execute('SELECT * FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    # Leave the ground truth text out: it is only needed on a cache miss.
+    test = db.execute('SELECT id, metric, ground_truth_version, ground_truth_hash FROM pi_tests WHERE id = ?',
+                      (test_id,)).fetchone()
     
     if not test:
         flash('Test not found')
         return redirect(url_for('index'))
+
+    # Throttle before the upload body is even read.
+    if ADMISSION_CONTROL:
+        retry_after = _take_submit_tokens(db, session['username'], test_id)
+        if retry_after:
+            metrics.inc('predictit_admission_total', result='throttled')
+            return _busy_response(test_id, retry_after, 'rate')
     
-    if 'prediction_file' not in request.files:
+    # The multipart body is received and spooled on first access to files.
+    with metrics.timer(SUBMIT_STAGE, stage='upload_read'):
+        files = request.files
+    if 'prediction_file' not in files:
         flash('No file uploaded')
         return redirect(url_for('test_detail', test_id=test_id))
     
-    file = request.files['prediction_file']
+    file = files['prediction_file']
     if not file.filename.endswith('.csv'):
         flash('Please upload a CSV file')
         return redirect(url_for('test_detail', test_id=test_id))
     
-    try:
-        raw = file.read()
-        content = raw.decode('utf-8')
-    except UnicodeDecodeError:
-        flash('Could not read the file. Please upload a valid UTF-8 encoded CSV.')
-        return redirect(url_for('test_detail', test_id=test_id))
-
-    # Record the raw upload size in bytes so admins can spot suspicious
-    # submissions (e.g. several users uploading byte-identical files).
-    filesize = len(raw)
-
-    score, error = calculate_score(content, test['ground_truth'], test['metric'])
+    if ASYNC_SCORING:
+        return _enqueue_submission(db, test, file)
+
+    # Hash the upload first: a file this test has already scored against its
+    # current ground truth and metric (a re-upload, or a teammate's copy)
+    # skips parsing and scoring. The size and SHA-256 are recorded too, so
+    # admins can spot suspicious submissions and byte-identical files are
+    # stored once.
+    with metrics.timer(SUBMIT_STAGE, stage='hash'):
+        hasher = _HashingReader(file.stream)
+        while hasher.read(UPLOAD_READ_CHUNK):
+            pass
+    filesize, content_hash = hasher.bytes_read, hasher.hexdigest()
+    with metrics.timer(SUBMIT_STAGE, stage='score_cache'):
+        cached = _cached_score(db, test, content_hash)
+    if cached:
+        score, error, signature = cached
+    else:
+        with scoring_slots.acquire() as admitted:
+            if not admitted:
+                metrics.inc('predictit_admission_total', result='busy')
+                return _busy_response(test_id, SCORING_QUEUE_TIMEOUT, 'busy')
+            metrics.inc('predictit_admission_total', result='admitted')
+            # Decode, parse and score the upload incrementally as it is read, so
+            # the file is never held in memory as a whole while it is validated.
+            file.stream.seek(0)
+            text, _ = _open_text_stream(file.stream)
+            try:
+                with metrics.timer(SUBMIT_STAGE, stage='ground_truth'):
+                    truth = _get_ground_truth(db, test)
+                score, error, signature = _score_and_sketch(text, truth, test['metric'])
+            except UnicodeDecodeError:
+                metrics.inc('predictit_submissions_total', result='rejected')
+                flash('Could not read the file. Please upload a valid UTF-8 encoded CSV.')
+                return redirect(url_for('test_detail', test_id=test_id))
+            except ValueError as e:
+                score, error, signature = None, str(e), None
     if error:
+        if not cached:
+            _cache_score(db, test, content_hash, score, error, signature)
+            db.commit()
+        metrics.inc('predictit_submissions_total', result='rejected')
         flash(f'Submission rejected: {error}')
         return redirect(url_for('test_detail', test_id=test_id))
 
-    # Keep only the single best submission per user per test. If the user has
-    # submitted before, replace the stored row only when the new score is an
-    # improvement; otherwise keep the existing best and discard the new one.
-    existing = db.execute(
-        'SELECT * FROM pi_submissions WHERE test_id = ? AND username = ?',
-        (test_id, session['username'])
-    ).fetchone()
+    flash(_record_submission(db, test, session['username'], score, file.filename,
+                             filesize, content_hash, lambda: _rewind_upload(file), signature,
+                             cache_score=not cached))
+    return redirect(url_for('test_detail', test_id=test_id))
+
 
+def _record_submission(db, test, username, score, filename, filesize, content_hash, open_content,
+                       signature=None, cache_score=False, job_id=None):
+    """Store a scored upload under the best-submission-per-user rule and
+    return the message to show the user.
+
+    The file itself goes into pi_blobs under content_hash; open_content
+    (returning the file as a binary stream) is only called when it is new
+    content that actually has to be stored.
+    signature is the upload's MinHash, indexed for near-duplicate search.
+    cache_score also adds the result to the score cache, in the same
+    transaction, and job_id marks that pi_jobs row done in it too, so a
+    worker dying half-way never leaves a recorded upload with its job still
+    running (which requeue_stale_jobs would score and record again).
+    With GROUP_COMMIT, the writes are handed to this process's batch writer
+    and this returns once the batch holding them has been committed; the
+    caller must not have uncommitted writes of its own, or on SQLite the
+    writer would wait for them forever.
+    """
+    args = (test, username, score, filename, filesize, content_hash, open_content, signature, cache_score, job_id)
+    _ensure_log_compactor()
+    if GROUP_COMMIT:
+        with metrics.timer(SUBMIT_STAGE, stage='commit'):
+            message, result = group_committer.submit(_apply_submission, *args)
+    else:
+        message, result = _apply_submission(db, *args)
+        with metrics.timer(SUBMIT_STAGE, stage='commit'):
+            db.commit()
+    metrics.inc('predictit_submissions_total', result=result)
+    return message
+
+
+def _apply_submission(db, test, username, score, filename, filesize, content_hash, open_content, signature,
+                      cache_score, job_id=None):
+    """The writes behind _record_submission, left uncommitted. Returns the
+    user's message and the outcome ('accepted' or 'kept')."""
+    message, result = _store_submission(db, test, username, score, filename, filesize, content_hash,
+                                        open_content, signature, cache_score)
+    if job_id is not None:
+        _finish_job(db, job_id, test['id'], 'done', score, None, message)
+    return message, result
+
+
+def _store_submission(db, test, username, score, filename, filesize, content_hash, open_content, signature,
+                      cache_score):
+    """Store the upload, log it and update the user's best, uncommitted."""
+    if cache_score:
+        _cache_score(db, test, content_hash, score, None, signature)
+    # Every scored upload is stored and appended to the history, whether or
+    # not it becomes the user's best.
+    with metrics.timer(SUBMIT_STAGE, stage='store_blob'):
+        _store_blob(db, content_hash, filesize, open_content)
     timestamp = datetime.now().isoformat()
+    with metrics.timer(SUBMIT_STAGE, stage='log_append'):
+        log_id = _append_submission_log(db, test['id'], username, timestamp, score, filename, filesize,
+                                        content_hash)
+        # The user's history on the test page grows with every upload.
+        bump_generations(db, f"history:{test['id']}:{username}")
+
+    # Keep only the single best submission per user per test. If the user has
+    # submitted before, point the row at the new entry only when its score is
+    # an improvement; otherwise the existing best stays.
+    with metrics.timer(SUBMIT_STAGE, stage='existing_lookup'):
+        existing = db.execute(
+            'SELECT id, score, content_hash FROM pi_submissions WHERE test_id = ? AND username = ?',
+            (test['id'], username)
+        ).fetchone()
+
+    if existing and not _is_better_score(score, existing['score'], test['metric']):
+        return (f'Submission scored {score:.4f}, but your previous best of '
+                f'{existing["score"]:.4f} was kept.'), 'kept'
+
+    # Insert-or-improve as one atomic statement: the WHERE clause re-checks
+    # the score against the row as it is at write time, so concurrent
+    # submissions from the same user can never replace a better result.
+    comparison = '<' if _lower_is_better(test['metric']) else '>'
+    with metrics.timer(SUBMIT_STAGE, stage='upsert'):
+        result = db.execute(
+            'INSERT INTO pi_submissions (test_id, username, timestamp, score, filename, filesize, content_hash, '
+            'minhash, log_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (test_id, username) DO UPDATE SET timestamp = excluded.timestamp, '
+            'score = excluded.score, filename = excluded.filename, filesize = excluded.filesize, '
+            'content = NULL, content_hash = excluded.content_hash, minhash = excluded.minhash, '
+            f'log_id = excluded.log_id WHERE excluded.score {comparison} pi_submissions.score',
+            (test['id'], username, timestamp, score, filename, filesize, content_hash, signature, log_id)
+        )
+    if result.rowcount == 0:
+        # A better submission landed between our read and the write.
+        current = db.execute('SELECT score FROM pi_submissions WHERE test_id = ? AND username = ?',
+                             (test['id'], username)).fetchone()
+        return (f'Submission scored {score:.4f}, but your previous best of '
+                f'{current["score"]:.4f} was kept.'), 'kept'
+
     if existing:
-        if _is_better_score(score, existing['score'], test['metric']):
-            db.execute(
-                'UPDATE pi_submissions SET timestamp = ?, score = ?, filename = ?, filesize = ?, content = ? WHERE id = ?',
-                (timestamp, score, file.filename, filesize, content, existing['id'])
-            )
+        _release_blobs(db, [existing['content_hash']])
+    with metrics.timer(SUBMIT_STAGE, stage='index'):
+        submission = db.execute('SELECT id FROM pi_submissions WHERE test_id = ? AND username = ?',
+                                (test['id'], username)).fetchone()
+        _index_signature(db, test['id'], submission['id'], signature)
+    bump_generations(db, f"test:{test['id']}")
+    if existing:
+        return f'Submission successful! New best score: {score:.4f}', 'accepted'
+    return f'Submission successful! Score: {score:.4f}', 'accepted'
+
+
+# --- Submission log ---
+#
+# pi_submission_log is insert-only: one entry per scored upload, with the
+# file kept in pi_blobs. A pi_submissions row is each user's current best,
+# with log_id pointing at its entry and the columns the leaderboard sorts and
+# shows copied alongside, so the leaderboard index still covers it. Only
+# compaction removes entries: those past the retention period that are no
+# longer anyone's best. rescore_test replays the whole history.
+
+def _append_submission_log(db, test_id, username, timestamp, score, filename, filesize, content_hash):
+    """Append one upload to the log and return the new entry's id."""
+    params = (test_id, username, timestamp, score, filename, filesize, content_hash)
+    if USE_POSTGRES:
+        return db.execute(
+            'INSERT INTO pi_submission_log (test_id, username, timestamp, score, filename, filesize, content_hash) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id', params).fetchone()['id']
+    return db.execute(
+        'INSERT INTO pi_submission_log (test_id, username, timestamp, score, filename, filesize, content_hash) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', params).lastrowid
+
+
+def compact_submission_log(db, retention_days=None, batch_size=1000):
+    """Delete log entries older than retention_days (default
+    SUBMISSION_LOG_RETENTION_DAYS; 0 keeps everything) that are not a
+    current best, and the stored files only they used. Commits in batches.
+    Returns (entries removed, files released)."""
+    retention_days = SUBMISSION_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0, 0
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    removed = released = 0
+    while True:
+        rows = db.execute('SELECT l.id, l.test_id, l.username, l.content_hash FROM pi_submission_log l '
+                          'WHERE l.timestamp < ? AND NOT EXISTS (SELECT 1 FROM pi_submissions s WHERE s.log_id = l.id) '
+                          'LIMIT ?', (cutoff, batch_size)).fetchall()
+        if not rows:
+            return removed, released
+        placeholders = ', '.join('?' for _ in rows)
+        db.execute(f'DELETE FROM pi_submission_log WHERE id IN ({placeholders})', tuple(row['id'] for row in rows))
+        released += _release_blobs(db, [row['content_hash'] for row in rows])
+        bump_generations(db, *{f"history:{row['test_id']}:{row['username']}" for row in rows})
+        db.commit()
+        removed += len(rows)
+
+
+_log_compactor = None
+_log_compactor_pid = None
+_log_compactor_lock = threading.Lock()
+
+
+def _ensure_log_compactor():
+    """Start this process's background compaction thread, if retention is
+    configured. Called on the write path, since writes are what grow the log."""
+    global _log_compactor, _log_compactor_pid
+    if SUBMISSION_LOG_RETENTION_DAYS <= 0:
+        return
+    with _log_compactor_lock:
+        if _log_compactor is None or _log_compactor_pid != os.getpid():
+            _log_compactor = threading.Thread(target=_run_log_compactor, name='log-compactor', daemon=True)
+            _log_compactor_pid = os.getpid()
+            _log_compactor.start()
+
+
+def _run_log_compactor():
+    while True:
+        # Jittered, so the workers of a host don't all compact at once.
+        time.sleep(SUBMISSION_LOG_COMPACT_INTERVAL * (0.5 + secrets.randbelow(1000) / 1000))
+        try:
+            with app.app_context():
+                removed, released = compact_submission_log(get_db_wrapper())
+            if removed:
+                app.logger.info('Compacted submission log: %d entries and %d files removed', removed, released)
+        except Exception:
+            app.logger.exception('Submission log compaction failed')
+
+
+@app.cli.command('compact-log')
+@click.option('--retention-days', type=float, default=None,
+              help='Keep entries newer than this (default: SUBMISSION_LOG_RETENTION_DAYS).')
+def compact_log_command(retention_days):
+    """Drop submission log entries past the retention period."""
+    if retention_days is None and SUBMISSION_LOG_RETENTION_DAYS <= 0:
+        raise click.UsageError('Set SUBMISSION_LOG_RETENTION_DAYS or pass --retention-days.')
+    with app.app_context():
+        removed, released = compact_submission_log(get_db_wrapper(), retention_days)
+    click.echo(f'Removed {removed} log entries and {released} stored files.')
+
+
+# --- Group commit ---
+#
+# With GROUP_COMMIT=1, accepted uploads are not committed one by one. Each
+# request hands its writes to a per-process writer thread, which gathers
+# whatever arrives within GROUP_COMMIT_MS and applies it all in a single
+# transaction: one fsync on PostgreSQL and one hold of the SQLite write lock
+# for the whole batch. Requests wait until their batch is committed.
+
+class _PendingWrite:
+    __slots__ = ('apply', 'args', 'done', 'result', 'error')
+
+    def __init__(self, apply, args):
+        self.apply = apply
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """Batches apply(db, *args) calls from many threads into shared
+    transactions. If a batch fails, its writes are retried one transaction
+    each, so a single bad write only fails its own request."""
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, apply, *args):
+        """Run apply(db, *args) in the next batch and return its result once
+        committed, or raise its exception."""
+        self._ensure_writer()
+        pending = _PendingWrite(apply, args)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_writer(self):
+        # Threads don't survive a fork, so each worker starts its own.
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        requests = self._queue
+        while True:
+            batch = [requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with app.app_context():
+                    self._commit(get_db_wrapper(), batch)
+            except Exception as e:
+                # No connection, say: fail the batch but keep the writer alive.
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.error = e
+                        pending.done.set()
+
+    def _commit(self, db, batch):
+        metrics.observe('predictit_group_commit_batch_size', len(batch))
+        try:
+            results = [pending.apply(db, *pending.args) for pending in batch]
+            db.commit()
+        except Exception:
+            db.rollback()
+            if len(batch) > 1:
+                for pending in batch:
+                    self._commit(db, [pending])
+                return
+            batch[0].error = sys.exc_info()[1]
+            batch[0].done.set()
+            return
+        for pending, result in zip(batch, results):
+            pending.result = result
+            pending.done.set()
+
+
+group_committer = GroupCommitter(GROUP_COMMIT_MS / 1000.0, GROUP_COMMIT_MAX_BATCH)
+
+
+def _enqueue_submission(db, test, file):
+    """ASYNC_SCORING path: store the upload and a queued job pointing at it,
+    hand the job to the scoring pool and send the user back straight away."""
+    # Hash the upload and check that it decodes as it streams past, so an
+    # unreadable file is reported now rather than by the job.
+    hasher = _HashingReader(file.stream)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while True:
+            chunk = hasher.read(UPLOAD_READ_CHUNK)
+            if not chunk:
+                break
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        flash('Could not read the file. Please upload a valid UTF-8 encoded CSV.')
+        return redirect(url_for('test_detail', test_id=test['id']))
+    filesize, digest = hasher.bytes_read, hasher.hexdigest()
+    _store_blob(db, digest, filesize, lambda: _rewind_upload(file))
+
+    params = (test['id'], session['username'], datetime.now().isoformat(), file.filename, filesize, digest,
+              time.time() + SCORING_JOB_LEASE)
+    insert = ('INSERT INTO pi_jobs (test_id, username, created, status, filename, filesize, content_hash, '
+              "lease_expires) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)")
+    if USE_POSTGRES:
+        job_id = db.execute(insert + ' RETURNING id', params).fetchone()['id']
+    else:
+        job_id = db.execute(insert, params).lastrowid
+    # The user's test page lists their jobs.
+    bump_generations(db, f"test:{test['id']}")
+    db.commit()
+
+    _dispatch_scoring_job(job_id)
+    flash(f'Submission received and queued for scoring (job #{job_id}). '
+          'This page will update when the score is ready.')
+    return redirect(url_for('test_detail', test_id=test['id']))
+
+
+def _dispatch_scoring_job(job_id):
+    future = _get_scoring_pool().submit(_run_scoring_job, job_id)
+    future.add_done_callback(lambda f: _log_job_failure(job_id, f))
+
+
+_scoring_pool = None
+_scoring_pool_pid = None
+_scoring_pool_lock = threading.Lock()
+
+
+def _get_scoring_pool():
+    """Lazily start this process's scoring pool. Workers are spawned rather
+    than forked so they never share the parent's database sockets."""
+    global _scoring_pool, _scoring_pool_pid
+    with _scoring_pool_lock:
+        if _scoring_pool is None or _scoring_pool_pid != os.getpid():
+            _scoring_pool = ProcessPoolExecutor(
+                max_workers=SCORING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'))
+            _scoring_pool_pid = os.getpid()
+        return _scoring_pool
+
+
+def _run_scoring_job(job_id):
+    """Score a queued upload inside a pool worker and record the outcome on
+    the job row. Runs in a separate process with its own DB connection and
+    ground truth cache."""
+    with app.app_context():
+        db = get_db_wrapper()
+        # Claim the job first: requeue_stale_jobs may have handed it to
+        # another pool as well, and only one of them may score it.
+        claimed = db.execute("UPDATE pi_jobs SET status = 'running', lease_expires = ? "
+                             "WHERE id = ? AND status = 'queued'",
+                             (time.time() + SCORING_JOB_LEASE, job_id)).rowcount
+        db.commit()
+        if not claimed:
+            return
+        job = db.execute('SELECT * FROM pi_jobs WHERE id = ?', (job_id,)).fetchone()
+
+        test = db.execute('SELECT id, metric, ground_truth_version, ground_truth_hash FROM pi_tests WHERE id = ?',
+                          (job['test_id'],)).fetchone()
+        digest = job['content_hash']
+        blob = db.execute('SELECT codec, data, content FROM pi_blobs WHERE hash = ?', (digest,)).fetchone()
+        score, error, message, signature, cached = None, None, None, None, None
+        if not test:
+            error = 'Test not found'
+        elif not blob:
+            error = 'The uploaded file is no longer stored.'
+        else:
+            cached = _cached_score(db, test, digest)
+            if cached:
+                score, error, signature = cached
+            else:
+                try:
+                    truth = _get_ground_truth(db, test)
+                    score, error, signature = _score_and_sketch(StringIO(_blob_text(blob)), truth, test['metric'])
+                except ValueError as e:
+                    error = str(e)
+
+        if error:
+            if test and not cached:
+                _cache_score(db, test, digest, score, error, signature)
+            _finish_job(db, job_id, job['test_id'], 'rejected', score, error, f'Submission rejected: {error}')
+            # A rejected file is not kept, unless something else uses it.
+            _release_blobs(db, [digest])
             db.commit()
-            flash(f'Submission successful! New best score: {score:.4f}')
         else:
-            flash(f'Submission scored {score:.4f}, but your previous best of '
-                  f'{existing["score"]:.4f} was kept.')
+            # The file is already stored, so open_content is never called.
+            # The job row is finished in the same transaction as the upload.
+            _record_submission(db, test, job['username'], score, job['filename'],
+                               job['filesize'], digest, lambda: io.BytesIO(_blob_text(blob).encode('utf-8')),
+                               signature, cache_score=not cached, job_id=job_id)
+
+
+def _finish_job(db, job_id, test_id, status, score, error, message):
+    """Record a job's outcome on its row, uncommitted."""
+    db.execute('UPDATE pi_jobs SET status = ?, score = ?, error = ?, message = ?, finished = ?, '
+               'lease_expires = NULL WHERE id = ?',
+               (status, score, error, message, datetime.now().isoformat(), job_id))
+    bump_generations(db, f"test:{test_id}")
+
+
+def _log_job_failure(job_id, future):
+    """Mark a job as failed if its worker raised instead of finishing it."""
+    exc = future.exception()
+    if exc is None:
+        return
+    app.logger.error('Scoring job %s failed: %r', job_id, exc)
+    with app.app_context():
+        db = get_db_wrapper()
+        job = db.execute('SELECT test_id, content_hash FROM pi_jobs WHERE id = ?', (job_id,)).fetchone()
+        db.execute("UPDATE pi_jobs SET status = 'failed', error = ?, finished = ?, lease_expires = NULL "
+                   'WHERE id = ?', ('Internal error while scoring.', datetime.now().isoformat(), job_id))
+        if job:
+            _release_blobs(db, [job['content_hash']])
+            bump_generations(db, f"test:{job['test_id']}")
+        db.commit()
+
+
+def requeue_stale_jobs(db):
+    """Queue again, in this process's pool, every job whose lease has run
+    out because the process meant to score it died or was restarted.
+    Returns the ids of the jobs requeued."""
+    now = time.time()
+    stale = db.execute("SELECT id, lease_expires FROM pi_jobs WHERE status IN ('queued', 'running') "
+                       'AND lease_expires < ?', (now,)).fetchall()
+    requeued = []
+    for job in stale:
+        # Conditional on the old lease, so each job is taken by one worker.
+        if db.execute("UPDATE pi_jobs SET status = 'queued', lease_expires = ? WHERE id = ? AND lease_expires = ?",
+                      (now + SCORING_JOB_LEASE, job['id'], job['lease_expires'])).rowcount:
+            requeued.append(job['id'])
+    db.commit()
+    for job_id in requeued:
+        _dispatch_scoring_job(job_id)
+    return requeued
+
+
+_job_sweeper_pid = None
+_job_sweeper_lock = threading.Lock()
+
+
+@app.before_request
+def _ensure_job_sweeper():
+    """With ASYNC_SCORING, start this process's stale-job sweeper on its
+    first request, so jobs left behind by a restart are picked up right away."""
+    global _job_sweeper_pid
+    if not ASYNC_SCORING or _job_sweeper_pid == os.getpid():
+        return
+    with _job_sweeper_lock:
+        if _job_sweeper_pid != os.getpid():
+            threading.Thread(target=_run_job_sweeper, name='job-sweeper', daemon=True).start()
+            _job_sweeper_pid = os.getpid()
+
+
+def _run_job_sweeper():
+    while True:
+        try:
+            with app.app_context():
+                requeued = requeue_stale_jobs(get_db_wrapper())
+            if requeued:
+                app.logger.warning('Requeued %d scoring jobs whose lease ran out: %s', len(requeued), requeued)
+        except Exception:
+            app.logger.exception('Requeueing stale scoring jobs failed')
+        # Jittered, so the workers of a host don't all sweep at once.
+        time.sleep(min(60.0, SCORING_JOB_LEASE / 4) * (0.5 + secrets.randbelow(1000) / 1000))
+
+
+# --- Score cache ---
+#
+# Scoring is a pure function of the file, the ground truth and the metric, so
+# results (including rejections) are kept in pi_score_cache under the upload's
+# SHA-256 and the test's ground truth hash and metric. A changed ground truth
+# or metric simply misses; edit_test also drops the test's old rows so they
+# don't accumulate, and rescore_test refills them.
+
+def _cached_score(db, test, content_hash):
+    """(score, error, signature) for a file already scored against the
+    test's current ground truth and metric, or None."""
+    if not test['ground_truth_hash']:
+        return None
+    row = db.execute('SELECT score, error, minhash FROM pi_score_cache WHERE test_id = ? '
+                     'AND ground_truth_hash = ? AND metric = ? AND content_hash = ?',
+                     (test['id'], test['ground_truth_hash'], test['metric'], content_hash)).fetchone()
+    metrics.inc('predictit_score_cache_total', result='hit' if row else 'miss')
+    if not row:
+        return None
+    return row['score'], row['error'], row['minhash']
+
+
+def _cache_score(db, test, content_hash, score, error, signature, replace=False):
+    """Remember a scoring result; committed with the caller's transaction."""
+    if not test['ground_truth_hash']:
+        return
+    conflict = ('DO UPDATE SET score = excluded.score, error = excluded.error, minhash = excluded.minhash'
+                if replace else 'DO NOTHING')
+    db.execute('INSERT INTO pi_score_cache (test_id, ground_truth_hash, metric, content_hash, score, error, minhash) '
+               'VALUES (?, ?, ?, ?, ?, ?, ?) '
+               f'ON CONFLICT (test_id, ground_truth_hash, metric, content_hash) {conflict}',
+               (test['id'], test['ground_truth_hash'], test['metric'], content_hash, score, error, signature))
+
+
+def _clear_score_cache(db, test_id):
+    db.execute('DELETE FROM pi_score_cache WHERE test_id = ?', (test_id,))
+
+
+# --- Bulk re-scoring ---
+#
+# Scores are computed once, at upload time, so changing a test's ground
+# truth or metric leaves them stale. rescore_test() re-runs scoring over the
+# stored file of every submission for a test, spread over a process pool,
+# and writes all new scores in a single transaction. The admin page runs it
+# on a background thread and records progress in pi_rescore_runs, which the
+# leaderboard polls; the rescore CLI command runs it in the foreground.
+
+_rescore_truth = None
+_rescore_metric = None
+
+
+def _init_rescore_worker(ground_truth_csv, metric, compiled_path=None):
+    """Pool initializer: map the compiled ground truth, or parse the CSV,
+    once per worker process."""
+    global _rescore_truth, _rescore_metric
+    if compiled_path:
+        _rescore_truth = CompiledGroundTruth(compiled_path)
     else:
-        db.execute(
-            'INSERT INTO pi_submissions (test_id, username, timestamp, score, filename, filesize, content) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (test_id, session['username'], timestamp, score, file.filename, filesize, content)
-        )
+        _rescore_truth = GroundTruth(_parse_id_value_csv(ground_truth_csv, 'Ground truth'))
+    _rescore_metric = metric
+
+
+def _rescore_one(content_hash, codec, data, content):
+    """Score one stored file. It is sent still compressed and decompressed
+    in the worker."""
+    try:
+        if codec:
+            content = _decompress(codec, data)
+        score, error, signature = _score_and_sketch(StringIO(content), _rescore_truth, _rescore_metric)
+    except ValueError as e:
+        score, error, signature = None, str(e), None
+    return content_hash, score, error, signature
+
+
+def _stored_file_args(row):
+    # PostgreSQL returns bytea as a memoryview, which can't be pickled.
+    data = bytes(row['data']) if row['data'] is not None else None
+    return row['hash'], row['codec'], data, row['content']
+
+
+def _iter_stored_files(db, hashes, batch_size=4):
+    """Yield the pi_blobs rows for the given hashes, a few at a time. Each
+    batch is fully fetched before it is yielded, so the caller may commit
+    (e.g. to report progress) between rows."""
+    for start in range(0, len(hashes), batch_size):
+        batch = hashes[start:start + batch_size]
+        placeholders = ', '.join('?' for _ in batch)
+        yield from db.execute(f'SELECT hash, codec, data, content FROM pi_blobs WHERE hash IN ({placeholders})',
+                              tuple(batch)).fetchall()
+
+
+def rescore_test(test_id, workers=None, progress=None):
+    """Re-score a test's submission history against its current ground truth
+    and metric, and re-select each user's best from it. Each distinct file
+    is scored once.
+
+    progress(done, total, elapsed_seconds) is called as files finish; it
+    may commit. Users none of whose files pass validation any more keep
+    their old best and are counted as failed. Users without a current best
+    (e.g. deleted by an admin) are not brought back, and users who upload
+    a new best while this runs keep it and are counted as skipped. Returns
+    a summary dict.
+    """
+    workers = workers or SCORING_WORKERS
+    started = time.perf_counter()
+    db = get_db_wrapper()
+    test = db.execute('SELECT id, metric, ground_truth_hash FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    if not test:
+        raise ValueError('Test not found')
+    # Workers map the compiled ground truth when there is one; otherwise each
+    # parses the CSV. Either way, fail fast on a broken file here.
+    compiled_path = _compiled_ground_truth_path(db, test)
+    ground_truth = None
+    if not compiled_path:
+        ground_truth = _load_ground_truth_text(db, test_id)
+        if not ground_truth:
+            raise ValueError('This test has no ground truth file configured yet.')
+        _parse_id_value_csv(ground_truth, 'Ground truth')
+
+    # Candidate uploads per user: the current best plus the rest of the
+    # user's logged history, as (timestamp, log id, filename, size, hash).
+    current, candidates = {}, {}
+    for row in db.iterate('SELECT id, username, log_id, timestamp, filename, filesize, content_hash '
+                          'FROM pi_submissions WHERE test_id = ? AND content_hash IS NOT NULL', (test_id,)):
+        current[row['username']] = (row['id'], row['log_id'], row['content_hash'])
+        candidates[row['username']] = [(row['timestamp'], row['log_id'], row['filename'], row['filesize'],
+                                        row['content_hash'])]
+    for row in db.iterate('SELECT id, username, timestamp, filename, filesize, content_hash '
+                          'FROM pi_submission_log WHERE test_id = ?', (test_id,)):
+        best = current.get(row['username'])
+        if best and row['id'] != best[1]:
+            candidates[row['username']].append((row['timestamp'], row['id'], row['filename'], row['filesize'],
+                                                row['content_hash']))
+    # Only files that could become someone's best are scored, so the history
+    # of users without a current best costs nothing.
+    hashes = sorted({entry[4] for entries in candidates.values() for entry in entries})
+    total = len(hashes)
+    contents = _iter_stored_files(db, hashes)
+
+    results = []
+    # Starting spawned workers costs more than scoring a handful of files.
+    if workers <= 1 or total < 2 * workers:
+        _init_rescore_worker(ground_truth, test['metric'], compiled_path)
+        for row in contents:
+            results.append(_rescore_one(*_stored_file_args(row)))
+            if progress:
+                progress(len(results), total, time.perf_counter() - started)
+    else:
+        # Keep a bounded number of files in flight so memory doesn't grow
+        # with the number of submissions.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_rescore_worker,
+                                 initargs=(ground_truth, test['metric'], compiled_path)) as pool:
+            pending = set()
+            for row in contents:
+                pending.add(pool.submit(_rescore_one, *_stored_file_args(row)))
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.append(future.result())
+                        if progress:
+                            progress(len(results), total, time.perf_counter() - started)
+            for future in as_completed(pending):
+                results.append(future.result())
+                if progress:
+                    progress(len(results), total, time.perf_counter() - started)
+
+    scored = {}
+    for content_hash, score, error, signature in results:
+        _cache_score(db, test, content_hash, score, error, signature, replace=True)
+        scored[content_hash] = (score, error, signature)
+
+    # Signatures depend on the ground truth, so each re-scored best is
+    # re-indexed for near-duplicates; users whose files all fail now stay
+    # indexed as they were. The log itself is never rewritten: its entries
+    # keep the score they got when uploaded.
+    rescored = failed = skipped = 0
+    errors, replaced = [], []
+    for username, entries in candidates.items():
+        best = best_score = best_signature = None
+        # Oldest first, so on a tie the upload that reached the score first wins.
+        for entry in sorted(entries, key=lambda entry: entry[0]):
+            score, error, signature = scored.get(entry[4], (None, 'The file is no longer stored.', None))
+            if not error and (best is None or _is_better_score(score, best_score, test['metric'])):
+                best, best_score, best_signature = entry, score, signature
+        if best is None:
+            failed += 1
+            errors.append(error)
+            continue
+        submission_id, previous_log_id, previous_hash = current[username]
+        timestamp, log_id, filename, filesize, content_hash = best
+        # Conditional on the best read at the start: one uploaded while the
+        # files were being scored is newer than anything here. The chosen
+        # entry must also still be in the log, as compaction may have
+        # removed it meanwhile.
+        if not db.execute('UPDATE pi_submissions SET score = ?, minhash = ?, timestamp = ?, log_id = ?, '
+                          'filename = ?, filesize = ?, content_hash = ? WHERE id = ? AND log_id = ? '
+                          'AND content_hash = ? AND EXISTS (SELECT 1 FROM pi_submission_log WHERE id = ?)',
+                          (best_score, best_signature, timestamp, log_id, filename, filesize, content_hash,
+                           submission_id, previous_log_id, previous_hash, log_id)).rowcount:
+            skipped += 1
+            continue
+        _index_signature(db, test_id, submission_id, best_signature)
+        if content_hash != previous_hash:
+            replaced.append(previous_hash)
+        rescored += 1
+    _release_blobs(db, replaced)
+    bump_generations(db, f'test:{test_id}')
+    db.commit()
+
+    elapsed = time.perf_counter() - started
+    return {'files': total, 'rescored': rescored, 'failed': failed, 'skipped': skipped, 'errors': errors[:3],
+            'seconds': elapsed, 'per_second': total / elapsed if elapsed else 0.0}
+
+
+def _rescore_message(summary):
+    message = (f"Re-scored {summary['rescored']} submissions in {summary['seconds']:.1f}s "
+               f"({summary['per_second']:.0f} files/s).")
+    if summary['failed']:
+        message += (f" {summary['failed']} no longer pass validation and kept their old score "
+                    f"(e.g. {summary['errors'][0]})")
+    if summary['skipped']:
+        message += f" {summary['skipped']} uploaded a new best meanwhile and kept it."
+    return message
+
+
+def _latest_rescore_run(db, test_id):
+    """The test's most recent re-score run, or None. A run whose thread
+    stopped reporting (its worker was restarted) is marked failed first."""
+    now = time.time()
+    if db.execute("UPDATE pi_rescore_runs SET status = 'failed', finished = ?, "
+                  "message = 'Re-scoring was interrupted. Start it again.' "
+                  "WHERE test_id = ? AND status = 'running' AND heartbeat < ?",
+                  (datetime.now().isoformat(), test_id, now - SCORING_JOB_LEASE)).rowcount:
+        bump_generations(db, f'test:{test_id}')
+    db.commit()
+    return db.execute('SELECT id, test_id, started, finished, status, done, total, message FROM pi_rescore_runs '
+                      'WHERE test_id = ? ORDER BY id DESC LIMIT 1', (test_id,)).fetchone()
+
+
+def _run_rescore(run_id, test_id):
+    """Background thread body for the admin re-score button: run
+    rescore_test and record its progress and outcome on the run's row."""
+    with app.app_context():
+        db = get_db_wrapper()
+        last_report = [0.0]
+
+        def report(done, total, elapsed):
+            if done == total or elapsed - last_report[0] >= 1:
+                last_report[0] = elapsed
+                db.execute('UPDATE pi_rescore_runs SET done = ?, total = ?, heartbeat = ? WHERE id = ?',
+                           (done, total, time.time(), run_id))
+                db.commit()
+
+        try:
+            summary = rescore_test(test_id, progress=report)
+        except Exception as e:
+            db.rollback()
+            if not isinstance(e, ValueError):
+                app.logger.exception('Re-scoring test %s failed', test_id)
+                e = 'internal error'
+            status, message = 'failed', f'Re-scoring failed: {e}'
+        else:
+            status, message = 'done', _rescore_message(summary)
+        db.execute('UPDATE pi_rescore_runs SET status = ?, message = ?, finished = ?, heartbeat = ? WHERE id = ?',
+                   (status, message, datetime.now().isoformat(), time.time(), run_id))
+        bump_generations(db, f'test:{test_id}')
         db.commit()
-        flash(f'Submission successful! Score: {score:.4f}')
 
-    return redirect(url_for('test_detail', test_id=test_id))
+
+@app.route('/admin/rescore/<int:test_id>', methods=['POST'])
+def rescore_submissions(test_id):
+    """Start re-scoring a test in the background; scoring every stored file
+    can take far longer than a request may. The leaderboard shows progress."""
+    if not session.get('is_admin'):
+        return redirect(url_for('login'))
+
+    db = get_db_wrapper()
+    if not db.execute('SELECT id FROM pi_tests WHERE id = ?', (test_id,)).fetchone():
+        flash('Test not found')
+        return redirect(url_for('index'))
+    run = _latest_rescore_run(db, test_id)
+    if run and run['status'] == 'running':
+        flash('This test is already being re-scored.')
+        return redirect(url_for('leaderboard', test_id=test_id))
+
+    params = (test_id, datetime.now().isoformat(), time.time())
+    insert = "INSERT INTO pi_rescore_runs (test_id, started, status, done, heartbeat) VALUES (?, ?, 'running', 0, ?)"
+    if USE_POSTGRES:
+        run_id = db.execute(insert + ' RETURNING id', params).fetchone()['id']
+    else:
+        run_id = db.execute(insert, params).lastrowid
+    bump_generations(db, f'test:{test_id}')
+    db.commit()
+
+    threading.Thread(target=_run_rescore, args=(run_id, test_id), name=f'rescore-{test_id}', daemon=True).start()
+    flash('Re-scoring started. The leaderboard will update when it finishes.')
+    return redirect(url_for('leaderboard', test_id=test_id))
+
+
+@app.route('/admin/rescore/<int:test_id>/status')
+def rescore_status(test_id):
+    """Poll the progress of a test's latest re-score run."""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    run = _latest_rescore_run(get_db_wrapper(), test_id)
+    if not run:
+        return jsonify({'error': 'No re-score run found'}), 404
+    return jsonify({key: run[key] for key in ('id', 'test_id', 'status', 'started', 'finished', 'done', 'total',
+                                              'message')})
 
 
+@app.cli.command('rescore')
+@click.argument('test_id', type=int)
+@click.option('--workers', type=int, default=None, help='Scoring processes (default: SCORING_WORKERS).')
+def rescore_command(test_id, workers):
+    """Re-score all stored submissions of TEST_ID."""
+    last_report = [0.0]
 
+    def report(done, total, elapsed):
+        if done == total or elapsed - last_report[0] >= 1:
+            last_report[0] = elapsed
+            rate = done / elapsed if elapsed else 0.0
+            click.echo(f'  {done}/{total} files scored ({rate:.0f}/s)')
+
+    try:
+        summary = rescore_test(test_id, workers=workers, progress=report)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Re-scored {summary['rescored']} submissions ({summary['files']} distinct files) "
+               f"in {summary['seconds']:.2f}s, {summary['per_second']:.0f} files/s.")
+    if summary['skipped']:
+        click.echo(f"{summary['skipped']} users uploaded a new best meanwhile and kept it.")
+    if summary['failed']:
+        click.echo(f"{summary['failed']} submissions failed validation and kept their old score:")
+        for error in summary['errors']:
+            click.echo(f'  {error}')
+
+
+@app.route('/submission/<int:job_id>/status')
+def submission_status(job_id):
+    """Poll the state of an ASYNC_SCORING job. Only its owner and admins can
+    see it."""
+    if 'username' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    db = get_db_wrapper()
+    job = db.execute('SELECT id, test_id, username, created, finished, status, filename, score, error, message '
+                     'FROM pi_jobs WHERE id = ?', (job_id,)).fetchone()
+    if not job or (job['username'] != session['username'] and not session.get('is_admin')):
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({key: job[key] for key in ('id', 'test_id', 'status', 'created', 'finished',
+                                              'filename', 'score', 'error', 'message')})
 
 
 @app.route('/leaderboard/<int:test_id>')
+@cached_page(lambda kwargs: [f"test:{kwargs['test_id']}"])
 def leaderboard(test_id):
     # Only admins can view leaderboard
     if not session.get('is_admin'):
@@ -487,61 +2830,222 @@ def leaderboard(test_id):
         return redirect(url_for('login'))
     
     db = get_db_wrapper()
-    test = db.execute('SELECT * FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    test = db.execute('SELECT id, name, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
     
     if not test:
         flash('Test not found')
         return redirect(url_for('index'))
-    
-    # Get all submissions for this test
-    test_submissions = db.execute(
-        'SELECT * FROM pi_submissions WHERE test_id = ? ORDER BY score DESC',
-        (test_id,)
-    ).fetchall()
-    
-    # Get best submission per user
-    user_best = {}
-    for sub in test_submissions:
-        username = sub['username']
-        if username not in user_best:
-            user_best[username] = sub
-    
-    # Sort by score (descending for accuracy, ascending for RMSE/MAE)
-    leaderboard_data = list(user_best.values())
-    if test['metric'] in ['rmse', 'mae']:
-        leaderboard_data.sort(key=lambda x: x['score'])
-    else:
-        leaderboard_data.sort(key=lambda x: x['score'], reverse=True)
+
+    after = _parse_leaderboard_cursor(request.args.get('after'))
+    rank_offset = after[3] if after else 0
+    leaderboard_data = _leaderboard_rows(db, test, limit=LEADERBOARD_PAGE_SIZE + 1, after=after)
+    next_cursor = None
+    if len(leaderboard_data) > LEADERBOARD_PAGE_SIZE:
+        leaderboard_data = leaderboard_data[:LEADERBOARD_PAGE_SIZE]
+        last = leaderboard_data[-1]
+        next_cursor = f"{last['score']!r}|{last['timestamp']}|{last['id']}|{rank_offset + len(leaderboard_data)}"
 
     # Flag exact-copy submissions: group the entries whose stored file content
     # is byte-for-byte identical. dup_groups maps a submission id to a short
     # label (A, B, ...) shared by every entry with the same content.
-    dup_groups = _find_duplicate_content_groups(leaderboard_data)
+    dup_groups = _find_duplicate_content_groups(db, test, leaderboard_data)
+    # Near-copies: files that differ (edited values, reordered rows) but
+    # predict nearly the same value for nearly every ID.
+    near_groups = _find_near_duplicate_groups(db, test, leaderboard_data)
+
+    # Upload sizes shared by more than one user across the whole leaderboard
+    # (not just this page): identical sizes are a strong sign of copying.
+    size_counts = {row['filesize']: row['n'] for row in db.execute(
+        'SELECT filesize, COUNT(*) AS n FROM pi_submissions WHERE test_id = ? AND filesize IS NOT NULL '
+        'GROUP BY filesize HAVING COUNT(*) > 1', (test_id,)).fetchall()}
+
+    rescore_run = db.execute('SELECT id, started, finished, status, done, total, message FROM pi_rescore_runs '
+                             'WHERE test_id = ? ORDER BY id DESC LIMIT 1', (test_id,)).fetchone()
 
     return render_template('leaderboard.html', test=test,
-                           leaderboard=leaderboard_data, dup_groups=dup_groups)
+                           leaderboard=leaderboard_data, dup_groups=dup_groups,
+                           near_groups=near_groups, near_threshold=NEAR_DUP_THRESHOLD,
+                           size_counts=size_counts, rank_offset=rank_offset, next_cursor=next_cursor,
+                           paged=after is not None, rescore_run=rescore_run)
+
 
+def _leaderboard_order(metric):
+    """ORDER BY clause ranking a test's submissions best-first. Ties go to
+    whoever reached the score first."""
+    direction = 'ASC' if _lower_is_better(metric) else 'DESC'
+    return f'score {direction}, timestamp ASC, id ASC'
 
-def _find_duplicate_content_groups(entries):
+
+def _parse_leaderboard_cursor(value):
+    """Decode a 'score|timestamp|id|rank' leaderboard cursor (the last row
+    already shown and its rank); None if absent or invalid."""
+    parts = (value or '').split('|')
+    if len(parts) != 4:
+        return None
+    try:
+        return float(parts[0]), parts[1], int(parts[2]), int(parts[3])
+    except ValueError:
+        return None
+
+
+def _leaderboard_rows(db, test, limit=None, after=None, stream=False):
+    """Return a page of a test's leaderboard, already ranked.
+
+    pi_submissions holds exactly one row per user per test, kept at that
+    user's best score by the upsert in _record_submission, so it is the
+    leaderboard: accepting, replacing or deleting a submission updates it in
+    place. after is the (score, timestamp, id, ...) of the last row already
+    shown; the page seeks past it on the (test_id, score) index rather than
+    skipping rows with OFFSET, so every page costs the same as the first.
+    With stream=True the rows are yielded from a server-side cursor instead.
+    """
+    query = ('SELECT id, username, score, timestamp, filename, filesize, content_hash '
+             'FROM pi_submissions WHERE test_id = ?')
+    params = (test['id'],)
+    if after:
+        # The cursor score is cast like the column (float4 on PostgreSQL),
+        # so the tie check compares equal values.
+        beyond = '>' if _lower_is_better(test['metric']) else '<'
+        query += (f' AND (score {beyond} CAST(? AS REAL) OR (score = CAST(? AS REAL) '
+                  'AND (timestamp > ? OR (timestamp = ? AND id > ?))))')
+        params += (after[0], after[0], after[1], after[1], after[2])
+    query += f' ORDER BY {_leaderboard_order(test["metric"])}'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params += (limit,)
+    if stream:
+        return db.iterate(query, params)
+    return db.execute(query, params).fetchall()
+
+
+def _find_duplicate_content_groups(db, test, entries):
     """Given leaderboard entries, return {submission_id: group_label} for every
-    entry whose stored content is identical to at least one other entry."""
-    by_hash = {}
-    for entry in entries:
-        content = entry['content']
-        if not content:
-            continue
-        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
-        by_hash.setdefault(digest, []).append(entry['id'])
-
-    dup_groups = {}
-    label_ord = ord('A')
-    for ids in by_hash.values():
-        if len(ids) > 1:
-            label = chr(label_ord)
-            label_ord += 1
-            for sid in ids:
-                dup_groups[sid] = label
-    return dup_groups
+    entry whose stored content is identical to at least one other entry.
+
+    Identical files share a content hash, so the duplicates are found with a
+    GROUP BY on the indexed hash column. Groups are labelled in order of their
+    best-ranked member across the whole leaderboard, so labels stay the same
+    from page to page."""
+    best = 'MIN(score)' if _lower_is_better(test['metric']) else 'MAX(score)'
+    direction = 'ASC' if _lower_is_better(test['metric']) else 'DESC'
+    rows = db.execute(
+        'SELECT content_hash FROM pi_submissions WHERE test_id = ? AND content_hash IS NOT NULL '
+        f'GROUP BY content_hash HAVING COUNT(*) > 1 ORDER BY {best} {direction}, MIN(timestamp) ASC',
+        (test['id'],)).fetchall()
+    labels = {row['content_hash']: _group_label(i) for i, row in enumerate(rows)}
+    return {entry['id']: labels[entry['content_hash']]
+            for entry in entries if entry['content_hash'] in labels}
+
+
+def _group_label(index):
+    """Spreadsheet-style labels: A..Z, then AA, AB, ..."""
+    label = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        label = chr(ord('A') + rem) + label
+    return label
+
+
+def _index_signature(db, test_id, submission_id, signature, replace=True):
+    """Add a submission to the test's near-duplicate index.
+
+    Two submissions are candidates when any LSH band of their signatures
+    matches, so the submission's own buckets are enough to find every
+    candidate among the submissions already indexed: one indexed lookup per
+    band, each capped at NEAR_DUP_BUCKET_CAP rows, however many submissions
+    the test has. Candidates whose estimated similarity reaches
+    NEAR_DUP_THRESHOLD are stored as pairs, which is all the leaderboard
+    needs to read.
+    """
+    if replace:
+        _unindex_signatures(db, test_id, submission_id)
+    if not signature:
+        return
+    width = MINHASH_ROWS_PER_BAND * 8
+    buckets = [f'{band:02d}:{signature[band * width:(band + 1) * width]}' for band in range(MINHASH_BANDS)]
+    candidates = {}
+    for bucket in buckets:
+        for other in db.execute(
+                'SELECT s.id, s.minhash FROM pi_lsh_buckets b JOIN pi_submissions s ON s.id = b.submission_id '
+                'WHERE b.test_id = ? AND b.bucket = ? LIMIT ?', (test_id, bucket, NEAR_DUP_BUCKET_CAP)).fetchall():
+            candidates[other['id']] = other['minhash']
+    candidates.pop(submission_id, None)
+    for other_id, other_signature in candidates.items():
+        similarity = _signature_similarity(signature, other_signature)
+        if similarity >= NEAR_DUP_THRESHOLD:
+            db.execute('INSERT INTO pi_near_duplicates (test_id, a, b, similarity) VALUES (?, ?, ?, ?)',
+                       (test_id, min(submission_id, other_id), max(submission_id, other_id), similarity))
+    for bucket in buckets:
+        db.execute('INSERT INTO pi_lsh_buckets (test_id, bucket, submission_id) VALUES (?, ?, ?)',
+                   (test_id, bucket, submission_id))
+
+
+def _unindex_signatures(db, test_id, submission_id=None):
+    """Drop one submission, or a whole test, from the near-duplicate index."""
+    if submission_id is None:
+        db.execute('DELETE FROM pi_lsh_buckets WHERE test_id = ?', (test_id,))
+        db.execute('DELETE FROM pi_near_duplicates WHERE test_id = ?', (test_id,))
+    else:
+        db.execute('DELETE FROM pi_lsh_buckets WHERE submission_id = ?', (submission_id,))
+        db.execute('DELETE FROM pi_near_duplicates WHERE a = ?', (submission_id,))
+        db.execute('DELETE FROM pi_near_duplicates WHERE b = ?', (submission_id,))
+
+
+def _find_near_duplicate_groups(db, test, entries, threshold=None):
+    """Given leaderboard entries, return {submission_id: group_label} for every
+    entry that is a near-copy of another submission to the test.
+
+    The candidate pairs were found when the submissions were indexed, so this
+    only reads the pairs at or above the threshold and merges them into
+    clusters; the cost depends on the number of similar pairs, not on the
+    number of submissions. Clusters whose members are all byte-identical are
+    left to the exact copy groups. Labels follow the same best-ranked-first
+    order as those.
+    """
+    threshold = NEAR_DUP_THRESHOLD if threshold is None else threshold
+    pairs = db.execute('SELECT a, b FROM pi_near_duplicates WHERE test_id = ? AND similarity >= ?',
+                       (test['id'], threshold)).fetchall()
+    if not pairs:
+        return {}
+
+    candidates = sorted({row['a'] for row in pairs} | {row['b'] for row in pairs})
+    info = {}
+    for start in range(0, len(candidates), 500):
+        chunk = candidates[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in db.execute('SELECT id, score, timestamp, content_hash FROM pi_submissions '
+                              f'WHERE id IN ({placeholders})', tuple(chunk)).fetchall():
+            info[row['id']] = row
+
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    for row in pairs:
+        a, b = info.get(row['a']), info.get(row['b'])
+        if a and b:
+            parent.setdefault(a['id'], a['id'])
+            parent.setdefault(b['id'], b['id'])
+            parent[find(a['id'])] = find(b['id'])
+
+    clusters = {}
+    for member in parent:
+        clusters.setdefault(find(member), []).append(info[member])
+    lower = _lower_is_better(test['metric'])
+    clusters = [members for members in clusters.values()
+                if len({m['content_hash'] for m in members}) > 1]
+    clusters.sort(key=lambda members: min(((m['score'] if lower else -m['score']), m['timestamp'])
+                                          for m in members))
+    labels = {}
+    for i, members in enumerate(clusters):
+        for member in members:
+            labels[member['id']] = _group_label(i)
+    return {entry['id']: labels[entry['id']] for entry in entries if entry['id'] in labels}
 
 @app.route('/submission/<int:submission_id>/download')
 def download_submission(submission_id):
@@ -558,12 +3062,13 @@ def download_submission(submission_id):
         flash('Submission not found')
         return redirect(url_for('admin_dashboard'))
 
-    if not submission['content']:
+    content = _load_content(db, submission)
+    if not content:
         flash('No stored file for this submission (it predates file storage).')
         return redirect(url_for('leaderboard', test_id=submission['test_id']))
 
     from flask import make_response
-    response = make_response(submission['content'])
+    response = make_response(content)
     name = submission['filename'] or f'submission_{submission_id}.csv'
     response.headers['Content-Disposition'] = f'attachment; filename={submission["username"]}_{name}'
     response.headers['Content-Type'] = 'text/csv'
@@ -578,75 +3083,425 @@ def download_leaderboard(test_id):
         return redirect(url_for('login'))
     
     db = get_db_wrapper()
-    test = db.execute('SELECT * FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    test = db.execute('SELECT id, name, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
     
     if not test:
         flash('Test not found')
         return redirect(url_for('index'))
-    
-    # Get all submissions for this test
-    test_submissions = db.execute(
-        'SELECT * FROM pi_submissions WHERE test_id = ? ORDER BY score DESC',
-        (test_id,)
-    ).fetchall()
-    
-    # Get best submission per user
-    user_best = {}
-    for sub in test_submissions:
-        username = sub['username']
-        if username not in user_best:
-            user_best[username] = sub
-    
-    # Sort by score (descending for accuracy, ascending for RMSE/MAE)
-    leaderboard_data = list(user_best.values())
-    if test['metric'] in ['rmse', 'mae']:
-        leaderboard_data.sort(key=lambda x: x['score'])
-    else:
-        leaderboard_data.sort(key=lambda x: x['score'], reverse=True)
-    
-    # Generate CSV
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Rank', 'Username', 'Score', 'Timestamp', 'Filename', 'Upload Size (bytes)'])
-    for idx, entry in enumerate(leaderboard_data, 1):
-        writer.writerow([idx, entry['username'], entry['score'], entry['timestamp'],
-                         entry['filename'], entry['filesize']])
-    
-    from flask import make_response
-    csv_output = output.getvalue()
-    response = make_response(csv_output)
+
+    def generate():
+        # Rows come off a server-side cursor and leave as CSV in ~64 KB
+        # chunks, so memory stays flat however long the leaderboard is.
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Rank', 'Username', 'Score', 'Timestamp', 'Filename', 'Upload Size (bytes)'])
+        for idx, entry in enumerate(_leaderboard_rows(db, test, stream=True), 1):
+            writer.writerow([idx, entry['username'], entry['score'], entry['timestamp'],
+                             entry['filename'], entry['filesize']])
+            if output.tell() >= EXPORT_CHUNK_SIZE:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+
+    response = app.response_class(stream_with_context(generate()), mimetype='text/csv')
     response.headers['Content-Disposition'] = f'attachment; filename=leaderboard_{test["name"].replace(" ", "_")}.csv'
-    response.headers['Content-Type'] = 'text/csv'
     return response
 
-def _parse_id_value_csv(csv_text, label):
-    """Parse a two-column (id, value) CSV into a dict, raising ValueError on
-    any structural or numeric problem so the caller can report it."""
-    reader = csv.DictReader(StringIO(csv_text))
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for zipfile. It buffers what has been
+    written until the response generator collects it with pop(), so an
+    archive can be streamed without ever existing in full."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+@app.route('/leaderboard/<int:test_id>/download_all')
+def download_all_submissions(test_id):
+    """Stream a ZIP of every stored submission file for a test, so admins
+    investigating a contest don't have to download them one by one."""
+    if not session.get('is_admin'):
+        flash('Admin access required')
+        return redirect(url_for('login'))
+
+    db = get_db_wrapper()
+    test = db.execute('SELECT id, name FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+
+    if not test:
+        flash('Test not found')
+        return redirect(url_for('index'))
+
+    def generate():
+        sink = _ZipStream()
+        # A few rows per batch: each one carries a whole file.
+        rows = db.iterate('SELECT s.id, s.username, s.filename, b.codec, b.data, b.content FROM pi_submissions s '
+                          'JOIN pi_blobs b ON b.hash = s.content_hash WHERE s.test_id = ? ORDER BY s.id',
+                          (test_id,), batch_size=4)
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for row in rows:
+                name = secure_filename(f"{row['id']}_{row['username']}_{row['filename'] or 'submission.csv'}")
+                data = _blob_text(row).encode('utf-8')
+                with archive.open(name, 'w') as member:
+                    for start in range(0, len(data), EXPORT_CHUNK_SIZE):
+                        member.write(data[start:start + EXPORT_CHUNK_SIZE])
+                        yield sink.pop()
+                yield sink.pop()
+        yield sink.pop()
+
+    response = app.response_class(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=submissions_{test["name"].replace(" ", "_")}.zip'
+    return response
+
+def _iter_id_value_rows(lines, label):
+    """Yield (id, value) pairs from a two-column (id, value) CSV given as any
+    iterable of lines, one row at a time. Raises ValueError on any structural
+    or numeric problem so the caller can report it."""
+    reader = csv.DictReader(lines)
     cols = reader.fieldnames
     if not cols or len(cols) < 2:
         raise ValueError(f'{label} must have at least two columns (id, value).')
 
-    data = {}
+    id_col, value_col = cols[0], cols[1]
     # Row numbering starts at 2 to account for the header row.
     for line_no, row in enumerate(reader, start=2):
-        key = row[cols[0]]
-        raw = row[cols[1]]
+        raw = row[value_col]
         try:
-            data[key] = float(raw)
+            value = float(raw)
         except (TypeError, ValueError):
             raise ValueError(f"{label} row {line_no}: '{raw}' is not a number.")
+        yield row[id_col], value
+
 
+def _parse_id_value_csv(csv_text, label):
+    """Parse a two-column (id, value) CSV into a dict, raising ValueError on
+    any structural or numeric problem so the caller can report it."""
+    data = dict(_iter_id_value_rows(StringIO(csv_text), label))
     if not data:
         raise ValueError(f'{label} contains no data rows.')
     return data
 
 
+class _HashingReader(io.RawIOBase):
+    """Read-only binary stream wrapper that counts and SHA-256 hashes the
+    bytes passing through, so an upload's size and content hash are known
+    without holding it in memory."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+        self._sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.bytes_read += n
+        self._sha256.update(data)
+        return n
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def _rewind_upload(file):
+    """An already-validated upload's stream, back at the start, for storage."""
+    file.stream.seek(0)
+    return file.stream
+
+
+def _open_text_stream(binary_stream):
+    """Wrap a binary upload stream so it can be decoded and parsed as UTF-8
+    CSV incrementally. Returns (text_stream, reader), where reader exposes
+    the byte count and hash of everything read so far."""
+    reader = _HashingReader(binary_stream)
+    text = io.TextIOWrapper(io.BufferedReader(reader, buffer_size=UPLOAD_READ_CHUNK),
+                            encoding='utf-8', newline='')
+    return text, reader
+
+
+class GroundTruthCache:
+    """Bounded in-process LRU cache of parsed ground truth files.
+
+    Entries are keyed by (test_id, ground_truth_version), so a new upload from
+    any worker makes stale copies unreachable; invalidate() just frees their
+    memory early. Capacity is measured in (estimated) bytes, not entries.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if nbytes > self.max_bytes:
+                # Too big to ever fit; caching it would only flush everything else.
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate(self, test_id):
+        """Drop every cached version of the given test."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == test_id]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+ground_truth_cache = GroundTruthCache(GROUND_TRUTH_CACHE_BYTES)
+
+
+class GroundTruth:
+    """A parsed ground truth file: the IDs in file order, an {id: position}
+    index, and the target values by position (a contiguous float64 array when
+    NumPy is available, otherwise a list)."""
+
+    __slots__ = ('ids', 'index', 'values')
+
+    def __init__(self, data):
+        self.ids = list(data)
+        self.index = {k: i for i, k in enumerate(self.ids)}
+        if HAS_NUMPY:
+            self.values = np.fromiter(data.values(), dtype=np.float64, count=len(data))
+        else:
+            self.values = list(data.values())
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Rough memory footprint, used to size the cache."""
+        size = (sys.getsizeof(self.ids) + sys.getsizeof(self.index)
+                + sum(sys.getsizeof(k) + sys.getsizeof(i) for k, i in self.index.items()))
+        if HAS_NUMPY:
+            size += self.values.nbytes
+        else:
+            size += sys.getsizeof(self.values) + 24 * len(self.values)
+        return size
+
+
+def _get_ground_truth(db, test):
+    """Return the parsed GroundTruth for a test row, parsing and caching it
+    on a miss. Raises ValueError if the test has no (valid) ground truth."""
+    key = (test['id'], test['ground_truth_version'])
+    truth = ground_truth_cache.get(key)
+    if truth is not None:
+        return truth
+
+    compiled_path = _compiled_ground_truth_path(db, test)
+    if compiled_path:
+        try:
+            truth = CompiledGroundTruth(compiled_path)
+        except FileNotFoundError:
+            # Removed since the existence check (the test's ground truth was
+            # replaced, or the directory cleaned): compile it again.
+            truth = CompiledGroundTruth(_compiled_ground_truth_path(db, test))
+    else:
+        text = _load_ground_truth_text(db, test['id'])
+        if not text:
+            raise ValueError('This test has no ground truth file configured yet.')
+        truth = GroundTruth(_parse_id_value_csv(text, 'Ground truth'))
+    ground_truth_cache.put(key, truth, truth.nbytes)
+    return truth
+
+
+# --- Compiled ground truth ---
+#
+# With NumPy, each ground truth is compiled once into a binary file that
+# workers memory-map instead of parsing it into per-process dicts:
+#
+#   header      64 bytes: magic, row count n, ID width w
+#   values      float64[n], in file order
+#   order       int64[n], file position of each sorted ID
+#   sorted_ids  S<w>[n], UTF-8 IDs sorted bytewise
+#
+# Prediction IDs are matched by binary search over sorted_ids. The pages
+# live in the OS page cache, shared by every process on the host, so a
+# worker's own memory doesn't grow with the number of active tests.
+
+_GT_MAGIC = b'PIGT\x00\x00\x00\x01'
+_GT_HEADER = struct.Struct('<8sQQ')
+_GT_HEADER_SIZE = 64
+# Prediction rows looked up per batch while aligning.
+ALIGN_BATCH_ROWS = 65536
+# Cache cost charged per mapped file: the mapping itself is shared page cache,
+# but each one holds a file handle, so the number kept open is still bounded.
+_MAPPED_ENTRY_COST = 64 * 1024
+
+
+def compile_ground_truth(text, path):
+    """Parse ground truth CSV text and write the compiled file to path,
+    atomically. Raises ValueError for a malformed file."""
+    data = _parse_id_value_csv(text, 'Ground truth')
+    n = len(data)
+    keys = [key.encode('utf-8') for key in data]
+    width = max([len(key) for key in keys] + [1])
+    ids = np.array(keys, dtype=f'S{width}')
+    order = np.argsort(ids, kind='stable').astype(np.int64)
+    values = np.fromiter(data.values(), dtype=np.float64, count=n)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_GT_HEADER.pack(_GT_MAGIC, n, width).ljust(_GT_HEADER_SIZE, b'\x00'))
+            f.write(values.tobytes())
+            f.write(order.tobytes())
+            f.write(ids[order].tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CompiledGroundTruth:
+    """A memory-mapped compiled ground truth (see compile_ground_truth)."""
+
+    __slots__ = ('path', 'values', 'order', 'sorted_ids', '_buffer')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, n, width = _GT_HEADER.unpack(f.read(_GT_HEADER.size))
+        if magic != _GT_MAGIC:
+            raise ValueError(f'{path} is not a compiled ground truth file.')
+        self._buffer = buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        start = _GT_HEADER_SIZE
+        self.values = buffer[start:start + 8 * n].view(np.float64)
+        self.order = buffer[start + 8 * n:start + 16 * n].view(np.int64)
+        self.sorted_ids = buffer[start + 16 * n:start + 16 * n + width * n].view(f'S{width}')
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return _MAPPED_ENTRY_COST
+
+    def ids_at(self, positions):
+        """The IDs at the given file positions (for error messages)."""
+        rank = np.empty(len(self.order), dtype=np.int64)
+        rank[self.order] = np.arange(len(self.order))
+        return [self.sorted_ids[rank[pos]].decode('utf-8') for pos in positions]
+
+    def lookup(self, keys):
+        """File positions of a batch of ID strings, -1 where unknown."""
+        n = len(self.sorted_ids)
+        if not n or not keys:
+            return np.full(len(keys), -1, dtype=np.int64)
+        width = self.sorted_ids.dtype.itemsize
+        encoded = [key.encode('utf-8') for key in keys]
+        # Longer keys can't match; the cast to S<width> would truncate them.
+        fits = np.fromiter((len(key) <= width for key in encoded), dtype=bool, count=len(encoded))
+        probe = np.array(encoded, dtype=f'S{width}')
+        idx = np.minimum(np.searchsorted(self.sorted_ids, probe), n - 1)
+        found = fits & (self.sorted_ids[idx] == probe)
+        return np.where(found, self.order[idx], -1)
+
+
+def _compiled_ground_truth_path(db, test):
+    """Path of the test's compiled ground truth, compiling it from the
+    database first if this host doesn't have it yet. None without NumPy or
+    ground truth. Raises ValueError for a malformed file."""
+    if not HAS_NUMPY or not test['ground_truth_hash']:
+        return None
+    # Scores are only as trustworthy as the files mapped from here.
+    path = os.path.join(_private_directory(GROUND_TRUTH_DIR), f"{test['ground_truth_hash']}.gt")
+    if not os.path.exists(path):
+        text = _load_ground_truth_text(db, test['id'])
+        if not text:
+            return None
+        compile_ground_truth(text, path)
+    return path
+
+
+def _compile_ground_truth_quietly(text, digest):
+    """Compile a just-uploaded ground truth ahead of the first submission.
+    A malformed file is reported when someone submits, as before."""
+    if not HAS_NUMPY:
+        return
+    try:
+        compile_ground_truth(text, os.path.join(_private_directory(GROUND_TRUTH_DIR), f'{digest}.gt'))
+    except (ValueError, OSError, RuntimeError) as e:
+        app.logger.warning('Could not compile ground truth %s: %s', digest, e)
+
+
+def _remove_compiled_ground_truth(db, digest):
+    """Delete a compiled file no test uses any more. Workers that still
+    have it mapped keep reading their copy until they let go of it."""
+    if not digest or db.execute('SELECT 1 FROM pi_tests WHERE ground_truth_hash = ?', (digest,)).fetchone():
+        return
+    try:
+        os.remove(os.path.join(GROUND_TRUTH_DIR, f'{digest}.gt'))
+    except OSError:
+        pass
+
+
+def _lower_is_better(metric):
+    """Whether a lower score is better for the metric, as declared in
+    SCORING_METRICS. Unknown metrics rank higher-is-better."""
+    entry = SCORING_METRICS.get(metric)
+    return bool(entry and entry.lower_is_better)
+
+
 def _is_better_score(new_score, old_score, metric):
     """Return True if new_score is an improvement over old_score for the given
-    metric. Lower is better for error metrics (RMSE/MAE); higher is better for
-    everything else (e.g. accuracy)."""
-    if metric in ('rmse', 'mae'):
+    metric."""
+    if _lower_is_better(metric):
         return new_score < old_score
     return new_score > old_score
 
@@ -661,35 +3516,450 @@ def calculate_score(predictions_csv, ground_truth_csv, metric):
         return None, 'This test has no ground truth file configured yet.'
 
     try:
-        truth_data = _parse_id_value_csv(ground_truth_csv, 'Ground truth')
-        pred_data = _parse_id_value_csv(predictions_csv, 'Prediction')
+        truth = GroundTruth(_parse_id_value_csv(ground_truth_csv, 'Ground truth'))
+        return _score_stream(StringIO(predictions_csv), truth, metric)
     except ValueError as e:
         return None, str(e)
 
-    missing = [k for k in truth_data if k not in pred_data]
-    if missing:
+
+def _score_stream(lines, truth, metric):
+    """Parse a prediction CSV from an iterable of lines and score it against
+    a GroundTruth in a single pass. Raises ValueError for malformed input;
+    otherwise returns the calculate_score (score, error) tuple.
+    """
+    pred, error = _align_predictions(lines, truth)
+    if error:
+        return None, error
+    return _score_aligned(pred, truth, metric)
+
+
+def _score_and_sketch(lines, truth, metric):
+    """Like _score_stream, but also return the prediction's MinHash
+    signature: (score, error, signature)."""
+    with metrics.timer(SUBMIT_STAGE, stage='parse'):
+        pred, error = _align_predictions(lines, truth)
+    if error:
+        return None, error, None
+    with metrics.timer(SUBMIT_STAGE, stage='score'):
+        score, error = _score_aligned(pred, truth, metric)
+    with metrics.timer(SUBMIT_STAGE, stage='sketch'):
+        signature = _minhash_signature(pred, truth.values)
+    return score, error, signature
+
+
+def _align_predictions(lines, truth):
+    """Parse a prediction CSV into a buffer aligned with the ground truth.
+
+    Each row is validated and written straight into the buffer, so memory is
+    bounded by the ground truth size no matter how large the upload is. Rows
+    for unknown IDs are validated but ignored, and a repeated ID keeps its
+    last value. Raises ValueError for malformed input; returns (pred, None),
+    or (None, error) when IDs are missing.
+    """
+    if isinstance(truth, CompiledGroundTruth):
+        return _align_compiled(lines, truth)
+    n = len(truth)
+    index = truth.index
+    pred = np.empty(n, dtype=np.float64) if HAS_NUMPY else [0.0] * n
+    seen = bytearray(n)
+    filled = 0
+    rows = 0
+    for key, value in _iter_id_value_rows(lines, 'Prediction'):
+        rows += 1
+        pos = index.get(key)
+        if pos is not None:
+            if not seen[pos]:
+                seen[pos] = 1
+                filled += 1
+            pred[pos] = value
+
+    if not rows:
+        raise ValueError('Prediction contains no data rows.')
+
+    if filled < n:
+        missing = [truth.ids[i] for i in range(n) if not seen[i]]
         sample = ', '.join(str(k) for k in missing[:3])
         return None, (f'Prediction is missing values for {len(missing)} of '
-                      f'{len(truth_data)} IDs (e.g. {sample}).')
+                      f'{n} IDs (e.g. {sample}).')
+    return pred, None
+
+
+def _align_compiled(lines, truth):
+    """_align_predictions against a CompiledGroundTruth: rows are collected
+    in batches and their IDs looked up by binary search."""
+    n = len(truth)
+    pred = np.empty(n, dtype=np.float64)
+    seen = np.zeros(n, dtype=bool)
+    rows = 0
+    keys, values = [], []
+
+    def flush():
+        positions = truth.lookup(keys)
+        batch = np.array(values, dtype=np.float64)
+        known = positions >= 0
+        positions, batch = positions[known], batch[known]
+        # A repeated ID keeps its last value: take each position's last row.
+        unique, last = np.unique(positions[::-1], return_index=True)
+        pred[unique] = batch[::-1][last]
+        seen[unique] = True
+        keys.clear()
+        values.clear()
+
+    for key, value in _iter_id_value_rows(lines, 'Prediction'):
+        rows += 1
+        keys.append(key)
+        values.append(value)
+        if len(keys) >= ALIGN_BATCH_ROWS:
+            flush()
+    if keys:
+        flush()
+
+    if not rows:
+        raise ValueError('Prediction contains no data rows.')
+
+    filled = int(np.count_nonzero(seen))
+    if filled < n:
+        missing = np.flatnonzero(~seen)
+        sample = ', '.join(truth.ids_at(missing[:3]))
+        return None, (f'Prediction is missing values for {len(missing)} of '
+                      f'{n} IDs (e.g. {sample}).')
+    return pred, None
+
+
+# --- Metric registry ---
+#
+# Every metric a test can use is registered here with its direction and two
+# kernels over predictions aligned with the targets: one on float64 arrays
+# (NumPy) and a single-pass pure-Python fallback. Each kernel returns the
+# calculate_score (score, error) tuple. Ranking, comparisons, forms and docs
+# all read the registry, so a new metric needs only a register_metric() call.
+
+class Metric:
+    """A registered scoring metric. kind says what targets it expects:
+    'value' (any number), 'label' (class labels) or 'binary' (0/1)."""
+
+    __slots__ = ('name', 'label', 'lower_is_better', 'kind', 'description', 'arrays', 'lists')
+
+    def __init__(self, name, label, lower_is_better, kind, description, arrays, lists):
+        self.name = name
+        self.label = label
+        self.lower_is_better = lower_is_better
+        self.kind = kind
+        self.description = description
+        self.arrays = arrays
+        self.lists = lists
+
+
+SCORING_METRICS = {}
+
+
+def register_metric(name, label, lower_is_better, kind, description, arrays, lists):
+    SCORING_METRICS[name] = Metric(name, label, lower_is_better, kind, description, arrays, lists)
+
+
+def _ground_truth_kind_error(metric, ground_truth):
+    """Why the ground truth CSV text cannot be scored with metric, or None.
+    Only 'binary' metrics restrict the targets; a file that does not parse is
+    left for scoring to report, as for any other metric."""
+    entry = SCORING_METRICS[metric]
+    if entry.kind != 'binary' or not ground_truth:
+        return None
+    try:
+        targets = _parse_id_value_csv(ground_truth, 'Ground truth').values()
+    except ValueError:
+        return None
+    if any(target not in (0, 1) for target in targets):
+        return f'{entry.label} needs ground truth values of 0 or 1.'
+    return None
+
+
+def _score_aligned(pred, truth, metric):
+    entry = SCORING_METRICS.get(metric)
+    if entry is None:
+        return None, f"Unknown metric '{metric}'."
+    if HAS_NUMPY:
+        return entry.arrays(pred, truth.values)
+    return entry.lists(pred, truth.values)
+
+
+# Probabilities are clipped to [eps, 1 - eps] so log-loss stays finite.
+LOG_LOSS_EPS = 1e-15
+
+
+def _accuracy_arrays(pred, truth):
+    # np.rint rounds half to even, exactly like Python's round().
+    correct = np.count_nonzero(np.rint(pred) == np.rint(truth))
+    return int(correct) / len(truth), None
 
-    if metric == 'accuracy':
-        correct = sum(1 for k in truth_data
-                      if round(pred_data[k]) == round(truth_data[k]))
-        return correct / len(truth_data), None
 
-    elif metric == 'rmse':
-        import math
-        mse = sum((pred_data[k] - truth_data[k]) ** 2 for k in truth_data) / len(truth_data)
-        return math.sqrt(mse), None
+def _accuracy_lists(pred, truth):
+    correct = 0
+    for p, t in zip(pred, truth):
+        if round(p) == round(t):
+            correct += 1
+    return correct / len(truth), None
 
-    elif metric == 'mae':
-        mae = sum(abs(pred_data[k] - truth_data[k]) for k in truth_data) / len(truth_data)
-        return mae, None
 
-    return None, f"Unknown metric '{metric}'."
+def _rmse_arrays(pred, truth):
+    diff = pred - truth
+    return math.sqrt(float(np.dot(diff, diff)) / len(truth)), None
 
 
+def _rmse_lists(pred, truth):
+    total = 0.0
+    for p, t in zip(pred, truth):
+        total += (p - t) ** 2
+    return math.sqrt(total / len(truth)), None
+
+
+def _mae_arrays(pred, truth):
+    return float(np.abs(pred - truth).mean()), None
+
+
+def _mae_lists(pred, truth):
+    total = 0.0
+    for p, t in zip(pred, truth):
+        total += abs(p - t)
+    return total / len(truth), None
+
+
+def _mape_arrays(pred, truth):
+    if not np.all(truth):
+        return None, 'MAPE is undefined when a ground truth value is 0.'
+    return float(np.mean(np.abs((truth - pred) / truth))), None
+
+
+def _mape_lists(pred, truth):
+    total = 0.0
+    for p, t in zip(pred, truth):
+        if t == 0:
+            return None, 'MAPE is undefined when a ground truth value is 0.'
+        total += abs((t - p) / t)
+    return total / len(truth), None
+
+
+def _r2_arrays(pred, truth):
+    diff = pred - truth
+    centered = truth - truth.mean()
+    total = float(np.dot(centered, centered))
+    if total == 0:
+        return None, 'R² is undefined when every ground truth value is the same.'
+    return 1.0 - float(np.dot(diff, diff)) / total, None
+
+
+def _r2_lists(pred, truth):
+    # One pass: residuals plus Welford's running mean/variance of the targets.
+    residual = mean = m2 = 0.0
+    for count, (p, t) in enumerate(zip(pred, truth), 1):
+        residual += (p - t) ** 2
+        delta = t - mean
+        mean += delta / count
+        m2 += delta * (t - mean)
+    if m2 == 0:
+        return None, 'R² is undefined when every ground truth value is the same.'
+    return 1.0 - residual / m2, None
+
+
+def _check_binary_arrays(truth):
+    if not np.all((truth == 0) | (truth == 1)):
+        return 'This metric needs ground truth values of 0 or 1.'
+    return None
+
+
+def _log_loss_arrays(pred, truth):
+    error = _check_binary_arrays(truth)
+    if error:
+        return None, error
+    p = np.clip(pred, LOG_LOSS_EPS, 1 - LOG_LOSS_EPS)
+    return float(-np.mean(np.where(truth == 1, np.log(p), np.log1p(-p)))), None
+
+
+def _log_loss_lists(pred, truth):
+    total = 0.0
+    for p, t in zip(pred, truth):
+        if t not in (0, 1):
+            return None, 'This metric needs ground truth values of 0 or 1.'
+        p = min(max(p, LOG_LOSS_EPS), 1 - LOG_LOSS_EPS)
+        total += math.log(p) if t == 1 else math.log1p(-p)
+    return -total / len(truth), None
+
+
+def _roc_auc_arrays(pred, truth):
+    """Rank-based (Mann-Whitney) AUC in O(n log n); tied predictions share
+    their average rank."""
+    error = _check_binary_arrays(truth)
+    if error:
+        return None, error
+    positives = int(np.count_nonzero(truth))
+    negatives = len(truth) - positives
+    if not positives or not negatives:
+        return None, 'ROC AUC needs both 0 and 1 in the ground truth.'
+    _, inverse, counts = np.unique(pred, return_inverse=True, return_counts=True)
+    average_rank = np.cumsum(counts) - (counts - 1) / 2.0
+    rank_sum = float(average_rank[inverse.ravel()][truth == 1].sum())
+    return (rank_sum - positives * (positives + 1) / 2.0) / (positives * negatives), None
+
+
+def _roc_auc_lists(pred, truth):
+    if any(t not in (0, 1) for t in truth):
+        return None, 'This metric needs ground truth values of 0 or 1.'
+    positives = sum(1 for t in truth if t == 1)
+    negatives = len(truth) - positives
+    if not positives or not negatives:
+        return None, 'ROC AUC needs both 0 and 1 in the ground truth.'
+    order = sorted(range(len(pred)), key=pred.__getitem__)
+    rank_sum = 0.0
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and pred[order[end + 1]] == pred[order[start]]:
+            end += 1
+        average_rank = (start + end) / 2.0 + 1
+        rank_sum += average_rank * sum(1 for i in order[start:end + 1] if truth[i] == 1)
+        start = end + 1
+    return (rank_sum - positives * (positives + 1) / 2.0) / (positives * negatives), None
+
+
+def _f1_arrays(pred, truth):
+    predicted = np.rint(pred) == 1
+    actual = np.rint(truth) == 1
+    tp = int(np.count_nonzero(predicted & actual))
+    denominator = int(np.count_nonzero(predicted)) + int(np.count_nonzero(actual))
+    return (2 * tp / denominator if denominator else 0.0), None
+
+
+def _f1_lists(pred, truth):
+    tp = denominator = 0
+    for p, t in zip(pred, truth):
+        predicted, actual = round(p) == 1, round(t) == 1
+        tp += predicted and actual
+        denominator += predicted + actual
+    return (2 * tp / denominator if denominator else 0.0), None
+
+
+register_metric('accuracy', 'Accuracy', False, 'label',
+                'Fraction of IDs whose rounded prediction equals the rounded target',
+                _accuracy_arrays, _accuracy_lists)
+register_metric('rmse', 'RMSE', True, 'value', 'Root mean squared error', _rmse_arrays, _rmse_lists)
+register_metric('mae', 'MAE', True, 'value', 'Mean absolute error', _mae_arrays, _mae_lists)
+register_metric('r2', 'R²', False, 'value', 'Coefficient of determination', _r2_arrays, _r2_lists)
+register_metric('mape', 'MAPE', True, 'value',
+                'Mean absolute percentage error, as a fraction (targets must be non-zero)',
+                _mape_arrays, _mape_lists)
+register_metric('roc_auc', 'ROC AUC', False, 'binary',
+                'Area under the ROC curve for 0/1 targets; predictions are scores or probabilities',
+                _roc_auc_arrays, _roc_auc_lists)
+register_metric('log_loss', 'Log loss', True, 'binary',
+                'Binary cross-entropy for 0/1 targets; predictions are probabilities of 1',
+                _log_loss_arrays, _log_loss_lists)
+register_metric('f1', 'F1', False, 'binary',
+                'F1 score of class 1, with predictions and targets rounded to labels',
+                _f1_arrays, _f1_lists)
+
+# --- Near-duplicate sketches ---
+#
+# A prediction is treated as the set of (ID position, value rounded to
+# MINHASH_DECIMALS) pairs where the rounded value differs from the ground
+# truth's: its mistakes. Accurate submissions agree wherever they are right,
+# so only shared mistakes say anything about copying. The set is summarised
+# by a one-permutation MinHash: each pair is hashed once, the top bits pick
+# one of MINHASH_SIZE bins and every bin keeps its smallest hash. The
+# fraction of equal bins between two signatures estimates the Jaccard
+# similarity of the two sets, so editing a few values barely moves it while
+# reordering rows doesn't move it at all. Bins are grouped into
+# MINHASH_BANDS bands for the LSH index. The NumPy and pure-Python versions
+# compute bit-identical signatures.
+
+MINHASH_SIZE = 128
+MINHASH_BANDS = 32
+MINHASH_ROWS_PER_BAND = MINHASH_SIZE // MINHASH_BANDS
+MINHASH_DECIMALS = 4
+_MASK64 = (1 << 64) - 1
+_BIN_SHIFT = 64 - 7  # log2(MINHASH_SIZE) top bits pick the bin
+_QUANT_LIMIT = float(1 << 62)
+
+
+def _splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def _splitmix64_array(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _quantize_array(values):
+    """Values rounded to MINHASH_DECIMALS, as int64; 0 where not finite."""
+    with np.errstate(over='ignore', invalid='ignore'):
+        scaled = np.asarray(values, dtype=np.float64) * 10.0 ** MINHASH_DECIMALS
+        ok = np.isfinite(scaled) & (np.abs(scaled) < _QUANT_LIMIT)
+        return np.where(ok, np.rint(np.where(ok, scaled, 0.0)), 0.0).astype(np.int64)
+
+
+def _quantize(value):
+    scaled = value * 10.0 ** MINHASH_DECIMALS
+    return round(scaled) if math.isfinite(scaled) and abs(scaled) < _QUANT_LIMIT else 0
+
+
+def _minhash_signature(pred, truth_values):
+    """MinHash signature of the positions where an aligned prediction buffer
+    differs from the ground truth, as a hex string of MINHASH_SIZE 32-bit
+    bins. None when the prediction is right everywhere."""
+    empty = 1 << 32
+    if HAS_NUMPY:
+        q = _quantize_array(pred)
+        wrong = np.flatnonzero(q != _quantize_array(truth_values))
+        if not wrong.size:
+            return None
+        with np.errstate(over='ignore'):
+            h = _splitmix64_array(_splitmix64_array(wrong.astype(np.uint64)) ^ q[wrong].view(np.uint64))
+        bins = (h >> np.uint64(_BIN_SHIFT)).astype(np.intp)
+        values = (h << np.uint64(7)) >> np.uint64(32)
+        sig = np.full(MINHASH_SIZE, empty, dtype=np.uint64)
+        np.minimum.at(sig, bins, values)
+        sig = [int(v) for v in sig]
+    else:
+        sig = [empty] * MINHASH_SIZE
+        wrong = 0
+        for pos, value in enumerate(pred):
+            q = _quantize(value)
+            if q == _quantize(truth_values[pos]):
+                continue
+            wrong += 1
+            h = _splitmix64(_splitmix64(pos) ^ (q & _MASK64))
+            b = h >> _BIN_SHIFT
+            v = ((h << 7) & _MASK64) >> 32
+            if v < sig[b]:
+                sig[b] = v
+        if not wrong:
+            return None
+    # Fill empty bins from the next non-empty one (with a distance tweak), so
+    # small predictions still give comparable signatures.
+    for i in range(MINHASH_SIZE):
+        if sig[i] == empty:
+            for step in range(1, MINHASH_SIZE):
+                source = sig[(i + step) % MINHASH_SIZE]
+                if source < empty:
+                    sig[i] = (source ^ _splitmix64(step)) & 0xFFFFFFFF
+                    break
+    return ''.join(f'{v:08x}' for v in sig)
+
+
+def _signature_similarity(a, b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    equal = sum(1 for i in range(0, len(a), 8) if a[i:i + 8] == b[i:i + 8])
+    return equal / (len(a) // 8)
+
 if __name__ == '__main__':
+    # Local development: bring the schema up to date before serving.
+    migrate_db()
     # Use PORT from environment or default to 5000
     port = int(os.environ.get('PORT', 5000))
     # Bind to 0.0.0.0 to accept external connections
@@ -0,0 +1,289 @@
+"""Micro-benchmarks for parsing, scoring and leaderboard construction.
+
+Runs against synthetic data and a throwaway SQLite database, so it never
+touches a real deployment:
+
+    python benchmarks/bench.py                    # full run, 1k .. 1M rows
+    python benchmarks/bench.py --quick            # 1k and 10k rows only
+    python benchmarks/bench.py --save-baseline    # record this machine's baseline
+    python benchmarks/bench.py --only score       # benchmarks whose name contains "score"
+
+Results are printed as a table and written as JSON (--output). When a
+baseline exists (benchmarks/baseline.json by default) every benchmark is
+compared against it and the script exits with status 1 if any got slower
+by more than --tolerance.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Point the app at a scratch database before importing it.
+_workdir = tempfile.mkdtemp(prefix='predict-it-bench-')
+os.environ['SQLITE_PATH'] = os.path.join(_workdir, 'bench.db')
+os.environ['GROUND_TRUTH_DIR'] = os.path.join(_workdir, 'ground-truth')
+os.environ['ADMISSION_DIR'] = os.path.join(_workdir, 'admission')
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('PAGE_CACHE_DIR', None)
+sys.path.insert(0, ROOT)
+
+import app as predict_it  # noqa: E402
+
+METRICS = tuple(predict_it.SCORING_METRICS)
+ROW_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+QUICK_ROW_SIZES = (1_000, 10_000)
+LEADERBOARD_SIZES = (1_000, 10_000, 100_000)
+QUICK_LEADERBOARD_SIZES = (1_000,)
+
+
+# --- Synthetic data ---
+
+def make_truth(n, metric, seed=0):
+    """Ground truth as {id: value}: class labels for accuracy, 0/1 for the
+    binary metrics, real values otherwise."""
+    rng = random.Random(seed)
+    kind = predict_it.SCORING_METRICS[metric].kind
+    if kind == 'binary':
+        return {f'id{i}': float(rng.random() < 0.3) for i in range(n)}
+    if kind == 'label':
+        return {f'id{i}': float(rng.randrange(5)) for i in range(n)}
+    return {f'id{i}': round(rng.gauss(50.0, 15.0), 4) for i in range(n)}
+
+
+def make_prediction(truth, metric, seed=1):
+    """A plausible prediction for truth: mostly right labels, probabilities
+    leaning towards the right class, or the truth plus noise, with rows in
+    shuffled order."""
+    rng = random.Random(seed)
+    kind = predict_it.SCORING_METRICS[metric].kind
+    rows = []
+    for key, value in truth.items():
+        if kind == 'binary':
+            rows.append((key, round(min(max(value * 0.4 + rng.random() * 0.6, 0.0), 1.0), 4)))
+        elif kind == 'label':
+            rows.append((key, value if rng.random() < 0.8 else float(rng.randrange(5))))
+        else:
+            rows.append((key, round(value + rng.gauss(0.0, 3.0), 4)))
+    rng.shuffle(rows)
+    return rows
+
+
+def to_csv(rows, header='id,value'):
+    return header + '\n' + ''.join(f'{key},{value}\n' for key, value in rows)
+
+
+def seed_leaderboard(users, seed=2):
+    """Create a test with one best submission per user, including some exact
+    and near copies, and return its id."""
+    rng = random.Random(seed)
+    with predict_it.app.app_context():
+        db = predict_it.get_db_wrapper()
+        test_id = db.execute(
+            'INSERT INTO pi_tests (name, description, start_date, end_date, metric, ground_truth) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (f'bench-{users}', '', '2024-01-01', '2030-01-01', 'rmse', 'id,value\n1,1\n')).lastrowid
+        originals = []
+        for i in range(users):
+            roll = rng.random()
+            if originals and roll < 0.02:
+                digest, signature = rng.choice(originals)  # exact copy
+            else:
+                digest = hashlib.sha256(f'{test_id}-{i}'.encode()).hexdigest()
+                if originals and roll < 0.04:
+                    # Near copy: a few bins differ from an earlier signature.
+                    bins = [originals[-1][1][j:j + 8] for j in range(0, len(originals[-1][1]), 8)]
+                    for j in rng.sample(range(len(bins)), 4):
+                        bins[j] = f'{rng.getrandbits(32):08x}'
+                    signature = ''.join(bins)
+                else:
+                    signature = ''.join(f'{rng.getrandbits(32):08x}' for _ in range(predict_it.MINHASH_SIZE))
+                originals.append((digest, signature))
+            submission_id = db.execute(
+                'INSERT INTO pi_submissions (test_id, username, timestamp, score, filename, filesize, '
+                'content_hash, minhash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (test_id, f'user{i}', f'2024-01-01T00:00:{i % 60:02d}.{i:06d}', rng.uniform(0, 10),
+                 'p.csv', rng.randrange(1000, 100000), digest, signature)).lastrowid
+            predict_it._index_signature(db, test_id, submission_id, signature, replace=False)
+        db.commit()
+    return test_id
+
+
+# --- Timing ---
+
+def measure(fn, repeat):
+    """Run fn repeat times (after one warm-up call) and return the timings."""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def record(results, name, timings, rows):
+    best = min(timings)
+    results[name] = {
+        'seconds': best,
+        'median_seconds': statistics.median(timings),
+        'rows': rows,
+        'rows_per_second': rows / best if best else None,
+    }
+    print(f'{name:<40} {best * 1000:>10.2f} ms  {rows / best if best else 0:>14,.0f} rows/s', flush=True)
+
+
+# --- Benchmarks ---
+
+def bench_parsing_and_scoring(results, sizes, repeat, selected):
+    for n in sizes:
+        for metric in METRICS:
+            truth = make_truth(n, metric)
+            gt_csv = to_csv(truth.items(), 'id,target')
+            pred_csv = to_csv(make_prediction(truth, metric))
+            if metric == METRICS[0] and selected(f'parse_ground_truth[{n}]'):
+                record(results, f'parse_ground_truth[{n}]', measure(
+                    lambda: predict_it.GroundTruth(predict_it._parse_id_value_csv(gt_csv, 'Ground truth')),
+                    repeat), n)
+            if selected(f'calculate_score[{metric},{n}]'):
+                record(results, f'calculate_score[{metric},{n}]', measure(
+                    lambda: predict_it.calculate_score(pred_csv, gt_csv, metric), repeat), n)
+            parsed = predict_it.GroundTruth(predict_it._parse_id_value_csv(gt_csv, 'Ground truth'))
+            if selected(f'score_cached_truth[{metric},{n}]'):
+                # The request path: ground truth already in the cache.
+                record(results, f'score_cached_truth[{metric},{n}]', measure(
+                    lambda: predict_it._score_stream(predict_it.StringIO(pred_csv), parsed, metric), repeat), n)
+            if selected(f'score_compiled_truth[{metric},{n}]'):
+                # Same, against the memory-mapped compiled ground truth.
+                path = os.path.join(_workdir, 'bench.gt')
+                predict_it.compile_ground_truth(gt_csv, path)
+                compiled = predict_it.CompiledGroundTruth(path)
+                record(results, f'score_compiled_truth[{metric},{n}]', measure(
+                    lambda: predict_it._score_stream(predict_it.StringIO(pred_csv), compiled, metric), repeat), n)
+            if metric == METRICS[-1] and selected(f'score_and_sketch[{n}]'):
+                record(results, f'score_and_sketch[{n}]', measure(
+                    lambda: predict_it._score_and_sketch(predict_it.StringIO(pred_csv), parsed, metric),
+                    repeat), n)
+
+
+def bench_is_better_score(results, repeat, selected):
+    n = 1_000_000
+    rng = random.Random(3)
+    pairs = [(rng.random(), rng.random()) for _ in range(n)]
+    for metric in ('accuracy', 'rmse'):
+        name = f'is_better_score[{metric}]'
+        if selected(name):
+            record(results, name, measure(
+                lambda: sum(predict_it._is_better_score(a, b, metric) for a, b in pairs), repeat), n)
+
+
+def bench_leaderboards(results, sizes, repeat, selected):
+    for users in sizes:
+        names = [f'leaderboard_page[{users}]', f'leaderboard_copy_groups[{users}]',
+                 f'leaderboard_csv_export[{users}]']
+        if not any(selected(name) for name in names):
+            continue
+        test_id = seed_leaderboard(users)
+        with predict_it.app.app_context():
+            db = predict_it.get_db_wrapper()
+            test = db.execute('SELECT id, name, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+            page = predict_it._leaderboard_rows(db, test, limit=predict_it.LEADERBOARD_PAGE_SIZE)
+            if selected(names[0]):
+                record(results, names[0], measure(
+                    lambda: predict_it._leaderboard_rows(db, test, limit=predict_it.LEADERBOARD_PAGE_SIZE),
+                    repeat), users)
+            if selected(names[1]):
+                record(results, names[1], measure(
+                    lambda: (predict_it._find_duplicate_content_groups(db, test, page),
+                             predict_it._find_near_duplicate_groups(db, test, page)), repeat), users)
+            if selected(names[2]):
+                record(results, names[2], measure(
+                    lambda: sum(1 for _ in predict_it._leaderboard_rows(db, test, stream=True)), repeat), users)
+
+
+# --- Baseline comparison ---
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline; return the names of the
+    benchmarks that regressed beyond tolerance."""
+    regressions = []
+    print(f'\n{"benchmark":<40} {"baseline":>12} {"current":>12} {"change":>9}')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            print(f'{name:<40} {"-":>12} {result["seconds"] * 1000:>10.2f}ms {"new":>9}')
+            continue
+        change = result['seconds'] / before['seconds'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<40} {before["seconds"] * 1000:>10.2f}ms {result["seconds"] * 1000:>10.2f}ms '
+              f'{change:>+8.1%}{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='small sizes only, for a fast check')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (best is kept)')
+    parser.add_argument('--only', help='run only benchmarks whose name contains this string')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results.json'), help='where to write JSON results')
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'), help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.20,
+                        help='allowed slowdown against the baseline before failing (default 0.20 = 20%%)')
+    args = parser.parse_args(argv)
+
+    selected = (lambda name: args.only in name) if args.only else (lambda name: True)
+    predict_it.migrate_db()
+
+    results = {}
+    bench_parsing_and_scoring(results, QUICK_ROW_SIZES if args.quick else ROW_SIZES, args.repeat, selected)
+    bench_is_better_score(results, args.repeat, selected)
+    bench_leaderboards(results, QUICK_LEADERBOARD_SIZES if args.quick else LEADERBOARD_SIZES,
+                       args.repeat, selected)
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': predict_it.np.__version__ if predict_it.HAS_NUMPY else None,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'\nWrote {args.output}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare against; run with --save-baseline to create one.')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f'\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""End-to-end load test: a contest deadline rush against a real server.
+
+Boots the app under gunicorn (or the Flask development server) on a
+throwaway SQLite database, creates a test, registers --users participants
+and has them all upload prediction files at once while admins keep polling
+the leaderboard and its CSV download:
+
+    python benchmarks/loadtest.py                          # 100 users, 3 uploads each
+    python benchmarks/loadtest.py --users 500 --workers 4  # size gunicorn workers
+    python benchmarks/loadtest.py --database-url postgresql://localhost/predictit_load
+
+--database-url points the app at a PostgreSQL database instead; use an
+empty, throwaway one, since the test creates tables and rows in it.
+
+Reports requests, error rate, throughput and p50/p95/p99 latency per route,
+writes them as JSON (--output), and exits with status 1 if any route's error
+rate is above --max-error-rate. Uploads refused by admission control (429)
+are counted separately, not as errors.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ADMIN_USERNAME = 'loadtest-admin'
+ADMIN_PASSWORD = 'loadtest-admin-password'
+
+
+# --- HTTP client ---
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as they are: the app answers every form POST with
+    one, and following it would time the next page instead."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def encode_multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as
+    multipart/form-data; returns (body, content_type)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: text/csv\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Stats:
+    """Latencies and outcomes per route, shared by all client threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            entry = self.routes.setdefault(route, {'latencies': [], 'statuses': {}})
+            entry['latencies'].append(seconds)
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+
+
+class Client:
+    """One browser: its own cookie jar, so its own session."""
+
+    def __init__(self, base_url, stats, timeout):
+        self.base_url = base_url
+        self.stats = stats
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, route, path, data=None, content_type=None):
+        """Send a request, record it under route and return (status, body).
+        Transport failures are recorded with status 'error'."""
+        req = urllib.request.Request(self.base_url + path, data=data)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            status, body = 'error', str(e).encode()
+        self.stats.record(route, time.perf_counter() - started, status)
+        return status, body
+
+    def post_form(self, route, path, fields):
+        return self.request(route, path, urllib.parse.urlencode(fields).encode(),
+                            'application/x-www-form-urlencoded')
+
+
+# --- Synthetic contest ---
+
+def make_ground_truth(rows, seed=0):
+    rng = random.Random(seed)
+    return [(f'id{i}', round(rng.gauss(50.0, 15.0), 4)) for i in range(rows)]
+
+
+def make_prediction(truth, noise, rng):
+    """The truth plus per-user noise, in shuffled row order."""
+    rows = [(key, round(value + rng.gauss(0.0, noise), 4)) for key, value in truth]
+    rng.shuffle(rows)
+    return ('id,prediction\n' + ''.join(f'{key},{value}\n' for key, value in rows)).encode()
+
+
+# --- Server ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir, port):
+    env = dict(os.environ)
+    env.pop('PAGE_CACHE_DIR', None)
+    env.update({
+        'PORT': str(port),
+        'SQLITE_PATH': os.path.join(workdir, 'loadtest.db'),
+        'SECRET_KEY': uuid.uuid4().hex,
+        'ADMIN_USERNAME': ADMIN_USERNAME,
+        'ADMIN_PASSWORD': ADMIN_PASSWORD,
+        'GROUND_TRUTH_DIR': os.path.join(workdir, 'ground-truth'),
+        'ADMISSION_DIR': os.path.join(workdir, 'admission'),
+    })
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    else:
+        env.pop('DATABASE_URL', None)
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+    if args.no_admission:
+        env['ADMISSION_CONTROL'] = '0'
+
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}']
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with status {process.returncode}; see {log.name}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'Server did not come up within 60 seconds; see {log.name}')
+
+
+# --- Scenario ---
+
+def setup_contest(base_url, stats, args):
+    """Log the admin in and create the test; returns (admin client, test id, truth)."""
+    admin = Client(base_url, stats, args.timeout)
+    admin.post_form('login', '/login', {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+    truth = make_ground_truth(args.rows)
+    ground_truth = ('id,target\n' + ''.join(f'{key},{value}\n' for key, value in truth)).encode()
+    body, content_type = encode_multipart(
+        {'name': f'Load test {time.strftime("%H:%M:%S")}', 'description': 'Synthetic deadline rush',
+         'start_date': '2024-01-01', 'end_date': '2099-12-31', 'metric': args.metric},
+        [('ground_truth', 'ground_truth.csv', ground_truth)])
+    admin.request('create_test', '/admin/create_test', body, content_type)
+    _, page = admin.request('admin', '/admin')
+    test_ids = [int(test_id) for test_id in re.findall(rb'/leaderboard/(\d+)', page)]
+    if not test_ids:
+        raise RuntimeError('Could not create the test (is the admin login working?)')
+    return admin, max(test_ids), truth
+
+
+def register_users(base_url, stats, args):
+    def register(i):
+        client = Client(base_url, stats, args.timeout)
+        username = f'load{i:05d}'
+        client.post_form('register', '/register',
+                         {'username': username, 'password': 'password', 'email': f'{username}@example.com'})
+        client.post_form('login', '/login', {'username': username, 'password': 'password'})
+        return client
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        return list(pool.map(register, range(args.users)))
+
+
+def rush(clients, admin, test_id, truth, args):
+    """Every user uploads args.submissions files while the admin pollers load
+    the leaderboard and its CSV download. Returns the rush duration."""
+    done = threading.Event()
+
+    def participant(i, client):
+        rng = random.Random(1000 + i)
+        time.sleep(rng.uniform(0, args.ramp))
+        noise = rng.uniform(1.0, 10.0)
+        previous = None
+        for _ in range(args.submissions):
+            # Some users re-upload the same file, as people do near a deadline.
+            if previous is None or rng.random() >= args.resubmit_share:
+                previous = make_prediction(truth, noise, rng)
+                noise *= 0.8
+            body, content_type = encode_multipart({}, [('prediction_file', 'prediction.csv', previous)])
+            client.request('submit', f'/test/{test_id}/submit', body, content_type)
+
+    def poller():
+        while not done.is_set():
+            admin.request('leaderboard', f'/leaderboard/{test_id}')
+            admin.request('download_leaderboard', f'/leaderboard/{test_id}/download')
+            done.wait(args.poll_interval)
+
+    pollers = [threading.Thread(target=poller, daemon=True) for _ in range(args.admin_pollers)]
+    started = time.perf_counter()
+    for thread in pollers:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(participant, range(len(clients)), clients))
+    done.set()
+    for thread in pollers:
+        thread.join()
+    return time.perf_counter() - started
+
+
+# --- Report ---
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(stats, duration):
+    report = {}
+    for route, entry in sorted(stats.routes.items()):
+        latencies = sorted(entry['latencies'])
+        statuses = entry['statuses']
+        errors = sum(n for status, n in statuses.items() if status == 'error' or status >= 500
+                     or (status >= 400 and status != 429))
+        report[route] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': errors / len(latencies),
+            'throttled': statuses.get(429, 0),
+            'per_second': len(latencies) / duration if duration else None,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'statuses': {str(status): n for status, n in sorted(statuses.items(), key=str)},
+        }
+    return report
+
+
+def print_report(report, title):
+    print(f'\n{title}')
+    print(f'{"route":<22} {"requests":>8} {"errors":>7} {"429":>6} {"req/s":>8} '
+          f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for route, r in report.items():
+        print(f'{route:<22} {r["requests"]:>8} {r["errors"]:>7} {r["throttled"]:>6} {r["per_second"]:>8.1f} '
+              f'{r["p50_ms"]:>9.1f} {r["p95_ms"]:>9.1f} {r["p99_ms"]:>9.1f} {r["max_ms"]:>9.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100, help='synthetic participants (default 100)')
+    parser.add_argument('--submissions', type=int, default=3, help='uploads per participant (default 3)')
+    parser.add_argument('--rows', type=int, default=10_000, help='rows in the ground truth and each upload')
+    parser.add_argument('--metric', default='rmse', help='metric of the test (default rmse)')
+    parser.add_argument('--resubmit-share', type=float, default=0.2,
+                        help='chance that an upload repeats the user\'s previous file (default 0.2)')
+    parser.add_argument('--concurrency', type=int, default=32, help='participants uploading at once')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which participants start')
+    parser.add_argument('--admin-pollers', type=int, default=2, help='admins polling the leaderboard')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between an admin\'s polls')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn',
+                        help='gunicorn with gunicorn.conf.py (default) or the Flask development server')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (WEB_CONCURRENCY)')
+    parser.add_argument('--database-url', help='throwaway PostgreSQL database to use instead of SQLite')
+    parser.add_argument('--no-admission', action='store_true', help='run with ADMISSION_CONTROL=0')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-request timeout in seconds')
+    parser.add_argument('--output', default=os.path.join(HERE, 'loadtest.json'), help='where to write JSON results')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='fail if any route\'s error rate is above this (default 0.01)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory (database, server log)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='predict-it-load-')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    print(f'Starting {args.server} on {base_url} (scratch directory {workdir})', flush=True)
+    server = start_server(args, workdir, port)
+    try:
+        setup_stats, rush_stats = Stats(), Stats()
+        admin, test_id, truth = setup_contest(base_url, setup_stats, args)
+        started = time.perf_counter()
+        clients = register_users(base_url, setup_stats, args)
+        setup_duration = time.perf_counter() - started
+        print(f'Registered {len(clients)} users; test {test_id} has {args.rows:,} rows ({args.metric})', flush=True)
+
+        admin = Client(base_url, rush_stats, args.timeout)
+        admin.post_form('login', '/login', {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+        for client in clients:
+            client.stats = rush_stats
+        duration = rush(clients, admin, test_id, truth, args)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    setup = summarize(setup_stats, setup_duration)
+    results = summarize(rush_stats, duration)
+    print_report(setup, 'Setup (registration and login)')
+    print_report(results, f'Deadline rush: {duration:.1f}s, {args.users} users x {args.submissions} uploads')
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'duration_seconds': duration,
+                            'args': dict(vars(args), database_url=bool(args.database_url))},
+                   'setup': setup, 'results': results}, f, indent=2, sort_keys=True)
+    print(f'\nWrote {args.output}')
+    if args.keep:
+        print(f'Kept {workdir}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failing = [route for route, r in results.items() if r['error_rate'] > args.max_error_rate]
+    if failing:
+        print(f'Error rate above {args.max_error_rate:.0%} on: {", ".join(failing)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
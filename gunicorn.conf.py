@@ -0,0 +1,55 @@
+"""Gunicorn settings for predict-it.
+
+Gunicorn reads this file automatically when started from the repository
+root (`gunicorn app:app`). Every setting can be overridden from the
+environment:
+
+    WEB_CONCURRENCY         worker processes (default: usable CPUs + 1)
+    GUNICORN_WORKER_CLASS   gthread (default), gevent (needs `pip install gevent`) or sync
+    GUNICORN_THREADS        threads per gthread worker (default 4)
+    GUNICORN_TIMEOUT        seconds before a silent worker is restarted (default 60)
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it, so they share its memory pages, its admin password hash and
+its secret key. Database migrations run once in the master, before any
+worker starts.
+"""
+import os
+
+
+def _usable_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS / Windows
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Scoring is CPU-bound, so more processes than cores doesn't help; threads
+# (or greenlets) cover requests that are just waiting on I/O, such as slow
+# uploads, so they don't hold a whole process.
+workers = int(os.environ.get('WEB_CONCURRENCY', str(_usable_cpus() + 1)))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_connections = 100
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+accesslog = '-'
+
+if worker_class == 'gevent':
+    # Patch the standard library before the preloaded app imports it, not
+    # only in the workers; otherwise its locks and threads stay unpatched.
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def on_starting(server):
+    """Bring the schema up to date before the workers are forked, then close
+    the master's database connections so no worker inherits them."""
+    import app
+
+    for version, description in app.migrate_db():
+        server.log.info('Applied migration %s: %s', version, description)
+    app.close_db_pool()
@@ -0,0 +1,107 @@
+"""Shared fixtures: every test gets a fresh SQLite database, ground truth
+directory and caches, with the schema already migrated."""
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app reads its configuration at import time.
+_workdir = tempfile.mkdtemp(prefix='predict-it-tests-')
+os.environ.update({
+    'SQLITE_PATH': os.path.join(_workdir, 'import.db'),
+    'SECRET_KEY': 'test-secret-key',
+    'ADMIN_USERNAME': 'admin',
+    'ADMIN_PASSWORD': 'admin-password',
+    'GROUND_TRUTH_DIR': os.path.join(_workdir, 'ground-truth'),
+    'ADMISSION_DIR': os.path.join(_workdir, 'admission'),
+    'SUBMIT_RATE_PER_USER': '0',
+    'SUBMIT_RATE_PER_TEST': '0',
+})
+for name in ('DATABASE_URL', 'PAGE_CACHE_DIR', 'ASYNC_SCORING', 'GROUP_COMMIT', 'SUBMISSION_LOG_RETENTION_DAYS'):
+    os.environ.pop(name, None)
+sys.path.insert(0, ROOT)
+
+import app as predict_it  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_app(tmp_path, monkeypatch):
+    """Point the app at an empty, migrated database and empty caches."""
+    monkeypatch.setattr(predict_it, 'SQLITE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(predict_it, 'GROUND_TRUTH_DIR', str(tmp_path / 'ground-truth'))
+    monkeypatch.setattr(predict_it, 'ground_truth_cache', predict_it.GroundTruthCache(16 * 1024 * 1024))
+    monkeypatch.setattr(predict_it, 'page_cache', predict_it.PageCache(64))
+    monkeypatch.setattr(predict_it, 'scoring_slots',
+                        predict_it.ScoringSlots(str(tmp_path / 'admission'), 2, 2, 1))
+    predict_it.close_db_pool()
+    predict_it.migrate_db()
+    yield predict_it
+    predict_it.close_db_pool()
+
+
+@pytest.fixture
+def db():
+    """A database wrapper inside an application context. Commit before
+    making requests with the test client: they share the connection."""
+    with predict_it.app.app_context():
+        yield predict_it.get_db_wrapper()
+
+
+@pytest.fixture
+def client():
+    return predict_it.app.test_client()
+
+
+@pytest.fixture
+def login_as(client):
+    """Sign the test client in as a user (created if needed) or the admin."""
+    def login(username, admin=False):
+        if not admin:
+            with predict_it.app.app_context():
+                db = predict_it.get_db_wrapper()
+                db.execute('INSERT INTO pi_users (username, password, email) VALUES (?, ?, ?) '
+                           'ON CONFLICT (username) DO NOTHING', (username, 'unused', f'{username}@example.com'))
+                db.commit()
+        with client.session_transaction() as session:
+            session['username'] = username
+            session['is_admin'] = admin
+    return login
+
+
+@pytest.fixture
+def make_test(client, login_as):
+    """Create a test through the admin form; returns its id. Leaves the
+    client signed in as the admin."""
+    def create(truth, metric='rmse', name='Test'):
+        login_as('admin', admin=True)
+        response = client.post('/admin/create_test', data={
+            'name': name, 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31',
+            'metric': metric, 'ground_truth': (io.BytesIO(to_csv(truth, 'id,target').encode()), 'truth.csv'),
+        }, content_type='multipart/form-data')
+        assert response.status_code == 302
+        with predict_it.app.app_context():
+            return predict_it.get_db_wrapper().execute('SELECT MAX(id) AS id FROM pi_tests').fetchone()['id']
+    return create
+
+
+@pytest.fixture
+def upload(client):
+    """Upload a prediction as whoever the client is signed in as."""
+    def post(test_id, rows, filename='prediction.csv'):
+        body = rows if isinstance(rows, (str, bytes)) else to_csv(rows)
+        if isinstance(body, str):
+            body = body.encode()
+        return client.post(f'/test/{test_id}/submit', data={'prediction_file': (io.BytesIO(body), filename)},
+                           content_type='multipart/form-data')
+    return post
+
+
+def to_csv(rows, header='id,prediction'):
+    """CSV text for {id: value} or (id, value) pairs."""
+    if isinstance(rows, dict):
+        rows = rows.items()
+    return header + '\n' + ''.join(f'{key},{value}\n' for key, value in rows)
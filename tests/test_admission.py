@@ -0,0 +1,98 @@
+import pytest
+
+import app as predict_it
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(predict_it.time, 'time', clock)
+    return clock
+
+
+def test_user_bucket_allows_a_burst_then_refills(db, clock, monkeypatch):
+    monkeypatch.setattr(predict_it, 'SUBMIT_RATE_PER_USER', 3)
+    assert [predict_it._take_submit_tokens(db, 'alice', 1) for _ in range(3)] == [0, 0, 0]
+    assert predict_it._take_submit_tokens(db, 'alice', 1) == pytest.approx(20.0)
+    # Other users have buckets of their own.
+    assert predict_it._take_submit_tokens(db, 'bob', 1) == 0
+    clock.now += 20
+    assert predict_it._take_submit_tokens(db, 'alice', 1) == 0
+    assert predict_it._take_submit_tokens(db, 'alice', 1) > 0
+
+
+def test_refill_is_capped_at_one_minute_of_uploads(db, clock, monkeypatch):
+    monkeypatch.setattr(predict_it, 'SUBMIT_RATE_PER_USER', 2)
+    predict_it._take_submit_tokens(db, 'alice', 1)
+    clock.now += 3600
+    assert [predict_it._take_submit_tokens(db, 'alice', 1) for _ in range(2)] == [0, 0]
+    assert predict_it._take_submit_tokens(db, 'alice', 1) > 0
+
+
+def test_a_full_test_bucket_takes_no_user_token(db, clock, monkeypatch):
+    monkeypatch.setattr(predict_it, 'SUBMIT_RATE_PER_USER', 2)
+    monkeypatch.setattr(predict_it, 'SUBMIT_RATE_PER_TEST', 1)
+    assert predict_it._take_submit_tokens(db, 'alice', 1) == 0
+    assert predict_it._take_submit_tokens(db, 'alice', 1) == pytest.approx(60.0)
+    tokens = db.execute("SELECT tokens FROM pi_rate_limits WHERE bucket = 'user:alice'").fetchone()['tokens']
+    assert tokens == pytest.approx(1.0)
+
+
+def test_throttled_uploads_get_429_with_retry_after(make_test, login_as, upload, monkeypatch):
+    test_id = make_test({'a': 1.0})
+    monkeypatch.setattr(predict_it, 'SUBMIT_RATE_PER_USER', 1)
+    login_as('alice')
+    assert upload(test_id, {'a': 1.0}).status_code == 302
+    response = upload(test_id, {'a': 1.0})
+    assert response.status_code == 429
+    assert 1 <= int(response.headers['Retry-After']) <= 60
+
+
+@pytest.mark.skipif(not predict_it.HAS_FCNTL, reason='needs flock()')
+def test_scoring_slots_cap_concurrency(tmp_path):
+    slots = predict_it.ScoringSlots(str(tmp_path), 1, 0, 0)
+    with slots.acquire() as first:
+        assert first
+        with slots.acquire() as second:
+            assert not second
+    with slots.acquire() as again:
+        assert again
+
+
+@pytest.mark.skipif(not predict_it.HAS_FCNTL, reason='needs flock()')
+def test_queued_request_waits_for_a_free_slot(tmp_path, monkeypatch):
+    slots = predict_it.ScoringSlots(str(tmp_path), 1, 1, 5)
+    outer = slots.acquire()
+    assert outer.__enter__()
+    sleeps = []
+
+    def release_while_waiting(seconds):
+        sleeps.append(seconds)
+        outer.__exit__(None, None, None)
+
+    monkeypatch.setattr(predict_it.time, 'sleep', release_while_waiting)
+    with slots.acquire() as admitted:
+        assert admitted
+    assert len(sleeps) == 1
+
+
+@pytest.mark.skipif(not predict_it.HAS_FCNTL, reason='needs flock()')
+def test_slot_files_are_kept_in_a_private_directory(tmp_path):
+    directory = tmp_path / 'admission'
+    slots = predict_it.ScoringSlots(str(directory), 1, 0, 0)
+    with slots.acquire() as admitted:
+        assert admitted
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+    directory.chmod(0o777)
+    with pytest.raises(RuntimeError, match='Refusing'):
+        with slots.acquire():
+            pass
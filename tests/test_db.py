@@ -0,0 +1,120 @@
+import threading
+
+import app as predict_it
+
+
+def test_sqlite_pool_keeps_one_tuned_connection_per_thread(tmp_path):
+    pool = predict_it.SQLitePool(str(tmp_path / 'pool.db'), 1234)
+    conn = pool.getconn()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 1234
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.getconn()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    assert pool.stats()['connections_opened'] == 2
+    assert pool.stats()['in_use'] == 2
+
+
+def test_returning_a_connection_discards_its_open_transaction(tmp_path):
+    pool = predict_it.SQLitePool(str(tmp_path / 'pool.db'), 1000)
+    conn = pool.getconn()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.putconn(conn)
+    assert pool.getconn().execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+
+def test_requests_share_the_process_pool(client):
+    pool = predict_it.get_db_pool()
+    client.get('/')
+    client.get('/')
+    assert predict_it.get_db_pool() is pool
+    assert pool.stats()['in_use'] == 0
+
+
+class FakeCursor:
+    """Enough of a psycopg2 cursor to drive PGResult and DBWrapper."""
+
+    def __init__(self, rows, name=None):
+        self.rows = list(rows)
+        self.name = name
+        self.description = None
+        self.itersize = None
+        self.executed = None
+        self.closed = False
+        self.rowcount = len(self.rows)
+
+    def execute(self, query, params):
+        self.executed = (query, params)
+        self.description = [('id',), ('username',)]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        batch, self.rows = self.rows, []
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+
+    def cursor(self, name=None):
+        self.cursors.append(FakeCursor(self.rows, name))
+        return self.cursors[-1]
+
+
+def _postgres_wrapper(rows):
+    db = predict_it.DBWrapper(FakeConnection(rows))
+    db.is_postgres = True
+    return db
+
+
+def test_pg_rows_share_one_column_index():
+    db = _postgres_wrapper([(1, 'alice'), (2, 'bob'), (3, 'carol')])
+    result = db.execute('SELECT id, username FROM pi_users WHERE id > ?', (0,))
+    assert db.db.cursors[0].executed == ('SELECT id, username FROM pi_users WHERE id > %s', (0,))
+    first = result.fetchone()
+    assert first['username'] == 'alice' and first[0] == 1
+    assert first.get('missing', 'default') == 'default'
+    assert dict(first) == {'id': 1, 'username': 'alice'}
+    # Iterating yields values, as with sqlite3.Row, so rows unpack the same way.
+    user_id, username = first
+    assert (user_id, username) == (1, 'alice')
+    assert first.keys() == ['id', 'username']
+    rest = result.fetchall()
+    assert [row['id'] for row in rest] == [2, 3]
+    assert rest[0]._index is rest[1]._index is first._index
+
+
+def test_iterate_streams_from_a_named_cursor_in_batches():
+    db = _postgres_wrapper([(i, f'user{i}') for i in range(7)])
+    rows = db.iterate('SELECT id, username FROM pi_users WHERE id < ?', (10,), batch_size=3)
+    assert [row['id'] for row in rows] == list(range(7))
+    cursor = db.db.cursors[0]
+    assert cursor.name.startswith('pi_stream_')
+    assert cursor.itersize == 3
+    assert cursor.closed
+
+
+def test_iterate_closes_its_cursor_when_abandoned():
+    db = _postgres_wrapper([(i, f'user{i}') for i in range(7)])
+    rows = db.iterate('SELECT id, username FROM pi_users', batch_size=2)
+    assert next(rows)['id'] == 0
+    rows.close()
+    assert db.db.cursors[0].closed
@@ -0,0 +1,49 @@
+import csv
+import io
+import zipfile
+
+import app as predict_it
+from conftest import to_csv
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+PREDICTIONS = {'alice': {'a': 1.0, 'b': 2.0}, 'bob': {'a': 1.5, 'b': 2.0}, 'carol': {'a': 2.0, 'b': 3.0}}
+
+
+def _submit_all(make_test, login_as, upload):
+    test_id = make_test(TRUTH, metric='mae')
+    for user, rows in PREDICTIONS.items():
+        login_as(user)
+        upload(test_id, rows, filename=f'{user}.csv')
+    login_as('admin', admin=True)
+    return test_id
+
+
+def test_leaderboard_csv_is_ranked_and_streamed(make_test, login_as, upload, client, monkeypatch):
+    monkeypatch.setattr(predict_it, 'EXPORT_CHUNK_SIZE', 64)
+    test_id = _submit_all(make_test, login_as, upload)
+    response = client.get(f'/leaderboard/{test_id}/download')
+    assert response.is_streamed
+    chunks = list(response.response)
+    assert len(chunks) > 1
+    rows = list(csv.reader(io.StringIO(''.join(c if isinstance(c, str) else c.decode() for c in chunks))))
+    assert rows[0][:3] == ['Rank', 'Username', 'Score']
+    assert [row[:2] for row in rows[1:]] == [['1', 'alice'], ['2', 'bob'], ['3', 'carol']]
+    assert rows[1][4] == 'alice.csv'
+
+
+def test_zip_export_contains_every_best_file(make_test, login_as, upload, client, monkeypatch):
+    monkeypatch.setattr(predict_it, 'EXPORT_CHUNK_SIZE', 8)
+    test_id = _submit_all(make_test, login_as, upload)
+    response = client.get(f'/leaderboard/{test_id}/download_all')
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.testzip() is None
+        files = {name.split('_', 1)[1]: archive.read(name).decode() for name in archive.namelist()}
+    assert files == {f'{user}_{user}.csv': to_csv(rows) for user, rows in PREDICTIONS.items()}
+
+
+def test_exports_require_admin(make_test, login_as, client):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    for path in (f'/leaderboard/{test_id}/download', f'/leaderboard/{test_id}/download_all'):
+        assert client.get(path).status_code == 302
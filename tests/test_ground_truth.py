@@ -0,0 +1,122 @@
+import io
+import os
+
+import pytest
+
+import app as predict_it
+from conftest import to_csv
+
+TRUTH = {'a': 1.0, 'b': 2.0, 'c': 3.0}
+
+
+def test_cache_evicts_least_recently_used_by_size():
+    cache = predict_it.GroundTruthCache(100)
+    cache.put((1, 1), 'one', 40)
+    cache.put((2, 1), 'two', 40)
+    assert cache.get((1, 1)) == 'one'
+    cache.put((3, 1), 'three', 40)
+    assert cache.get((2, 1)) is None
+    assert cache.get((1, 1)) == 'one'
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 80
+
+
+def test_cache_skips_entries_larger_than_its_budget():
+    cache = predict_it.GroundTruthCache(100)
+    cache.put((1, 1), 'small', 10)
+    cache.put((2, 1), 'huge', 200)
+    assert cache.get((2, 1)) is None
+    assert cache.get((1, 1)) == 'small'
+
+
+def test_invalidate_drops_every_version_of_a_test():
+    cache = predict_it.GroundTruthCache(100)
+    cache.put((1, 1), 'v1', 10)
+    cache.put((1, 2), 'v2', 10)
+    cache.put((2, 1), 'other', 10)
+    cache.invalidate(1)
+    assert cache.get((1, 1)) is None and cache.get((1, 2)) is None
+    assert cache.get((2, 1)) == 'other'
+    assert cache.stats()['bytes'] == 10
+
+
+def test_submissions_parse_the_ground_truth_once(make_test, login_as, upload):
+    test_id = make_test(TRUTH)
+    for user in ('alice', 'bob'):
+        login_as(user)
+        upload(test_id, {'a': 1.0, 'b': 2.0, 'c': 3.5 if user == 'bob' else 3.0})
+    stats = predict_it.ground_truth_cache.stats()
+    assert stats['entries'] == 1
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+
+def test_new_ground_truth_is_not_served_from_the_cache(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    upload(test_id, TRUTH)
+    login_as('admin', admin=True)
+    client.post(f'/admin/edit_test/{test_id}', data={
+        'name': 'Test', 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31',
+        'metric': 'rmse', 'ground_truth': (io.BytesIO(to_csv({'a': 2.0, 'b': 2.0, 'c': 3.0}).encode()), 'truth.csv'),
+    }, content_type='multipart/form-data')
+    login_as('bob')
+    upload(test_id, TRUTH)
+    score = db.execute("SELECT score FROM pi_submissions WHERE username = 'bob'").fetchone()['score']
+    assert abs(score - (1 / 3) ** 0.5) < 1e-9
+
+
+def test_compiled_and_parsed_ground_truth_score_alike(tmp_path):
+    text = to_csv({f'id{i}': i * 0.5 for i in range(1000)}, 'id,target')
+    path = str(tmp_path / 'truth.gt')
+    predict_it.compile_ground_truth(text, path)
+    compiled = predict_it.CompiledGroundTruth(path)
+    parsed = predict_it.GroundTruth(predict_it._parse_id_value_csv(text, 'Ground truth'))
+    assert len(compiled) == len(parsed) == 1000
+    rows = [(f'id{i}', i * 0.5 + (1.0 if i % 3 == 0 else 0.0)) for i in reversed(range(1000))] + [('extra', 1.0)]
+    for metric in ('mae', 'rmse'):
+        lines = to_csv(rows).splitlines(keepends=True)
+        assert predict_it._score_stream(lines, compiled, metric) == predict_it._score_stream(lines, parsed, metric)
+
+
+def test_compiled_file_is_rebuilt_if_removed_before_it_is_opened(make_test, db, monkeypatch):
+    test_id = make_test(TRUTH)
+    test = db.execute('SELECT id, ground_truth_version, ground_truth_hash FROM pi_tests WHERE id = ?',
+                      (test_id,)).fetchone()
+    original = predict_it._compiled_ground_truth_path
+    calls = []
+
+    def removed_after_check(db, test):
+        path = original(db, test)
+        if not calls:
+            os.remove(path)
+        calls.append(path)
+        return path
+
+    monkeypatch.setattr(predict_it, '_compiled_ground_truth_path', removed_after_check)
+    truth = predict_it._get_ground_truth(db, test)
+    assert isinstance(truth, predict_it.CompiledGroundTruth)
+    assert len(calls) == 2 and os.path.exists(calls[0])
+    lines = to_csv(TRUTH).splitlines(keepends=True)
+    assert predict_it._score_stream(lines, truth, 'mae') == (0.0, None)
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX file ownership')
+def test_compiled_files_are_kept_in_a_private_directory(make_test, db):
+    test_id = make_test(TRUTH)
+    assert os.stat(predict_it.GROUND_TRUTH_DIR).st_mode & 0o777 == 0o700
+    assert os.listdir(predict_it.GROUND_TRUTH_DIR)
+    # A directory others can write to could hold planted files.
+    os.chmod(predict_it.GROUND_TRUTH_DIR, 0o777)
+    test = db.execute('SELECT id, ground_truth_version, ground_truth_hash FROM pi_tests WHERE id = ?',
+                      (test_id,)).fetchone()
+    with pytest.raises(RuntimeError, match='Refusing'):
+        predict_it._get_ground_truth(db, test)
+
+
+def test_a_symlinked_ground_truth_directory_is_refused(tmp_path, monkeypatch):
+    (tmp_path / 'elsewhere').mkdir(mode=0o700)
+    os.symlink(tmp_path / 'elsewhere', tmp_path / 'link')
+    with pytest.raises(RuntimeError, match='Refusing'):
+        predict_it._private_directory(str(tmp_path / 'link'))
+
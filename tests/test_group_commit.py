@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import app as predict_it
+
+
+class RecordingCommitter(predict_it.GroupCommitter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.batches = []
+
+    def _commit(self, db, batch):
+        self.batches.append(len(batch))
+        super()._commit(db, batch)
+
+
+def _insert(db, value):
+    if value < 0:
+        raise ValueError('negative')
+    db.execute('INSERT INTO pi_rate_limits (bucket, tokens, updated) VALUES (?, ?, 0)', (f'v{value}', value))
+    return value * 10
+
+
+def _submit_concurrently(committer, values):
+    results, errors, ready = {}, {}, threading.Barrier(len(values))
+
+    def run(value):
+        ready.wait()
+        try:
+            results[value] = committer.submit(_insert, value)
+        except ValueError as e:
+            errors[value] = e
+
+    threads = [threading.Thread(target=run, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def _stored(db):
+    db.commit()
+    return sorted(row['tokens'] for row in db.execute("SELECT tokens FROM pi_rate_limits WHERE bucket LIKE 'v%'"))
+
+
+def test_concurrent_writes_share_a_transaction(db):
+    committer = RecordingCommitter(0.2, 64)
+    results, errors = _submit_concurrently(committer, [1, 2, 3, 4, 5])
+    assert results == {value: value * 10 for value in [1, 2, 3, 4, 5]} and not errors
+    assert sum(committer.batches) == 5 and len(committer.batches) < 5
+    assert _stored(db) == [1, 2, 3, 4, 5]
+
+
+def test_batches_are_capped(db):
+    committer = RecordingCommitter(0.2, 2)
+    _submit_concurrently(committer, [1, 2, 3, 4, 5])
+    assert max(committer.batches) <= 2
+
+
+def test_a_failing_write_only_fails_its_own_request(db):
+    committer = RecordingCommitter(0.2, 64)
+    results, errors = _submit_concurrently(committer, [1, -1, 2])
+    assert results == {1: 10, 2: 20}
+    assert list(errors) == [-1]
+    assert _stored(db) == [1, 2]
+
+
+@pytest.fixture
+def group_commit(monkeypatch):
+    monkeypatch.setattr(predict_it, 'GROUP_COMMIT', True)
+    monkeypatch.setattr(predict_it, 'group_committer', RecordingCommitter(0.001, 64))
+    return predict_it.group_committer
+
+
+def test_uploads_are_recorded_through_the_batch_writer(group_commit, make_test, login_as, upload, db):
+    test_id = make_test({'a': 1.0, 'b': 2.0}, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 3.0})
+    upload(test_id, {'a': 1.0, 'b': 2.0})
+    assert group_commit.batches == [1, 1]
+    db.commit()
+    assert db.execute('SELECT score FROM pi_submissions').fetchone()['score'] == 0.0
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 2
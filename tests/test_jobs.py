@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+import app as predict_it
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    """Turn on ASYNC_SCORING, recording jobs handed to the pool instead of
+    scoring them in spawned processes (which would not see this test's
+    database)."""
+    jobs = []
+    monkeypatch.setattr(predict_it, 'ASYNC_SCORING', True)
+    monkeypatch.setattr(predict_it, '_job_sweeper_pid', os.getpid())
+    monkeypatch.setattr(predict_it, '_dispatch_scoring_job', jobs.append)
+    return jobs
+
+
+def _job(db, job_id):
+    return db.execute('SELECT * FROM pi_jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def test_queued_jobs_reference_the_stored_file(make_test, login_as, upload, dispatched, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 3.0})
+    [job_id] = dispatched
+    job = _job(db, job_id)
+    assert job['status'] == 'queued'
+    assert job['content'] is None
+    blob = db.execute('SELECT codec, data, content FROM pi_blobs WHERE hash = ?', (job['content_hash'],)).fetchone()
+    assert predict_it._blob_text(blob) == 'id,prediction\na,1.0\nb,3.0\n'
+
+    predict_it._run_scoring_job(job_id)
+    job = _job(db, job_id)
+    assert (job['status'], job['score']) == ('done', 0.5)
+    row = db.execute('SELECT score, content_hash FROM pi_submissions WHERE username = ?', ('alice',)).fetchone()
+    assert (row['score'], row['content_hash']) == (0.5, job['content_hash'])
+
+    # A second copy of the same job (e.g. requeued) finds it taken.
+    predict_it._run_scoring_job(job_id)
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 1
+
+
+def test_rejected_jobs_release_their_file(make_test, login_as, upload, dispatched, db):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    upload(test_id, {'a': 1.0})
+    [job_id] = dispatched
+    predict_it._run_scoring_job(job_id)
+    job = _job(db, job_id)
+    assert job['status'] == 'rejected'
+    assert 'missing values' in job['error']
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 0
+
+
+def test_unreadable_uploads_are_refused_before_queueing(make_test, login_as, upload, dispatched, db):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    upload(test_id, b'id,prediction\na,\xff\n')
+    assert not dispatched
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_jobs').fetchone()['n'] == 0
+
+
+def test_jobs_whose_lease_ran_out_are_requeued(make_test, login_as, upload, dispatched, db):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    upload(test_id, TRUTH)
+    upload(test_id, {'a': 1.0, 'b': 2.5})
+    orphaned, live = dispatched
+    dispatched.clear()
+    # The first job's worker died mid-scoring; the second is still leased.
+    db.execute("UPDATE pi_jobs SET status = 'running', lease_expires = 0 WHERE id = ?", (orphaned,))
+    db.commit()
+
+    assert predict_it.requeue_stale_jobs(db) == [orphaned]
+    assert dispatched == [orphaned]
+    assert _job(db, orphaned)['status'] == 'queued'
+    assert predict_it.requeue_stale_jobs(db) == []
+
+    predict_it._run_scoring_job(orphaned)
+    assert _job(db, orphaned)['status'] == 'done'
+
+
+def test_a_worker_dying_before_commit_leaves_the_job_to_be_rescored_once(make_test, login_as, upload, dispatched,
+                                                                         db, monkeypatch):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 3.0})
+    [job_id] = dispatched
+    finish_job = predict_it._finish_job
+
+    def die_after_finishing(*args):
+        finish_job(*args)
+        raise SystemExit('worker killed')
+
+    monkeypatch.setattr(predict_it, '_finish_job', die_after_finishing)
+    with pytest.raises(SystemExit):
+        predict_it._run_scoring_job(job_id)
+    # The dead worker's connection goes away with its open transaction.
+    db.rollback()
+    assert _job(db, job_id)['status'] == 'running'
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 0
+
+    monkeypatch.setattr(predict_it, '_finish_job', finish_job)
+    db.execute('UPDATE pi_jobs SET lease_expires = 0 WHERE id = ?', (job_id,))
+    db.commit()
+    assert predict_it.requeue_stale_jobs(db) == [job_id]
+    predict_it._run_scoring_job(job_id)
+    assert (_job(db, job_id)['status'], _job(db, job_id)['score']) == ('done', 0.5)
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 1
+
+
+def test_migration_moves_unfinished_job_text_into_blobs(db):
+    db.execute("INSERT INTO pi_jobs (test_id, username, created, status, content) "
+               "VALUES (1, 'alice', '2024-01-01', 'queued', 'id,p\na,1\n')")
+    db.execute("INSERT INTO pi_jobs (test_id, username, created, status, content) "
+               "VALUES (1, 'bob', '2024-01-01', 'failed', 'id,p\na,2\n')")
+    predict_it._migration_job_blobs(db)
+    queued, failed = db.execute('SELECT * FROM pi_jobs ORDER BY id').fetchall()
+    assert queued['content'] is None and queued['lease_expires'] == 0
+    blob = db.execute('SELECT codec, data, content FROM pi_blobs WHERE hash = ?', (queued['content_hash'],)).fetchone()
+    assert predict_it._blob_text(blob) == 'id,p\na,1\n'
+    assert failed['content'] is None and failed['content_hash'] is None
@@ -0,0 +1,62 @@
+import html
+import re
+
+import app as predict_it
+
+
+def _seed(db, metric, scores):
+    """A test with one best submission per (username, score, timestamp)."""
+    test_id = db.execute("INSERT INTO pi_tests (name, metric) VALUES ('Board', ?)", (metric,)).lastrowid
+    for username, score, timestamp in scores:
+        db.execute('INSERT INTO pi_submissions (test_id, username, timestamp, score) VALUES (?, ?, ?, ?)',
+                   (test_id, username, timestamp, score))
+    db.commit()
+    return db.execute('SELECT id, name, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+
+
+SCORES = [('ann', 0.5, '2024-01-03'), ('ben', 0.25, '2024-01-02'), ('cat', 0.5, '2024-01-01'),
+          ('dan', 0.75, '2024-01-01'), ('eve', 0.5, '2024-01-01'), ('fay', 0.1, '2024-01-05')]
+
+
+def _walk(db, test, page_size):
+    pages, after = [], None
+    while True:
+        rows = predict_it._leaderboard_rows(db, test, limit=page_size, after=after)
+        if not rows:
+            return pages
+        pages.append([row['username'] for row in rows])
+        last = rows[-1]
+        after = (last['score'], last['timestamp'], last['id'], 0)
+
+
+def test_keyset_pages_follow_the_ranking(db):
+    for metric, expected in (('rmse', ['fay', 'ben', 'cat', 'eve', 'ann', 'dan']),
+                             ('accuracy', ['dan', 'cat', 'eve', 'ann', 'ben', 'fay'])):
+        test = _seed(db, metric, SCORES)
+        assert [row['username'] for row in predict_it._leaderboard_rows(db, test)] == expected
+        for page_size in (1, 2, 4):
+            pages = _walk(db, test, page_size)
+            assert [name for page in pages for name in page] == expected
+            assert all(len(page) <= page_size for page in pages)
+
+
+def test_leaderboard_pages_link_to_the_next_and_keep_ranks(db, client, login_as, monkeypatch):
+    test = _seed(db, 'rmse', SCORES)
+    monkeypatch.setattr(predict_it, 'LEADERBOARD_PAGE_SIZE', 4)
+    login_as('admin', admin=True)
+
+    first = client.get(f"/leaderboard/{test['id']}").get_data(as_text=True)
+    assert 'First page' not in first
+    next_url = html.unescape(re.search(r'href="([^"]*after=[^"]*)"', first).group(1))
+
+    second = client.get(next_url).get_data(as_text=True)
+    assert 'First page' in second
+    assert 'after=' not in second
+    ranks = re.findall(r'<td>(\d+)</td>\s*<td>(\w+)</td>', second)
+    assert ranks == [('5', 'ann'), ('6', 'dan')]
+
+
+def test_invalid_cursors_fall_back_to_the_first_page():
+    assert predict_it._parse_leaderboard_cursor(None) is None
+    assert predict_it._parse_leaderboard_cursor('1.5|2024|x|0') is None
+    assert predict_it._parse_leaderboard_cursor('1.5|2024-01-01T00:00:00|7|100') == (1.5, '2024-01-01T00:00:00', 7, 100)
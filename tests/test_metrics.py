@@ -0,0 +1,50 @@
+import app as predict_it
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = predict_it.Metrics()
+    registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        registry.observe('latency_seconds', value, stage='parse')
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="parse",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{stage="parse",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{stage="parse"} 4' in lines
+    assert 'latency_seconds_sum{stage="parse"} 6.05' in lines
+
+
+def test_counters_and_label_escaping():
+    registry = predict_it.Metrics()
+    registry.counter('uploads_total', 'Uploads.')
+    registry.inc('uploads_total', outcome='accepted')
+    registry.inc('uploads_total', 2, outcome='accepted')
+    registry.inc('uploads_total', outcome='say "hi"\n')
+    lines = registry.render(gauges=[('queue_depth', 'Queue depth.', 7)]).splitlines()
+    assert '# TYPE uploads_total counter' in lines
+    assert 'uploads_total{outcome="accepted"} 3' in lines
+    assert 'uploads_total{outcome="say \\"hi\\"\\n"} 1' in lines
+    assert lines[-2:] == ['# TYPE queue_depth gauge', 'queue_depth 7']
+
+
+def test_metrics_endpoint_requires_admin_or_token(client, login_as, monkeypatch):
+    assert client.get('/metrics').status_code == 403
+    monkeypatch.setattr(predict_it, 'METRICS_TOKEN', 'scrape-token')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    login_as('admin', admin=True)
+    assert client.get('/metrics').status_code == 200
+
+
+def test_uploads_are_timed_by_stage(make_test, login_as, upload, client):
+    test_id = make_test({'a': 1.0})
+    login_as('alice')
+    upload(test_id, {'a': 1.0})
+    login_as('admin', admin=True)
+    body = client.get('/metrics').get_data(as_text=True)
+    for stage in ('parse', 'score', 'sketch'):
+        assert f'predictit_submit_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'predictit_requests_total{endpoint="submit_prediction",method="POST",status="302"}' in body
+    assert 'predictit_page_cache_hits' in body
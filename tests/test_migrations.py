@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+
+import app as predict_it
+
+
+def _versions(db):
+    return [row['version'] for row in db.execute('SELECT version FROM pi_schema_version ORDER BY version')]
+
+
+def test_every_migration_is_applied_once(db):
+    assert _versions(db) == [version for version, _, _ in predict_it.MIGRATIONS]
+    assert predict_it.migrate_db() == []
+
+
+def test_concurrent_migrations_apply_each_step_once(fresh_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(predict_it, 'SQLITE_PATH', str(tmp_path / 'concurrent.db'))
+    predict_it.close_db_pool()
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(predict_it.migrate_db())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    versions = sorted(version for applied in results for version, _ in applied)
+    assert versions == [version for version, _, _ in predict_it.MIGRATIONS]
+
+
+def test_databases_from_before_versioning_are_adopted(fresh_app, tmp_path, monkeypatch):
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE pi_users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                               password TEXT NOT NULL, email TEXT NOT NULL);
+        CREATE TABLE pi_tests (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT,
+                               start_date TEXT, end_date TEXT, metric TEXT, ground_truth TEXT);
+        CREATE TABLE pi_submissions (id INTEGER PRIMARY KEY AUTOINCREMENT, test_id INTEGER NOT NULL,
+                                     username TEXT NOT NULL, timestamp TEXT NOT NULL, score REAL NOT NULL,
+                                     filename TEXT);
+        INSERT INTO pi_tests (name, metric, ground_truth) VALUES ('Old', 'rmse', 'id,target
+a,1
+');
+        INSERT INTO pi_submissions (test_id, username, timestamp, score, filename)
+            VALUES (1, 'alice', '2024-01-01T00:00:00', 0.5, 'first.csv'),
+                   (1, 'alice', '2024-01-02T00:00:00', 0.2, 'second.csv'),
+                   (1, 'bob', '2024-01-01T00:00:00', 0.3, 'bob.csv');
+    ''')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(predict_it, 'SQLITE_PATH', str(path))
+    predict_it.close_db_pool()
+
+    applied = predict_it.migrate_db()
+    assert [version for version, _ in applied] == [version for version, _, _ in predict_it.MIGRATIONS]
+    with predict_it.app.app_context():
+        db = predict_it.get_db_wrapper()
+        rows = db.execute('SELECT username, score, filename FROM pi_submissions ORDER BY username').fetchall()
+        assert [tuple(row) for row in rows] == [('alice', 0.2, 'second.csv'), ('bob', 0.3, 'bob.csv')]
+        assert predict_it._load_ground_truth_text(db, 1) == 'id,target\na,1\n'
+        test = db.execute('SELECT ground_truth, ground_truth_codec, ground_truth_hash FROM pi_tests').fetchone()
+        assert test['ground_truth'] is None and test['ground_truth_codec'] and test['ground_truth_hash']
+
+
+def test_migrate_command_reports_what_it_did():
+    result = predict_it.app.test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0
+    assert result.output == 'Database schema is up to date.\n'
@@ -0,0 +1,82 @@
+import random
+
+import app as predict_it
+
+N = 1000
+
+
+def _binary_truth(seed=0):
+    rng = random.Random(seed)
+    return {f'id{i}': float(rng.randint(0, 1)) for i in range(N)}
+
+
+def _with_mistakes(truth, rate, seed):
+    rng = random.Random(seed)
+    return {key: (1.0 - value if rng.random() < rate else value) for key, value in truth.items()}
+
+
+def _pairs(db):
+    db.commit()
+    return db.execute('SELECT a, b, similarity FROM pi_near_duplicates').fetchall()
+
+
+def test_numpy_and_pure_python_signatures_agree(monkeypatch):
+    truth = predict_it.GroundTruth(_binary_truth())
+    pred = [value + (0.5 if i % 7 == 0 else 0.0) for i, value in enumerate(truth.values.tolist())]
+    vectorized = predict_it._minhash_signature(predict_it.np.array(pred), truth.values)
+    monkeypatch.setattr(predict_it, 'HAS_NUMPY', False)
+    assert predict_it._minhash_signature(pred, truth.values.tolist()) == vectorized
+
+
+def test_a_perfect_prediction_has_no_signature():
+    truth = predict_it.GroundTruth(_binary_truth())
+    assert predict_it._minhash_signature(truth.values.copy(), truth.values) is None
+
+
+def test_independent_accurate_submissions_are_not_flagged(make_test, login_as, upload, db):
+    truth = _binary_truth()
+    test_id = make_test(truth, metric='accuracy')
+    for seed, user in enumerate(['alice', 'bob', 'carol', 'dave'], 1):
+        login_as(user)
+        upload(test_id, _with_mistakes(truth, 0.05, seed))
+    assert _pairs(db) == []
+
+
+def test_a_near_copy_is_flagged(make_test, login_as, upload, db):
+    truth = _binary_truth()
+    test_id = make_test(truth, metric='accuracy')
+    original = _with_mistakes(truth, 0.05, 1)
+    copy = dict(original)
+    # Fix one of the original's mistakes, so the files differ.
+    wrong = next(key for key in truth if original[key] != truth[key])
+    copy[wrong] = truth[wrong]
+    for user, rows in (('alice', original), ('bob', copy), ('carol', _with_mistakes(truth, 0.05, 2))):
+        login_as(user)
+        upload(test_id, rows)
+    pairs = _pairs(db)
+    assert len(pairs) == 1
+    assert pairs[0]['similarity'] >= predict_it.NEAR_DUP_THRESHOLD
+    test = db.execute('SELECT id, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    entries = db.execute('SELECT id, username FROM pi_submissions').fetchall()
+    groups = predict_it._find_near_duplicate_groups(db, test, entries)
+    flagged = {row['username'] for row in entries if row['id'] in groups}
+    assert flagged == {'alice', 'bob'}
+
+
+def test_candidates_per_bucket_are_capped(make_test, login_as, upload, db, monkeypatch):
+    truth = _binary_truth()
+    test_id = make_test(truth, metric='accuracy')
+    rows = _with_mistakes(truth, 0.05, 1)
+    users = ['alice', 'bob', 'carol', 'dave']
+    for user in users:
+        login_as(user)
+        upload(test_id, rows)
+    # Every band of the next identical submission lands in a bucket the
+    # four earlier ones share; with a cap of 1 each bucket offers one.
+    monkeypatch.setattr(predict_it, 'NEAR_DUP_BUCKET_CAP', 1)
+    login_as('erin')
+    upload(test_id, rows)
+    erin = db.execute("SELECT id FROM pi_submissions WHERE username = 'erin'").fetchone()['id']
+    pairs = [pair for pair in _pairs(db) if erin in (pair['a'], pair['b'])]
+    assert 1 <= len(pairs) < len(users)
+    assert len(_pairs(db)) - len(pairs) == len(users) * (len(users) - 1) // 2
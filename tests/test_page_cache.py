@@ -0,0 +1,66 @@
+import threading
+
+import app as predict_it
+
+
+def _sign_in(login_as, client, username):
+    login_as(username)
+    # Pages showing a flash message (make_test leaves one) are never cached.
+    with client.session_transaction() as session:
+        session.pop('_flashes', None)
+
+
+def _stats():
+    with predict_it.app.app_context():
+        return predict_it._page_cache_stats()
+
+
+def test_unchanged_page_is_served_from_cache_then_as_304(make_test, login_as, client):
+    test_id = make_test({'a': 1.0})
+    _sign_in(login_as, client, 'alice')
+    before = _stats()
+    first = client.get(f'/test/{test_id}')
+    second = client.get(f'/test/{test_id}')
+    assert first.status_code == second.status_code == 200
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert second.get_data() == first.get_data()
+    revalidated = client.get(f'/test/{test_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    after = _stats()
+    assert after['misses'] - before['misses'] == 1
+    assert after['hits'] - before['hits'] == 1
+    assert after['not_modified'] - before['not_modified'] == 1
+
+
+def test_writes_change_the_etag(make_test, login_as, upload, client):
+    test_id = make_test({'a': 1.0})
+    _sign_in(login_as, client, 'alice')
+    etag = client.get(f'/test/{test_id}').headers['ETag']
+    upload(test_id, {'a': 1.0})
+    client.get(f'/test/{test_id}')  # consumes the flash message
+    response = client.get(f'/test/{test_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_other_users_do_not_share_a_cached_page(make_test, login_as, client):
+    test_id = make_test({'a': 1.0})
+    _sign_in(login_as, client, 'alice')
+    etag = client.get(f'/test/{test_id}').headers['ETag']
+    _sign_in(login_as, client, 'bob')
+    assert client.get(f'/test/{test_id}', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_counters_are_not_lost_under_concurrency():
+    before = _stats()['hits']
+
+    def count():
+        for _ in range(10000):
+            predict_it._count_page('hits')
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _stats()['hits'] - before == 80000
@@ -0,0 +1,170 @@
+import io
+import time
+
+import app as predict_it
+from conftest import to_csv
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+
+
+def _change_truth(client, login_as, test_id, truth, metric='mae'):
+    login_as('admin', admin=True)
+    client.post(f'/admin/edit_test/{test_id}', data={
+        'name': 'Test', 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31',
+        'metric': metric, 'ground_truth': (io.BytesIO(to_csv(truth, 'id,target').encode()), 'truth.csv'),
+    }, content_type='multipart/form-data')
+
+
+def _wait_for_run(client, test_id):
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        run = client.get(f'/admin/rescore/{test_id}/status').get_json()
+        if run['status'] != 'running':
+            return run
+        time.sleep(0.05)
+    raise AssertionError('re-score did not finish')
+
+
+def _scores(db):
+    db.commit()
+    return {row['username']: row['score'] for row in db.execute('SELECT username, score FROM pi_submissions')}
+
+
+def test_rescore_reselects_each_users_best(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 2.0})
+    upload(test_id, {'a': 3.0, 'b': 2.0})
+    _change_truth(client, login_as, test_id, {'a': 3.0, 'b': 2.0})
+    with predict_it.app.app_context():
+        summary = predict_it.rescore_test(test_id, workers=1)
+    assert summary['rescored'] == 1 and summary['failed'] == 0
+    assert _scores(db) == {'alice': 0.0}
+
+
+def test_admin_rescore_runs_in_the_background(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    for user in ('alice', 'bob'):
+        login_as(user)
+        upload(test_id, {'a': 1.0, 'b': 2.0 if user == 'alice' else 3.0})
+    _change_truth(client, login_as, test_id, {'a': 1.0, 'b': 3.0})
+    response = client.post(f'/admin/rescore/{test_id}')
+    assert response.status_code == 302
+    run = _wait_for_run(client, test_id)
+    assert run['status'] == 'done'
+    assert run['done'] == run['total'] == 2
+    assert run['message'].startswith('Re-scored 2 submissions')
+    assert _scores(db) == {'alice': 0.5, 'bob': 0.0}
+    assert run['message'] in client.get(f'/leaderboard/{test_id}').get_data(as_text=True)
+
+
+def test_only_one_rescore_runs_at_a_time(make_test, client, db):
+    test_id = make_test(TRUTH)
+    db.execute("INSERT INTO pi_rescore_runs (test_id, started, status, done, heartbeat) "
+               "VALUES (?, '2024-01-01', 'running', 0, ?)", (test_id, time.time()))
+    db.commit()
+    client.post(f'/admin/rescore/{test_id}')
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_rescore_runs').fetchone()['n'] == 1
+
+
+def test_interrupted_rescore_is_reported(make_test, client, db):
+    test_id = make_test(TRUTH)
+    db.execute("INSERT INTO pi_rescore_runs (test_id, started, status, done, heartbeat) "
+               "VALUES (?, '2024-01-01', 'running', 0, ?)", (test_id, time.time() - predict_it.SCORING_JOB_LEASE - 1))
+    db.commit()
+    run = client.get(f'/admin/rescore/{test_id}/status').get_json()
+    assert run['status'] == 'failed' and 'interrupted' in run['message']
+
+
+def test_a_best_uploaded_during_a_rescore_is_kept(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 2.0, 'b': 2.0})
+    _change_truth(client, login_as, test_id, {'a': 2.0, 'b': 2.0})
+    login_as('alice')
+
+    def upload_midway(done, total, elapsed):
+        # The files have been scored but the new bests are not written yet.
+        upload(test_id, {'a': 2.0, 'b': 2.0, 'extra': 0.0})
+
+    with predict_it.app.app_context():
+        summary = predict_it.rescore_test(test_id, workers=1, progress=upload_midway)
+    assert summary['skipped'] == 1 and summary['rescored'] == 0
+    db.commit()
+    row = db.execute('SELECT log_id FROM pi_submissions').fetchone()
+    latest = db.execute('SELECT MAX(id) AS id FROM pi_submission_log').fetchone()['id']
+    assert row['log_id'] == latest
+
+
+def test_files_of_users_without_a_best_are_not_scored(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    for user, b in (('alice', 2.0), ('bob', 3.0), ('carol', 4.0)):
+        login_as(user)
+        upload(test_id, {'a': 1.0, 'b': b})
+    login_as('admin', admin=True)
+    carol = db.execute("SELECT id FROM pi_submissions WHERE username = 'carol'").fetchone()['id']
+    client.post(f'/admin/delete_submission/{carol}')
+    with predict_it.app.app_context():
+        summary = predict_it.rescore_test(test_id, workers=1)
+    assert summary['files'] == 2 and summary['rescored'] == 2
+    assert set(_scores(db)) == {'alice', 'bob'}
+
+
+def test_users_whose_files_now_fail_stay_indexed(make_test, login_as, upload, client, db):
+    truth = {f'id{i}': float(i % 2) for i in range(200)}
+    test_id = make_test(truth, metric='accuracy')
+    mistakes = {key: (1.0 - value if i % 10 == 0 else value) for i, (key, value) in enumerate(truth.items())}
+    login_as('alice')
+    upload(test_id, mistakes)
+    login_as('bob')
+    upload(test_id, dict(mistakes, extra=1.0))
+    alice = db.execute("SELECT id FROM pi_submissions WHERE username = 'alice'").fetchone()['id']
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_near_duplicates').fetchone()['n'] == 1
+
+    # alice's file has no value for the new ID, so it no longer validates.
+    _change_truth(client, login_as, test_id, dict(truth, extra=1.0), metric='accuracy')
+    with predict_it.app.app_context():
+        summary = predict_it.rescore_test(test_id, workers=1)
+    assert summary['rescored'] == 1 and summary['failed'] == 1
+    db.commit()
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_lsh_buckets WHERE submission_id = ?', (alice,)).fetchone()['n']
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_near_duplicates').fetchone()['n'] == 1
+
+
+def test_a_best_compacted_away_during_a_rescore_is_not_selected(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 2.0})
+    upload(test_id, {'a': 3.0, 'b': 2.0})
+    db.execute("UPDATE pi_submission_log SET timestamp = '2000-01-01T00:00:00' WHERE id = "
+               "(SELECT MAX(id) FROM pi_submission_log)")
+    db.commit()
+    # The second upload becomes the better one, but is old enough to compact.
+    _change_truth(client, login_as, test_id, {'a': 3.0, 'b': 2.0})
+
+    def compact_midway(done, total, elapsed):
+        with predict_it.app.app_context():
+            predict_it.compact_submission_log(predict_it.get_db_wrapper(), retention_days=30)
+
+    with predict_it.app.app_context():
+        summary = predict_it.rescore_test(test_id, workers=1, progress=compact_midway)
+    assert summary['skipped'] == 1
+    db.commit()
+    row = db.execute('SELECT log_id FROM pi_submissions').fetchone()
+    assert db.execute('SELECT id FROM pi_submission_log WHERE id = ?', (row['log_id'],)).fetchone()
+
+
+def test_leaderboard_polls_a_running_rescore_from_the_page_body(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH)
+    login_as('alice')
+    upload(test_id, TRUTH)
+    db.execute("INSERT INTO pi_rescore_runs (test_id, started, status, done, total, heartbeat) "
+               "VALUES (?, '2024-01-01', 'running', 1, 4, ?)", (test_id, time.time()))
+    db.commit()
+    login_as('admin', admin=True)
+    page = client.get(f'/leaderboard/{test_id}').get_data(as_text=True)
+    title = page[page.index('<title>'):page.index('</title>')]
+    assert '<script>' not in title
+    assert page.count('fetch(box.dataset.statusUrl)') == 1
+    assert page.index('fetch(box.dataset.statusUrl)') > page.index('id="rescore-run"')
+    assert '1/4' in page
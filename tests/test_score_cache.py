@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+import app as predict_it
+from conftest import to_csv
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+PREDICTION = {'a': 1.5, 'b': 2.0}
+
+
+def _cache_rows(db):
+    db.commit()
+    return db.execute('SELECT metric, score, error FROM pi_score_cache').fetchall()
+
+
+def _edit(client, test_id, metric, truth=None):
+    data = {'name': 'Test', 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31', 'metric': metric}
+    if truth is not None:
+        data['ground_truth'] = (io.BytesIO(to_csv(truth, 'id,target').encode()), 'truth.csv')
+    client.post(f'/admin/edit_test/{test_id}', data=data, content_type='multipart/form-data')
+
+
+def test_identical_uploads_are_scored_once(make_test, login_as, upload, db, monkeypatch):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, PREDICTION)
+    calls = []
+    monkeypatch.setattr(predict_it, '_score_and_sketch', lambda *args: calls.append(args))
+    login_as('bob')
+    upload(test_id, PREDICTION)
+    assert calls == []
+    scores = db.execute('SELECT username, score FROM pi_submissions ORDER BY username').fetchall()
+    assert [tuple(row) for row in scores] == [('alice', 0.25), ('bob', 0.25)]
+
+
+def test_rejections_are_cached_too(make_test, login_as, upload, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0})
+    rows = _cache_rows(db)
+    assert len(rows) == 1 and rows[0]['score'] is None
+    assert 'missing values' in rows[0]['error']
+
+
+def test_new_metric_or_ground_truth_invalidates_the_cache(make_test, login_as, upload, client, db):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, PREDICTION)
+    login_as('admin', admin=True)
+    _edit(client, test_id, 'mae')
+    assert len(_cache_rows(db)) == 1  # nothing that affects scores changed
+    _edit(client, test_id, 'rmse')
+    assert _cache_rows(db) == []
+
+    login_as('bob')
+    upload(test_id, PREDICTION)
+    rows = _cache_rows(db)
+    assert [row['metric'] for row in rows] == ['rmse']
+    assert rows[0]['score'] == pytest.approx(0.125 ** 0.5)
+    login_as('admin', admin=True)
+    _edit(client, test_id, 'rmse', truth={'a': 1.5, 'b': 2.0})
+    assert _cache_rows(db) == []
+    login_as('carol')
+    upload(test_id, PREDICTION)
+    score = db.execute("SELECT score FROM pi_submissions WHERE username = 'carol'").fetchone()['score']
+    assert score == 0.0
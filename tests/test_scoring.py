@@ -0,0 +1,168 @@
+import io
+import math
+import random
+
+import pytest
+
+import app as predict_it
+from conftest import to_csv
+
+
+def _truth_and_prediction(n, seed=0, binary=False):
+    rng = random.Random(seed)
+    if binary:
+        truth = {f'id{i}': float(rng.random() < 0.3) for i in range(n)}
+        # Probabilities rounded to 2 decimals, so there are plenty of ties.
+        prediction = [(key, round(min(max(value * 0.6 + rng.random() * 0.4, 0.0), 1.0), 2))
+                      for key, value in truth.items()]
+    else:
+        truth = {f'id{i}': round(rng.gauss(10.0, 3.0), 4) for i in range(n)}
+        prediction = [(key, round(value + rng.gauss(0.0, 1.0), 4)) for key, value in truth.items()]
+    rng.shuffle(prediction)
+    return truth, prediction
+
+
+@pytest.mark.parametrize('metric', sorted(predict_it.SCORING_METRICS))
+def test_numpy_and_pure_python_scores_agree(metric, monkeypatch):
+    truth, prediction = _truth_and_prediction(500, binary=predict_it.SCORING_METRICS[metric].kind == 'binary')
+    vectorized = predict_it.calculate_score(to_csv(prediction), to_csv(truth, 'id,target'), metric)
+    monkeypatch.setattr(predict_it, 'HAS_NUMPY', False)
+    pure = predict_it.calculate_score(to_csv(prediction), to_csv(truth, 'id,target'), metric)
+    assert vectorized[1] is None and pure[1] is None
+    assert vectorized[0] == pytest.approx(pure[0], rel=1e-12)
+
+
+def test_known_scores():
+    truth = to_csv({'a': 1, 'b': 2, 'c': 3, 'd': 4}, 'id,target')
+    prediction = to_csv({'d': 4, 'c': 1, 'b': 2, 'a': 2})
+    assert predict_it.calculate_score(prediction, truth, 'accuracy') == (0.5, None)
+    assert predict_it.calculate_score(prediction, truth, 'mae') == (0.75, None)
+    score, error = predict_it.calculate_score(prediction, truth, 'rmse')
+    assert error is None and score == pytest.approx(math.sqrt(5 / 4))
+
+
+def test_accuracy_rounds_half_to_even_like_python():
+    truth = to_csv({'a': 2, 'b': 3}, 'id,target')
+    prediction = to_csv({'a': 2.5, 'b': 2.5})
+    assert predict_it.calculate_score(prediction, truth, 'accuracy') == (0.5, None)
+
+
+def test_prediction_rows_are_aligned_by_id():
+    truth = predict_it.GroundTruth({'a': 1.0, 'b': 2.0})
+    # Unknown IDs are ignored and a repeated ID keeps its last value.
+    lines = to_csv([('b', 9.0), ('zzz', 5.0), ('a', 1.0), ('b', 2.0)]).splitlines(keepends=True)
+    assert predict_it._score_stream(lines, truth, 'mae') == (0.0, None)
+
+
+def test_missing_ids_are_reported():
+    truth = predict_it.GroundTruth({'a': 1.0, 'b': 2.0, 'c': 3.0})
+    score, error = predict_it._score_stream(to_csv({'a': 1.0}).splitlines(keepends=True), truth, 'mae')
+    assert score is None
+    assert 'missing values for 2 of 3 IDs' in error
+
+
+@pytest.mark.parametrize('body, message', [
+    ('id\n1\n', 'at least two columns'),
+    ('id,prediction\na,oops\n', "row 2: 'oops' is not a number"),
+    ('id,prediction\n', 'no data rows'),
+])
+def test_malformed_predictions_raise(body, message):
+    truth = predict_it.GroundTruth({'a': 1.0})
+    with pytest.raises(ValueError, match=message):
+        predict_it._score_stream(body.splitlines(keepends=True), truth, 'mae')
+
+
+def test_upload_that_is_not_utf8_is_rejected(make_test, login_as, upload, client, db):
+    test_id = make_test({'a': 1.0})
+    login_as('alice')
+    upload(test_id, b'id,prediction\na,1\xff\n')
+    with client.session_transaction() as session:
+        assert 'valid UTF-8' in session['_flashes'][-1][1]
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submissions').fetchone()['n'] == 0
+
+
+def _score(metric, prediction, truth):
+    return predict_it.calculate_score(to_csv(prediction), to_csv(truth, 'id,target'), metric)
+
+
+def _pairwise_auc(prediction, truth):
+    positives = [prediction[key] for key, value in truth.items() if value == 1]
+    negatives = [prediction[key] for key, value in truth.items() if value == 0]
+    wins = sum(1.0 if p > n else 0.5 if p == n else 0.0 for p in positives for n in negatives)
+    return wins / (len(positives) * len(negatives))
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_roc_auc_matches_the_pairwise_definition_with_ties(use_numpy, monkeypatch):
+    monkeypatch.setattr(predict_it, 'HAS_NUMPY', use_numpy)
+    truth, prediction = _truth_and_prediction(300, seed=3, binary=True)
+    score, error = _score('roc_auc', dict(prediction), truth)
+    assert error is None
+    assert score == pytest.approx(_pairwise_auc(dict(prediction), truth), rel=1e-12)
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_other_registered_metrics_match_their_definitions(use_numpy, monkeypatch):
+    monkeypatch.setattr(predict_it, 'HAS_NUMPY', use_numpy)
+    truth = {'a': 2.0, 'b': 4.0, 'c': 6.0, 'd': 8.0}
+    prediction = {'a': 3.0, 'b': 4.0, 'c': 5.0, 'd': 10.0}
+    assert _score('r2', prediction, truth)[0] == pytest.approx(1 - 6 / 20)
+    assert _score('mape', prediction, truth)[0] == pytest.approx((1 / 2 + 0 + 1 / 6 + 2 / 8) / 4)
+    labels = {'a': 1.0, 'b': 0.0, 'c': 1.0, 'd': 1.0}
+    probabilities = {'a': 0.9, 'b': 0.2, 'c': 0.4, 'd': 1.0}
+    expected = -(math.log(0.9) + math.log(0.8) + math.log(0.4) + math.log(1 - 1e-15)) / 4
+    assert _score('log_loss', probabilities, labels)[0] == pytest.approx(expected)
+    # Rounded: predicted positives a, d; actual positives a, c, d.
+    assert _score('f1', probabilities, labels)[0] == pytest.approx(2 * 2 / (2 + 3))
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('metric, truth, message', [
+    ('mape', {'a': 0.0, 'b': 1.0}, 'MAPE is undefined'),
+    ('r2', {'a': 1.0, 'b': 1.0}, 'R² is undefined'),
+    ('roc_auc', {'a': 1.0, 'b': 1.0}, 'needs both 0 and 1'),
+    ('roc_auc', {'a': 1.0, 'b': 2.0}, 'values of 0 or 1'),
+    ('log_loss', {'a': 0.5, 'b': 1.0}, 'values of 0 or 1'),
+])
+def test_metrics_reject_ground_truth_they_cannot_score(use_numpy, metric, truth, message, monkeypatch):
+    monkeypatch.setattr(predict_it, 'HAS_NUMPY', use_numpy)
+    score, error = _score(metric, {'a': 0.5, 'b': 0.5}, truth)
+    assert score is None and message in error
+
+
+def test_binary_metrics_refuse_ground_truth_other_than_0_or_1(make_test, client, db):
+    assert make_test({'a': 0.0, 'b': 2.0}, metric='log_loss') is None
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1][1] == 'Log loss needs ground truth values of 0 or 1.'
+
+    test_id = make_test({'a': 0.0, 'b': 2.0}, metric='mae')
+    response = client.post(f'/admin/edit_test/{test_id}', data={
+        'name': 'Test', 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31', 'metric': 'f1'})
+    assert response.headers['Location'].endswith(f'/admin/edit_test/{test_id}')
+    assert db.execute('SELECT metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()['metric'] == 'mae'
+
+    response = client.post(f'/admin/edit_test/{test_id}', data={
+        'name': 'Test', 'description': '', 'start_date': '2024-01-01', 'end_date': '2099-12-31',
+        'metric': 'roc_auc', 'ground_truth': (io.BytesIO(b'id,target\na,0\nb,1\n'), 'truth.csv')},
+        content_type='multipart/form-data')
+    assert response.headers['Location'].endswith('/admin')
+    assert db.execute('SELECT metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()['metric'] == 'roc_auc'
+
+
+def test_metric_select_shows_each_description(make_test, client):
+    make_test({'a': 1.0})
+    page = client.get('/admin').get_data(as_text=True)
+    for metric in predict_it.SCORING_METRICS.values():
+        assert f'{metric.label} - {metric.description}' in page
+
+
+def test_unknown_metrics_are_reported():
+    assert _score('nope', {'a': 1.0}, {'a': 1.0}) == (None, "Unknown metric 'nope'.")
+
+
+def test_every_metric_declares_its_direction():
+    for name, entry in predict_it.SCORING_METRICS.items():
+        assert entry.name == name
+        assert entry.kind in ('label', 'value', 'binary')
+        assert predict_it._lower_is_better(name) is entry.lower_is_better
+    assert predict_it._is_better_score(0.1, 0.2, 'rmse') and predict_it._is_better_score(0.9, 0.8, 'roc_auc')
@@ -0,0 +1,53 @@
+import os
+import stat
+import threading
+
+import pytest
+
+import app as predict_it
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX file ownership')
+
+
+def test_key_is_created_private_and_reused(tmp_path):
+    path = tmp_path / 'instance' / 'secret_key'
+    key = predict_it._shared_secret_key(str(path))
+    assert len(key) == 64
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) & 0o077 == 0
+    assert predict_it._shared_secret_key(str(path)) == key
+
+
+def test_concurrent_workers_agree_on_one_key(tmp_path):
+    path = str(tmp_path / 'secret_key')
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(predict_it._shared_secret_key(path)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(keys) == 8 and len(set(keys)) == 1
+
+
+def test_a_key_others_can_read_is_refused(tmp_path):
+    path = tmp_path / 'secret_key'
+    path.write_text('planted')
+    os.chmod(path, 0o644)
+    with pytest.raises(RuntimeError, match='mode 0600'):
+        predict_it._shared_secret_key(str(path))
+
+
+def test_a_symlinked_key_is_refused(tmp_path):
+    target = tmp_path / 'elsewhere'
+    target.write_text('planted')
+    os.chmod(target, 0o600)
+    os.symlink(target, tmp_path / 'secret_key')
+    with pytest.raises(RuntimeError, match='Refusing'):
+        predict_it._shared_secret_key(str(tmp_path / 'secret_key'))
+
+
+def test_hash_password_command_prints_a_usable_hash():
+    result = predict_it.app.test_cli_runner().invoke(args=['hash-password'], input='s3cret\ns3cret\n')
+    assert result.exit_code == 0
+    assert predict_it.check_password_hash(result.output.strip().splitlines()[-1], 's3cret')
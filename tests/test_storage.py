@@ -0,0 +1,102 @@
+import io
+import random
+
+import app as predict_it
+
+
+class _ChunkCountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.largest_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.largest_read = max(self.largest_read, len(data))
+        return data
+
+
+def _csv_bytes(rows, seed=0):
+    rng = random.Random(seed)
+    return ('id,prediction\n' + ''.join(f'id{i},{rng.random():.6f}\n' for i in range(rows))).encode()
+
+
+def test_stored_uploads_are_compressed_in_chunks(db):
+    raw = _csv_bytes(50_000)
+    assert len(raw) > 4 * predict_it.UPLOAD_READ_CHUNK
+    stream = _ChunkCountingStream(raw)
+    predict_it._store_blob(db, 'digest', len(raw), lambda: stream)
+    assert stream.largest_read <= predict_it.UPLOAD_READ_CHUNK
+    blob = db.execute("SELECT size, codec, data, content FROM pi_blobs WHERE hash = 'digest'").fetchone()
+    assert blob['codec'] == predict_it.STORAGE_CODEC
+    assert len(blob['data']) < len(raw)
+    assert predict_it._blob_text(blob) == raw.decode()
+
+
+def test_incompressible_files_are_stored_as_is():
+    raw = b'id,p\n1,2\n'
+    codec, data = predict_it._compress_stream(io.BytesIO(raw), len(raw))
+    assert (codec, data) == ('none', raw)
+    assert predict_it._decompress(codec, data) == raw.decode()
+
+
+def test_stream_and_text_compression_read_back_the_same(monkeypatch):
+    raw = _csv_bytes(2_000)
+    monkeypatch.setattr(predict_it, 'STORAGE_CODEC', 'zlib')
+    streamed = predict_it._compress_stream(io.BytesIO(raw), len(raw))
+    whole = predict_it._compress(raw.decode())
+    assert streamed[0] == whole[0] == 'zlib'
+    assert predict_it._decompress(*streamed) == predict_it._decompress(*whole) == raw.decode()
+
+
+def test_identical_uploads_are_stored_once(make_test, login_as, upload, client, db):
+    test_id = make_test({'a': 1.0, 'b': 2.0})
+    for user in ('alice', 'bob'):
+        login_as(user)
+        upload(test_id, {'a': 1.0, 'b': 2.5})
+    rows = db.execute('SELECT id, content_hash, filesize FROM pi_submissions ORDER BY id').fetchall()
+    assert rows[0]['content_hash'] == rows[1]['content_hash']
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 1
+
+    login_as('admin', admin=True)
+    response = client.get(f"/submission/{rows[0]['id']}/download")
+    assert response.data == b'id,prediction\na,1.0\nb,2.5\n'
+    assert len(response.data) == rows[0]['filesize']
+
+
+def test_blobs_are_released_once_nothing_references_them(make_test, login_as, upload, client, db):
+    test_id = make_test({'a': 1.0, 'b': 2.0})
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 2.5})
+    login_as('bob')
+    upload(test_id, {'a': 1.0, 'b': 2.5})
+    alice = db.execute("SELECT id FROM pi_submissions WHERE username = 'alice'").fetchone()['id']
+    bob = db.execute("SELECT id FROM pi_submissions WHERE username = 'bob'").fetchone()['id']
+
+    login_as('admin', admin=True)
+    client.post(f'/admin/delete_submission/{alice}')
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 1
+    client.post(f'/admin/delete_submission/{bob}')
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 0
+
+
+def test_exact_copies_are_grouped_on_the_leaderboard(make_test, login_as, upload, db):
+    test_id = make_test({'a': 1.0, 'b': 2.0})
+    for user, b in (('alice', 2.5), ('bob', 2.5), ('carol', 2.25)):
+        login_as(user)
+        upload(test_id, {'a': 1.0, 'b': b})
+    test = db.execute('SELECT id, metric FROM pi_tests WHERE id = ?', (test_id,)).fetchone()
+    entries = predict_it._leaderboard_rows(db, test)
+    groups = predict_it._find_duplicate_content_groups(db, test, entries)
+    by_user = {entry['username']: groups.get(entry['id']) for entry in entries}
+    assert by_user == {'alice': 'A', 'bob': 'A', 'carol': None}
+
+
+def test_compression_migration_converts_stored_files_quietly(db, capsys):
+    text = _csv_bytes(2_000).decode()
+    db.execute("INSERT INTO pi_blobs (hash, size, content) VALUES ('legacy', ?, ?)", (len(text), text))
+    predict_it._migration_compress_storage(db)
+    db.commit()
+    blob = db.execute("SELECT codec, data, content FROM pi_blobs WHERE hash = 'legacy'").fetchone()
+    assert blob['codec'] == predict_it.STORAGE_CODEC and blob['content'] == ''
+    assert predict_it._blob_text(blob) == text
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,59 @@
+import app as predict_it
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+
+
+def _upload_history(make_test, login_as, upload, db):
+    """alice: a good upload, then two worse ones; all but the newest are old."""
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    for error in (0.0, 1.0, 2.0):
+        upload(test_id, {'a': 1.0 + error, 'b': 2.0})
+    ids = [row['id'] for row in db.execute('SELECT id FROM pi_submission_log ORDER BY id')]
+    db.execute("UPDATE pi_submission_log SET timestamp = '2000-01-01T00:00:00' WHERE id IN (?, ?)",
+               (ids[0], ids[1]))
+    db.commit()
+    return test_id, ids
+
+
+def test_compaction_keeps_bests_and_recent_entries(make_test, login_as, upload, db):
+    _, ids = _upload_history(make_test, login_as, upload, db)
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 3
+
+    assert predict_it.compact_submission_log(db, retention_days=30) == (1, 1)
+    assert [row['id'] for row in db.execute('SELECT id FROM pi_submission_log ORDER BY id')] == [ids[0], ids[2]]
+    assert db.execute('SELECT log_id FROM pi_submissions').fetchone()['log_id'] == ids[0]
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 2
+    assert predict_it.compact_submission_log(db, retention_days=30) == (0, 0)
+
+
+def test_compaction_is_off_without_retention(make_test, login_as, upload, db):
+    _upload_history(make_test, login_as, upload, db)
+    assert predict_it.compact_submission_log(db) == (0, 0)
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 3
+
+
+def test_compact_log_command(make_test, login_as, upload, db):
+    _upload_history(make_test, login_as, upload, db)
+    runner = predict_it.app.test_cli_runner()
+    assert runner.invoke(args=['compact-log']).exit_code != 0
+    result = runner.invoke(args=['compact-log', '--retention-days', '30'])
+    assert result.exit_code == 0
+    assert result.output == 'Removed 1 log entries and 1 stored files.\n'
+
+
+def test_deleting_a_submission_frees_the_users_history(make_test, login_as, upload, client, db):
+    test_id, _ = _upload_history(make_test, login_as, upload, db)
+    login_as('bob')
+    upload(test_id, TRUTH)
+    alice = db.execute("SELECT id FROM pi_submissions WHERE username = 'alice'").fetchone()['id']
+
+    login_as('admin', admin=True)
+    client.post(f'/admin/delete_submission/{alice}')
+    assert [row['username'] for row in db.execute('SELECT username FROM pi_submission_log')] == ['bob']
+    # alice's first upload was the same file as bob's, which is still used.
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 1
+
+    client.post(f'/admin/delete_all_submissions/{test_id}')
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_submission_log').fetchone()['n'] == 0
+    assert db.execute('SELECT COUNT(*) AS n FROM pi_blobs').fetchone()['n'] == 0
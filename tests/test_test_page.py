@@ -0,0 +1,41 @@
+import re
+
+import app as predict_it
+
+TRUTH = {'a': 1.0, 'b': 2.0}
+
+
+def _scores(page):
+    return re.findall(r'<td>(\d+\.\d{4})( <strong>\(best\)</strong>)?</td>', page)
+
+
+def test_history_pages_through_every_upload(make_test, login_as, upload, client, monkeypatch):
+    monkeypatch.setattr(predict_it, 'SUBMISSIONS_PAGE_SIZE', 2)
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    for error in (0.5, 0.1, 0.3):
+        upload(test_id, {'a': 1.0 + error, 'b': 2.0})
+    page = client.get(f'/test/{test_id}').get_data(as_text=True)
+    assert _scores(page) == [('0.1500', ''), ('0.0500', ' <strong>(best)</strong>')]
+    cursor = re.search(r'before=([^"]+)"', page).group(1)
+    older = client.get(f'/test/{test_id}?before={cursor}').get_data(as_text=True)
+    assert _scores(older) == [('0.2500', '')]
+    assert 'Older &raquo;' not in older
+
+
+def test_history_is_not_served_stale_from_the_page_cache(make_test, login_as, upload, client):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, {'a': 1.0, 'b': 2.0})
+    assert len(_scores(client.get(f'/test/{test_id}').get_data(as_text=True))) == 1
+    # A worse upload leaves the best untouched but still joins the history.
+    upload(test_id, {'a': 2.0, 'b': 2.0})
+    assert len(_scores(client.get(f'/test/{test_id}').get_data(as_text=True))) == 2
+
+
+def test_history_is_private(make_test, login_as, upload, client):
+    test_id = make_test(TRUTH, metric='mae')
+    login_as('alice')
+    upload(test_id, TRUTH)
+    login_as('bob')
+    assert _scores(client.get(f'/test/{test_id}').get_data(as_text=True)) == []